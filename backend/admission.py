@@ -0,0 +1,298 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+from jose import JWTError, jwt
+from auth import ALGORITHM, SECRET_KEY
+from cache import LRUCache
+import metrics
+
+load_dotenv()
+
+# Lower runs first when calls queue for a provider
+INTERACTIVE, ANALYSIS, BULK = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", ANALYSIS: "analysis", BULK: "bulk"}
+
+# Per caller (token subject, else client address); 0 disables rate limiting
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "10"))
+# Most tokens one request can be charged (a 200-file batch by default); larger costs are capped here
+RATE_LIMIT_MAX_COST = int(os.getenv("RATE_LIMIT_MAX_COST", "200"))
+RATE_LIMIT_TRACKED_CALLERS = 10000
+
+# Concurrent calls per provider, e.g. "gemini=8,openai=8,assemblyai=16"; others get the default
+DEFAULT_PROVIDER_CONCURRENCY = int(os.getenv("DEFAULT_PROVIDER_CONCURRENCY", "8"))
+PROVIDER_CONCURRENCY = {
+    name.strip(): int(limit)
+    for name, _, limit in (item.partition("=") for item in os.getenv("PROVIDER_CONCURRENCY", "").split(","))
+    if name.strip() and limit.strip()
+}
+# Calls allowed to wait per provider, and how long; beyond that callers get a 429
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "60"))
+
+# Set by the endpoint; copied onto worker threads with the rest of the request context
+priority = contextvars.ContextVar("admission_priority", default=BULK)
+
+
+class Overloaded(RuntimeError):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def too_busy(e: Overloaded) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e),
+                         headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+
+
+class TokenBuckets:
+    """One token bucket per caller: ``rate`` tokens per second, holding at most ``burst``.
+
+    A request costing more than the burst is admitted from a full bucket and
+    leaves it in debt, so it is still charged its full cost.
+    """
+
+    def __init__(self, rate: float, burst: int, max_cost: int = RATE_LIMIT_MAX_COST):
+        self.rate = rate
+        self.burst = burst
+        self.max_cost = max(max_cost, burst)
+        # A bucket left alone this long is full again, even from the deepest debt, so idle callers can be forgotten
+        self._buckets = LRUCache(RATE_LIMIT_TRACKED_CALLERS, (burst + self.max_cost) / rate + 1 if rate > 0 else 1)
+        self._lock = threading.Lock()
+
+    def _tokens(self, caller: str, now: float) -> float:
+        tokens, updated = self._buckets.get(caller) or (self.burst, now)
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def take(self, caller: str, cost: int = 1) -> float:
+        """Spend ``cost`` tokens; returns 0 when admitted, else seconds until they would be available."""
+        if self.rate <= 0:
+            return 0
+        cost = min(cost, self.max_cost)
+        # Large requests wait for a full bucket, not for a balance the bucket can never hold
+        needed = min(cost, self.burst)
+        with self._lock:
+            now = time.monotonic()
+            tokens = self._tokens(caller, now)
+            if tokens >= needed:
+                self._buckets.set(caller, (tokens - cost, now))
+                return 0
+            self._buckets.set(caller, (tokens, now))
+            return (needed - tokens) / self.rate
+
+    def charge(self, caller: str, cost: int):
+        # Spend tokens for work found after admission (files inside an archive); may leave the bucket in debt
+        if self.rate <= 0 or cost <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._buckets.set(caller, (max(self._tokens(caller, now) - cost, -self.max_cost), now))
+
+
+class _Waiter:
+    def __init__(self, weight: int, loop=None):
+        self.weight = weight
+        self.loop = loop
+        self.granted = False
+        self.signal = loop.create_future() if loop is not None else threading.Event()
+
+    def grant(self):
+        self.granted = True
+        if self.loop is None:
+            self.signal.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.signal)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class PriorityLimiter:
+    """Concurrency cap for one provider; queued calls are served by priority, then arrival.
+
+    Usable from worker threads (``slot``) and the event loop (``aslot``).
+    Freed capacity is handed straight to the next waiter, so a new call cannot
+    overtake the queue.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int = ADMISSION_MAX_QUEUE,
+                 max_wait: float = ADMISSION_MAX_WAIT_SECONDS):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_use = 0
+        self._queue = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        # Moving average of how long a call holds its slot, for Retry-After estimates
+        self._hold_seconds = 1.0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._queue)
+
+    @property
+    def full(self) -> bool:
+        return len(self._queue) >= self.max_queue
+
+    def retry_after(self) -> float:
+        # Time for everyone already queued (and this caller) to get a slot
+        return (len(self._queue) + 1) / self.limit * self._hold_seconds
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "in_use": self.in_use, "waiting": self.waiting,
+                "hold_seconds": round(self._hold_seconds, 3)}
+
+    def _enter(self, waiter: _Waiter, level: int) -> bool:
+        # Lock held. True if the slot was taken at once, else the waiter is queued
+        if not self._queue and self.in_use + waiter.weight <= self.limit:
+            self.in_use += waiter.weight
+            metrics.PROVIDER_SLOTS_IN_USE.labels(self.name).set(self.in_use)
+            return True
+        if len(self._queue) >= self.max_queue:
+            metrics.ADMISSION_REJECTED.labels("queue_full").inc()
+            raise Overloaded(f"{self.name} queue is full", self.retry_after())
+        heapq.heappush(self._queue, (level, next(self._seq), waiter))
+        metrics.ADMISSION_QUEUE_DEPTH.labels(self.name, PRIORITY_NAMES[level]).inc()
+        return False
+
+    def _grant_waiting(self):
+        # Lock held. Strict order: a heavy waiter at the head is not skipped for lighter ones
+        while self._queue and self.in_use + self._queue[0][2].weight <= self.limit:
+            level, _, waiter = heapq.heappop(self._queue)
+            metrics.ADMISSION_QUEUE_DEPTH.labels(self.name, PRIORITY_NAMES[level]).dec()
+            self.in_use += waiter.weight
+            waiter.grant()
+        metrics.PROVIDER_SLOTS_IN_USE.labels(self.name).set(self.in_use)
+
+    def _abandon(self, waiter: _Waiter, level: int) -> bool:
+        """Leave the queue after a timeout or cancellation; True if the slot was granted meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+            heapq.heapify(self._queue)
+            metrics.ADMISSION_QUEUE_DEPTH.labels(self.name, PRIORITY_NAMES[level]).dec()
+            return False
+
+    def _release(self, weight: int, held: float = None):
+        with self._lock:
+            self.in_use -= weight
+            if held is not None:
+                self._hold_seconds = 0.9 * self._hold_seconds + 0.1 * held
+            self._grant_waiting()
+
+    def _timed_out(self) -> Overloaded:
+        metrics.ADMISSION_REJECTED.labels("wait_timeout").inc()
+        return Overloaded(f"Timed out waiting for {self.name} capacity", self.retry_after())
+
+    @contextmanager
+    def slot(self, weight: int = 1):
+        level = priority.get()
+        waiter = _Waiter(min(weight, self.limit))
+        started = time.perf_counter()
+        with self._lock:
+            acquired = self._enter(waiter, level)
+        if not acquired and not waiter.signal.wait(self.max_wait) and not self._abandon(waiter, level):
+            raise self._timed_out()
+        held = time.perf_counter()
+        metrics.ADMISSION_WAIT_SECONDS.labels(self.name, PRIORITY_NAMES[level]).observe(held - started)
+        try:
+            yield
+        finally:
+            self._release(waiter.weight, time.perf_counter() - held)
+
+    @asynccontextmanager
+    async def aslot(self, weight: int = 1):
+        level = priority.get()
+        waiter = _Waiter(min(weight, self.limit), asyncio.get_running_loop())
+        started = time.perf_counter()
+        with self._lock:
+            acquired = self._enter(waiter, level)
+        if not acquired:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.signal), self.max_wait)
+            except asyncio.TimeoutError:
+                if not self._abandon(waiter, level):
+                    raise self._timed_out()
+            except asyncio.CancelledError:
+                if self._abandon(waiter, level):
+                    self._release(waiter.weight)
+                raise
+        held = time.perf_counter()
+        metrics.ADMISSION_WAIT_SECONDS.labels(self.name, PRIORITY_NAMES[level]).observe(held - started)
+        try:
+            yield
+        finally:
+            self._release(waiter.weight, time.perf_counter() - held)
+
+
+buckets = TokenBuckets(RATE_LIMIT_PER_MINUTE / 60, RATE_LIMIT_BURST)
+limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter(provider: str) -> PriorityLimiter:
+    # Shared by every Provider with this name, so the cap is global to the process
+    with _limiters_lock:
+        if provider not in limiters:
+            limiters[provider] = PriorityLimiter(
+                provider, PROVIDER_CONCURRENCY.get(provider, DEFAULT_PROVIDER_CONCURRENCY)
+            )
+        return limiters[provider]
+
+
+def caller_identity(request: Request) -> str:
+    # Signed-in callers are limited per account; everyone else per client address. Behind a reverse
+    # proxy every anonymous caller has the proxy's address and shares one bucket, unless uvicorn runs
+    # with --proxy-headers --forwarded-allow-ips=<proxy> so request.client is the forwarded address.
+    # X-Forwarded-For is not read here: without a trusted proxy in front, any caller could set it
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        try:
+            subject = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+            if subject:
+                return f"user:{subject}"
+        except JWTError:
+            pass
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def admit(request: Request, level: int, stacks=(), cost: int = 1):
+    """Admit a request before any work starts, or raise a 429 with Retry-After.
+
+    ``stacks`` are the provider lists the request will call; it is turned
+    away when every provider of one of them already has a full queue. On
+    success the request's provider calls queue at ``level`` priority.
+    """
+    for providers in stacks:
+        queues = [limiter(provider.name) for provider in providers]
+        if queues and all(queue.full for queue in queues):
+            metrics.ADMISSION_REJECTED.labels("queue_full").inc()
+            raise too_busy(Overloaded("Providers are at capacity, retry later",
+                                      min(queue.retry_after() for queue in queues)))
+    wait = buckets.take(caller_identity(request), cost)
+    if wait:
+        metrics.ADMISSION_REJECTED.labels("rate_limited").inc()
+        raise too_busy(Overloaded("Rate limit exceeded", wait))
+    priority.set(level)
+
+
+def charge(request: Request, cost: int):
+    """Charge an admitted request for extra work it turned out to carry."""
+    buckets.charge(caller_identity(request), cost)
+
+
+def stats() -> dict:
+    return {name: queue.stats() for name, queue in limiters.items()}
@@ -0,0 +1,177 @@
+from datetime import date, datetime, timedelta
+from typing import Optional
+from sqlalchemy import delete, select, tuple_
+from database import SessionLocal
+from models import AnalyticsLanguageDB, AnalyticsPeriodDB, AnalyticsPeriodPatientDB, SoapNoteDB
+
+PERIODS = ("day", "week", "month")
+ALL_TIME = date(1970, 1, 1)
+UNKNOWN_LANGUAGE = "unknown"
+
+
+def period_start(period: str, moment: datetime) -> date:
+    day = moment.date()
+    if period == "day":
+        return day
+    if period == "week":
+        # Weeks start on Monday
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return ALL_TIME
+
+
+def _insert(db):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+
+def _increment(db, model, keys: dict, increments: dict):
+    insert = _insert(db)
+    if insert is not None:
+        # Single-statement upsert, safe under concurrent note inserts
+        stmt = insert(model).values(**keys, **increments)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: getattr(model, name) + stmt.excluded[name] for name in increments},
+        )
+        db.execute(stmt)
+        return
+
+    row = db.get(model, tuple(keys.values()), with_for_update=True)
+    if row is None:
+        db.add(model(**keys, **increments))
+        db.flush()
+    else:
+        for name, value in increments.items():
+            setattr(row, name, getattr(row, name) + value)
+
+
+def _add_patients(db, keys: list) -> dict:
+    """Insert period membership rows; return {(period, period_start): newly added patients}."""
+    added = {}
+    insert = _insert(db)
+    if insert is not None:
+        stmt = insert(AnalyticsPeriodPatientDB).values(keys).on_conflict_do_nothing().returning(
+            AnalyticsPeriodPatientDB.period, AnalyticsPeriodPatientDB.period_start
+        )
+        for period, start in db.execute(stmt):
+            added[(period, start)] = added.get((period, start), 0) + 1
+        return added
+    for key in keys:
+        if db.get(AnalyticsPeriodPatientDB, (key["period"], key["period_start"], key["patient_id"])) is None:
+            db.add(AnalyticsPeriodPatientDB(**key))
+            db.flush()
+            added[(key["period"], key["period_start"])] = added.get((key["period"], key["period_start"]), 0) + 1
+    return added
+
+
+def record_notes(db, notes):
+    """Fold new notes into the rollups; runs inside the caller's transaction.
+
+    Increments are aggregated first, so a batch of notes costs one statement
+    per touched period rather than several per note.
+    """
+    periods, patients, languages = {}, set(), {}
+    for note in notes:
+        created_at = note.created_at or datetime.utcnow()
+        for period in PERIODS + ("all",):
+            start = period_start(period, created_at)
+            counts = periods.setdefault((period, start), {"note_count": 0, "content_chars": 0})
+            counts["note_count"] += 1
+            counts["content_chars"] += len(note.content or "")
+            patients.add((period, start, note.patient_id))
+        language = note.language or UNKNOWN_LANGUAGE
+        languages[language] = languages.get(language, 0) + 1
+    if not periods:
+        return
+
+    added = _add_patients(db, [
+        {"period": period, "period_start": start, "patient_id": patient_id}
+        for period, start, patient_id in sorted(patients)
+    ])
+    for (period, start), counts in sorted(periods.items()):
+        _increment(db, AnalyticsPeriodDB, {"period": period, "period_start": start},
+                   dict(counts, patient_count=added.get((period, start), 0)))
+    for language, count in sorted(languages.items()):
+        _increment(db, AnalyticsLanguageDB, {"language": language}, {"note_count": count})
+
+
+async def get_periods(db, period: str, start: Optional[date] = None, end: Optional[date] = None):
+    query = select(AnalyticsPeriodDB).where(AnalyticsPeriodDB.period == period)
+    if start is not None:
+        query = query.where(AnalyticsPeriodDB.period_start >= period_start(period, datetime.combine(start, datetime.min.time())))
+    if end is not None:
+        query = query.where(AnalyticsPeriodDB.period_start <= end)
+    rows = await db.scalars(query.order_by(AnalyticsPeriodDB.period_start))
+    return [{
+        "period_start": row.period_start,
+        "notes": row.note_count,
+        "patients": row.patient_count,
+        "avg_content_chars": round(row.content_chars / row.note_count, 1) if row.note_count else 0,
+    } for row in rows]
+
+
+async def get_languages(db):
+    rows = await db.scalars(select(AnalyticsLanguageDB).order_by(AnalyticsLanguageDB.note_count.desc()))
+    return [{"language": row.language, "count": row.note_count} for row in rows]
+
+
+async def get_overview(db):
+    now = datetime.utcnow()
+    keys = [(period, period_start(period, now)) for period in PERIODS + ("all",)]
+    rows = await db.scalars(select(AnalyticsPeriodDB).where(
+        tuple_(AnalyticsPeriodDB.period, AnalyticsPeriodDB.period_start).in_(keys)
+    ))
+    found = {row.period: row for row in rows}
+
+    def totals(period: str):
+        row = found.get(period)
+        return {"notes": row.note_count, "patients": row.patient_count} if row else {"notes": 0, "patients": 0}
+
+    return {
+        "all_time": totals("all"),
+        "today": totals("day"),
+        "this_week": totals("week"),
+        "this_month": totals("month"),
+    }
+
+
+async def get_recent_activity(db, limit: int = 5):
+    rows = await db.execute(select(
+        SoapNoteDB.id, SoapNoteDB.patient_id, SoapNoteDB.patient_name, SoapNoteDB.created_at
+    ).order_by(SoapNoteDB.created_at.desc(), SoapNoteDB.id.desc()).limit(limit))
+    return [dict(row._mapping) for row in rows]
+
+
+def rebuild_rollups(batch_size: int = 1000):
+    """Recompute every rollup from soap_notes, e.g. after upgrading an existing database."""
+    db = SessionLocal()
+    try:
+        for model in (AnalyticsPeriodDB, AnalyticsPeriodPatientDB, AnalyticsLanguageDB):
+            db.execute(delete(model))
+        notes = db.query(
+            SoapNoteDB.patient_id, SoapNoteDB.content, SoapNoteDB.language, SoapNoteDB.created_at
+        ).order_by(SoapNoteDB.id).yield_per(batch_size)
+        batch = []
+        for note in notes:
+            batch.append(note)
+            if len(batch) == batch_size:
+                record_notes(db, batch)
+                batch = []
+        record_notes(db, batch)
+        db.commit()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    print("Rebuilding analytics rollups...")
+    rebuild_rollups()
+    print("Analytics rollups rebuilt successfully!")
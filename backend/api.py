@@ -1,25 +1,44 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, WebSocket, Request, Query, Header, Response
+from typing import List
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
+import asyncio
+from starlette.concurrency import run_in_threadpool
 import assemblyai as aai
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
 import os
 from dotenv import load_dotenv
 from sqlalchemy.orm import Session
-from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date
 from pydantic import BaseModel
 from schemas import UserCreate, UserResponse, Token, LoginRequest
-from database import SessionLocal, engine
+from database import SessionLocal, ReadSessionLocal, get_db, get_read_db, pool_stats
 from models import SoapNoteDB, User
-from passlib.context import CryptContext
-from auth import authenticate_user, create_access_token
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-from langchain_google_genai import ChatGoogleGenerativeAI
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+from auth import authenticate_user, create_access_token, get_user_by_email, hash_password_async
+import jobs
+import ingest
+import streaming
+import cache
+import realtime
+import pagination
+import summaries
+import analytics
+import search
+import bulk
+import batches
+import prompt_budget
+import metrics
+import providers
+import preprocess
+import sections
+import similar
+import idempotency
+import uploads
+import admission
+import note_writer
+from typing import Optional
 
 # Load environment variables
 load_dotenv()
@@ -29,12 +48,37 @@ class SoapNoteCreate(BaseModel):
     patient_id: str
     patient_name: str
     content: str
+    language: Optional[str] = None
+    # Usage reported by /transcribe, stored so cost can be compared across templates
+    prompt_version: Optional[str] = None
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    trimmed_tokens: Optional[int] = None
+    transcript: Optional[str] = None
 
     class Config:
         from_attributes = True
 
+async def purge_caches():
+    # Cached transcripts, notes and idempotent responses hold PHI, so expired rows do not wait for a lookup
+    while True:
+        jobs.run_background(cache.purge_expired)
+        await asyncio.sleep(cache.CACHE_PURGE_INTERVAL_SECONDS)
+
+@asynccontextmanager
+async def lifespan(app):
+    purge = asyncio.create_task(purge_caches())
+    try:
+        yield
+    finally:
+        purge.cancel()
+
 # Set up FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+metrics.configure_logging()
+
+# Request ids, request counters and latency histograms for every HTTP route
+app.middleware("http")(metrics.middleware)
 
 # Configure CORS
 app.add_middleware(
@@ -43,345 +87,650 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", metrics.TRACE_HEADER, idempotency.REPLAYED_HEADER, "Location", "Tus-Resumable",
+                    "Upload-Offset", "Upload-Length", "Upload-Expires", "Retry-After"],
 )
 
-# Set up AssemblyAI
-aai.settings.api_key = os.getenv("ASSEMBLYAI_API_KEY")
-transcriber = aai.Transcriber()
-
-# # Set up LangChain with OpenAI
-# llm = ChatOpenAI(
-#     model="gpt-4o",
-#     temperature=0,
-#     api_key=os.getenv("OPENAI_API_KEY")
-# )
-
-llm = ChatGoogleGenerativeAI(
-    model="gemini-1.5-flash-002",
-    temperature=0,
-    api_key=os.getenv("GEMINI_API_KEY")
-)
+# Transcription and LLM providers with deadlines, retries, hedging and fallback (see providers.py)
+transcriber = providers.transcriber
+llm = providers.llm
 
-# SOAP note template
-soap_template = """
-# SOAP Note Template
-
-You are an experienced medical professional tasked with creating a comprehensive and precise SOAP note. Generate a detailed clinical documentation from the provided transcript, adhering to the following structured format:
-
-## Subjective
-• Chief Complaint (if mentioned):
-  - Primary concern with exact duration (days/weeks/months)
-  - Pain scale rating (if applicable, 0-10)
-  - Pattern and timing of symptoms
-• History of Present Illness (if mentioned):
-  - Chronological progression of symptoms
-  - Specific associated symptoms
-  - Precise aggravating and alleviating factors
-  - Previous treatments attempted
-• Past Medical History (if mentioned):
-  - Chronic conditions
-  - Previous surgeries with dates
-  - Relevant hospitalizations
-• Current Medications (if mentioned):
-  - Name (generic and brand)
-  - Exact dosage and frequency
-  - Duration of current regimen
-  - Compliance history
-• Allergies (if mentioned):
-  - Medication allergies with specific reactions
-  - Environmental/food allergies
-  - Severity of reactions
-• Family History (if mentioned):
-  - First-degree relatives' conditions
-  - Age of onset for hereditary conditions
-  - Current status of family members
-• Social History (if mentioned):
-  - Occupation and work environment
-  - Living situation and support system
-  - Detailed habits:
-    ∘ Smoking (packs/day, years)
-    ∘ Alcohol (type, frequency, amount)
-    ∘ Exercise routine
-    ∘ Diet patterns
-• Review of Systems (if mentioned):
-  - Cardiovascular
-  - Respiratory
-  - Gastrointestinal
-  - Musculoskeletal
-  - Neurological
-  - Other pertinent systems
-
-## Objective
-• Vital Signs (if mentioned):
-  - Blood pressure (mmHg)
-  - Heart rate (bpm)
-  - Temperature (°C/°F)
-  - Respiratory rate (breaths/min)
-  - O2 saturation (%)
-  - BMI
-• Physical Examination (if mentioned):
-  - General appearance
-  - Mental status
-  - Detailed cardiovascular exam:
-    ∘ Heart sounds (S1/S2/murmurs)
-    ∘ Peripheral pulses
-    ∘ Edema assessment
-  - Respiratory exam
-  - Abdominal exam
-  - Neurological exam
-  - Skin assessment
-• Laboratory Results (if mentioned):
-  - Complete blood count
-  - Metabolic panel
-  - Cardiac enzymes
-  - Other relevant tests
-• Diagnostic Studies (if mentioned):
-  - ECG findings
-  - Imaging results
-  - Other test results
-
-## Assessment
-• Primary Diagnosis (if mentioned):
-  - Condition name with specificity (e.g., "Essential Hypertension, Stage 2, poorly controlled")
-  - Severity/stage classification with detailed criteria:
-    ∘ Clinical parameters
-    ∘ Risk stratification 
-    ∘ Disease progression indicators
-  - Supporting evidence:
-    ∘ Key symptoms and clinical findings
-    ∘ Relevant test results
-    ∘ Response to previous treatments
-    ∘ Impact on patient's quality of life
-  - Clinical reasoning:
-    ∘ Key findings supporting diagnosis
-    ∘ Risk stratification
-    ∘ Disease progression assessment
-  - Complications:
-    ∘ Current complications
-    ∘ Potential complications
-    ∘ Risk factors
-
-## Differential Diagnosis
-• Primary Differential Diagnoses:
-  - List of potential diagnoses in order of likelihood
-  - For each diagnosis:
-    ∘ ICD-11 code and complete description
-    ∘ Supporting evidence and clinical findings
-    ∘ Key distinguishing features
-    ∘ Required confirmatory tests
-• Secondary Differential Diagnoses:
-  - Additional conditions to consider
-  - Risk factors and predisposing conditions
-  - Required screening or testing
-• Critical "Must-Not-Miss" Diagnoses:
-  - Life-threatening conditions to rule out
-  - Red flag symptoms/signs
-  - Emergency management considerations
-• Diagnostic Approach:
-  - Systematic evaluation strategy
-  - Key diagnostic tests needed
-  - Clinical decision points
-  - Consultation requirements
-
-## Plan
-• Medications (if mentioned):
-  - New prescriptions (name, dose, frequency, duration)
-  - Modified medications
-  - Discontinued medications
-  - Reason for each change
-• Diagnostic Testing (if mentioned):
-  - Ordered tests with rationale
-  - Expected timeframe
-  - Specific instructions
-• Interventions (if mentioned):
-  - Procedures planned
-  - Referrals with urgency level
-  - Specialist consultations
-• Patient Education (if mentioned):
-  - Lifestyle modifications
-  - Warning signs to monitor
-  - Self-management instructions
-• Follow-up (if mentioned):
-  - Next appointment timing
-  - Specific goals for next visit
-  - Conditions for earlier return
-
-## Conclusion
-• Case Summary (if mentioned):
-  - Brief overview of key findings
-  - Main diagnostic considerations
-  - Treatment strategy rationale
-• Prognosis (if mentioned):
-  - Expected outcomes
-  - Recovery timeline
-  - Long-term management needs
-• Quality Metrics (if mentioned):
-  - Care plan compliance
-  - Outcome measures
-  - Documentation completeness
-
----
-
-### Critical Requirements:
-1. Extract information ONLY from the provided transcript: {transcript}
-2. Use standardized medical terminology and approved abbreviations following ICD-10 and SNOMED CT
-3. Document with extreme precision - use specific measurements, values and descriptors
-4. Maintain strict chronological order with clear timestamps for all historical events
-5. Include exact measurements with SI units and reference ranges where applicable
-6. Format using hierarchical bullet points and clear section headers for optimal readability
-7. Emphasize cardiovascular findings with detailed descriptions of heart sounds, rhythms, and circulation
-8. Establish clear connections between symptoms, signs, and diagnostic reasoning
-9. Mark undocumented information as "Not reported in transcript" to ensure transparency
-10. Follow standard medical documentation guidelines per Joint Commission requirements
-11. Include pertinent negatives that help rule out differential diagnoses
-12. Quantify all findings with objective measurements (e.g. pain scale 1-10, ROM in degrees)
-13. Flag urgent/emergent conditions in bold with clear action items
-14. Document patient's understanding, compliance, and barriers to treatment
-15. Include precise time stamps for all critical events, medications, and interventions
-16. Note any cultural or linguistic considerations affecting care
-17. Document all patient education provided and comprehension verified
-18. Include interdisciplinary communication and care coordination details
-19. Note any pending results or follow-up items clearly
-20. Document informed consent discussions and decisions
-
-Note: Maintain absolute objectivity and accuracy. Do not include speculative information or assumptions. If information is not explicitly stated in the transcript, mark it as "Not documented" rather than making clinical assumptions.
-"""
-prompt = PromptTemplate(
-    input_variables=["transcript"],
-    template=soap_template
-)
+# Identical transcriptions, generations and analyses running at the same time share one provider call
+transcription_flights = idempotency.SingleFlight("transcription")
+generation_flights = idempotency.SingleFlight("generation")
+analysis_flights = idempotency.SingleFlight("analysis")
 
-# Database dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Update the patient's rolling summary as soon as a note is stored
+SUMMARY_REFRESH_ON_CREATE = os.getenv("SUMMARY_REFRESH_ON_CREATE", "true").lower() == "true"
+
+def after_notes_committed(notes):
+    # Off the request path: one summary refresh per patient in the batch, one index sync per batch
+    if SUMMARY_REFRESH_ON_CREATE:
+        for patient_id in dict.fromkeys(note["patient_id"] for note in notes):
+            jobs.run_background(summaries.refresh_summary, llm, patient_id)
+    jobs.run_background(similar.index.sync)
+
+# Every route stores notes through this writer; concurrent inserts share one transaction
+note_writes = note_writer.NoteWriter(after_commit=after_notes_committed)
 
 # Register route
 @app.post("/register", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await get_user_by_email(db, user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_password = get_password_hash(user.password)
-    new_user = User(email=user.email, hashed_password=hashed_password)
+    # bcrypt runs on its own executor, off the event loop and the shared threadpool
+    hashed_password = await hash_password_async(user.password)
+    new_user = User(email=user.email, username=user.username, job=user.job, hashed_password=hashed_password)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 # Login route
 @app.post("/login", response_model=Token)
-def login(request: LoginRequest, db: Session = Depends(get_db)):
-    user = authenticate_user(db, request.email, request.password)
+async def login(request: LoginRequest, db: AsyncSession = Depends(get_db)):
+    user = await authenticate_user(db, request.email, request.password)
     if not user:
         raise HTTPException(status_code=400, detail="Invalid email or password")
     access_token = create_access_token(data={"sub": user.email})
     return {"access_token": access_token, "token_type": "bearer"}
 
-@app.post("/transcribe")
-async def transcribe_audio(file: UploadFile = File(...), language: str = 'ar', db: Session = Depends(get_db)):
+# Blocking pipeline stages; these run on worker threads, never on the event loop
+def transcribe_with_report(audio, language: str, audio_digest: Optional[str] = None):
+    """Return ``(transcript, audio_report)``; the report says what preprocessing saved."""
+    # `audio` is the path of a staged upload
+    key = cache.transcript_key(audio_digest or ingest.content_hash(audio), language)
+    cached = cache.transcript_cache.get(key)
+    if cached is not None:
+        return cached, {"preprocessed": False, "reason": "transcript cached"}
+    return transcription_flights.do(key, transcribe_uncached, key, audio, language)
+
+def transcribe_uncached(key: str, audio, language: str):
+    # A call that finished just before this one started has already filled the cache
+    cached = cache.transcript_cache.get(key)
+    if cached is not None:
+        return cached, {"preprocessed": False, "reason": "transcript cached"}
+
+    # Mono 16 kHz audio with the silence trimmed out is what gets uploaded and billed
+    processed, report = None, {"preprocessed": False, "reason": "disabled"}
+    if preprocess.AUDIO_PREPROCESS:
+        with metrics.stage("preprocess"):
+            processed, report = preprocess.preprocess(audio)
     try:
-        # Save the uploaded file temporarily
-        with open("temp_audio.wav", "wb") as buffer:
-            buffer.write(await file.read())
-        
-        # Transcribe the audio
         config = aai.TranscriptionConfig(language_code=language, speech_model=aai.SpeechModel.nano)
-        transcript = transcriber.transcribe("temp_audio.wav", config)
+        with metrics.stage("transcription"):
+            transcript = transcriber.transcribe(processed or audio, config)
+    finally:
+        if processed is not None:
+            ingest.remove_file(processed)
+    # A stubbed transcript raises here, so it is never cached or turned into a note
+    text = providers.real_transcript(transcript)
+    cache.transcript_cache.set(key, text)
+    return text, report
+
+def transcribe_file(audio, language: str) -> str:
+    return transcribe_with_report(audio, language)[0]
+
+def soap_note_cache_key(transcript_text: str, template: Optional[str] = None) -> str:
+    # The template id is the prompt version, so each variant caches separately
+    return cache.soap_note_key(transcript_text, template or prompt_budget.DEFAULT_SOAP_TEMPLATE, llm.model)
+
+def cacheable(model: str) -> bool:
+    # Keys name the primary provider's model; a fallback's note is returned but not cached under it
+    return model == llm.model
+
+def generate_soap_note(transcript_text: str, template: Optional[str] = None):
+    """Return ``(soap_note, usage)``; cache hits report the tokens the call would have used."""
+    prompt_text, usage = prompt_budget.build_soap_prompt(transcript_text, template)
+    key = soap_note_cache_key(transcript_text, template)
+    soap_note = cache.soap_note_cache.get(key)
+    if soap_note is None:
+        soap_note = generation_flights.do(key, generate_uncached, key, prompt_text)
+    return soap_note, prompt_budget.record_output(usage, soap_note)
+
+def generate_uncached(key: str, prompt_text: str) -> str:
+    soap_note = cache.soap_note_cache.get(key)
+    if soap_note is None:
+        with metrics.stage("generation"):
+            message, model = llm.invoke_with_model(prompt_text)
+        soap_note = providers.real_content(message)
+        if cacheable(model):
+            cache.soap_note_cache.set(key, soap_note)
+    return soap_note
+
+def generate_soap_notes(transcripts: list, template: Optional[str] = None) -> list:
+    """Batch variant of generate_soap_note: one ``(note, usage)`` or exception per transcript."""
+    prompts = [prompt_budget.build_soap_prompt(transcript, template) for transcript in transcripts]
+    keys = [soap_note_cache_key(transcript, template) for transcript in transcripts]
+    notes = [cache.soap_note_cache.get(key) for key in keys]
+    missing = [i for i, note in enumerate(notes) if note is None]
+    if missing:
+        with metrics.stage("generation_batch"):
+            generated = llm.batch_with_models(
+                [prompts[i][0] for i in missing],
+                config={"max_concurrency": batches.BATCH_LLM_GROUP_SIZE},
+                return_exceptions=True,
+            )
+        for i, (message, model) in zip(missing, generated):
+            if isinstance(message, Exception):
+                notes[i] = message
+                continue
+            try:
+                notes[i] = providers.real_content(message)
+            except providers.ProviderUnavailable as e:
+                notes[i] = e
+                continue
+            if cacheable(model):
+                cache.soap_note_cache.set(keys[i], notes[i])
+    return [
+        note if isinstance(note, Exception) else (note, prompt_budget.record_output(usage, note))
+        for note, (_, usage) in zip(notes, prompts)
+    ]
+
+def run_transcription_pipeline(audio, language: str, template: Optional[str] = None,
+                               audio_digest: Optional[str] = None):
+    transcript, audio_report = transcribe_with_report(audio, language, audio_digest)
+    soap_note, usage = generate_soap_note(transcript, template)
+    return transcript, soap_note, usage, audio_report
+
+def check_patient(patient_id: Optional[str], patient_name: Optional[str]):
+    if (patient_id is None) != (patient_name is None):
+        raise HTTPException(status_code=400, detail="patient_id and patient_name must be given together")
+
+def save_generated_note(patient_id: str, patient_name: str, language: str, transcript: str, soap_note: str,
+                        usage: dict) -> dict:
+    # Blocking; for worker threads. Async callers await note_writes.awrite directly
+    return note_writes.write(note_writer.note_values(patient_id, patient_name, soap_note, language, transcript, **usage))
+
+def check_template(template: Optional[str]):
+    try:
+        prompt_budget.get_template(template)
+    except prompt_budget.UnknownTemplate as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # Generate SOAP note
-        soap_note = llm.invoke(
-            prompt.format(transcript=transcript.text)
-        )
+@app.get("/prompt-templates")
+async def get_prompt_templates():
+    return prompt_budget.list_templates()
 
-        # Clean up temporary file
-        os.remove("temp_audio.wav")
+@app.post("/transcribe")
+async def transcribe_audio(request: Request, response: Response, file: UploadFile = File(...), language: str = 'ar',
+                           template: Optional[str] = None, patient_id: Optional[str] = None,
+                           patient_name: Optional[str] = None,
+                           idempotency_key: Optional[str] = Header(None, alias=idempotency.IDEMPOTENCY_HEADER)):
+    # With a patient, the note is also stored and its id returned, so the client need not post it back
+    metrics.observe_upload()
+    check_template(template)
+    check_patient(patient_id, patient_name)
+    admission.admit(request, admission.INTERACTIVE, (transcriber.providers, llm.providers))
+    # The computation may outlive this request (a retry with the same key joins it after a disconnect),
+    # so it runs on a temp file of its own rather than the request's upload spool
+    try:
+        audio_path = await ingest.spool_upload(file)
+    except ingest.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    owned = False
+    try:
+        audio_digest = await run_in_threadpool(ingest.content_hash, audio_path)
+
+        async def transcribe():
+            nonlocal owned
+            # From here on the computation removes the file; it starts before this request can be cancelled
+            owned = True
+            try:
+                # Transcribe the audio and generate the SOAP note off the event loop
+                transcript, soap_note, usage, audio_report = await run_in_threadpool(
+                    run_transcription_pipeline, audio_path, language, template, audio_digest
+                )
+            finally:
+                ingest.remove_file(audio_path)
+            result = {"soap_note": soap_note, "sections": sections.parse_note(soap_note),
+                      "usage": usage, "audio": audio_report}
+            if patient_id is not None:
+                note = await note_writes.awrite(note_writer.note_values(
+                    patient_id, patient_name, soap_note, language, transcript, **usage
+                ))
+                result["note"] = {"id": note["id"], "created_at": note["created_at"]}
+            return result
+
+        # A retried upload with the same key gets the stored response instead of a second run
+        fingerprint = cache.sha256_text(audio_digest, language, template or "", patient_id or "", patient_name or "")
+        return await idempotency.replay_or_run("transcribe", idempotency_key, fingerprint, response, transcribe)
+    except HTTPException:
+        raise
+    except admission.Overloaded as e:
+        raise admission.too_busy(e)
+    except providers.ProviderUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise metrics.internal_error(e)
+    finally:
+        # Replayed and coalesced requests never start a computation of their own
+        if not owned:
+            ingest.remove_file(audio_path)
+
+@app.post("/transcribe/stream")
+async def transcribe_audio_stream(request: Request, file: UploadFile = File(...), language: str = 'ar',
+                                  template: Optional[str] = None):
+    metrics.observe_upload()
+    check_template(template)
+    admission.admit(request, admission.INTERACTIVE, (transcriber.providers, llm.providers))
+    # The stream outlives the request's upload spool, so stage the audio first
+    try:
+        audio_path = await ingest.spool_upload(file)
+    except ingest.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    async def events():
+        try:
+            transcript = await run_in_threadpool(transcribe_file, audio_path, language)
+        finally:
+            ingest.remove_file(audio_path)
+        yield streaming.sse_event("transcript", {"text": transcript})
+
+        prompt_text, usage = await run_in_threadpool(prompt_budget.build_soap_prompt, transcript, template)
+        metadata = {"language": language, "transcript": transcript, "usage": usage}
+        key = soap_note_cache_key(transcript, template)
+        cached = await run_in_threadpool(cache.soap_note_cache.get, key)
+        if cached is not None:
+            prompt_budget.record_output(usage, cached)
+            yield streaming.sse_event("done", dict(metadata, text=cached, cached=True))
+            return
+
+        def on_complete(text, model):
+            # Fills usage in place, before the done event that carries it is sent
+            prompt_budget.record_output(usage, text)
+            if text != providers.STUB_RESPONSE and cacheable(model):
+                return run_in_threadpool(cache.soap_note_cache.set, key, text)
+
+        with metrics.stage("generation"):
+            async for event in streaming.stream_llm(llm, prompt_text, metadata, on_complete=on_complete):
+                yield event
+
+    # Also removed after the response, for clients that disconnect before the body is iterated
+    return streaming.sse_response(events(), background=BackgroundTask(ingest.remove_file, audio_path))
+
+async def draft_soap_note(transcript_text: str) -> str:
+    # Drafts are superseded every few seconds, so they bypass the note cache
+    prompt_text, _ = prompt_budget.build_soap_prompt(transcript_text)
+    with metrics.stage("draft"):
+        return (await llm.ainvoke(prompt_text)).content
+
+async def finalize_soap_note(transcript_text: str) -> str:
+    soap_note, _ = await run_in_threadpool(generate_soap_note, transcript_text)
+    return soap_note
+
+@app.websocket("/ws/transcribe")
+async def transcribe_live(websocket: WebSocket):
+    # Binary messages are 16-bit mono PCM frames at STREAMING_SAMPLE_RATE
+    await websocket.accept()
+    # Live dictation is interactive work; its provider calls queue ahead of bulk and analysis
+    admission.priority.set(admission.INTERACTIVE)
+    session = realtime.RealtimeSession(realtime.get_streaming_transcriber(), draft_soap_note)
+    await realtime.serve(
+        websocket, session,
+        finalize=finalize_soap_note,
+    )
+
+@app.post("/transcribe/jobs", status_code=202)
+async def submit_transcription_job(request: Request, file: UploadFile = File(...), language: str = 'ar',
+                                   template: Optional[str] = None, patient_id: Optional[str] = None,
+                                   patient_name: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    metrics.observe_upload()
+    check_template(template)
+    check_patient(patient_id, patient_name)
+    admission.admit(request, admission.INTERACTIVE, (transcriber.providers, llm.providers))
+    # The job outlives the request, so the audio is copied to its own temp file
+    try:
+        audio_path = await ingest.spool_upload(file)
+    except ingest.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        job = await queue_transcription_job(db, audio_path, language, template,
+                                            patient_id=patient_id, patient_name=patient_name)
+    except jobs.JobQueueFull as e:
+        ingest.remove_file(audio_path)
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        ingest.remove_file(audio_path)
+        raise metrics.internal_error(e)
+    return jobs.job_to_dict(job)
+
+async def queue_transcription_job(db: AsyncSession, audio_path: str, language: str, template: Optional[str] = None,
+                                  filename: Optional[str] = None, patient_id: Optional[str] = None,
+                                  patient_name: Optional[str] = None):
+    """Create a job for a staged audio file and queue it; the job removes the file when done.
+
+    With a patient, the job also stores the note and records its id.
+    """
+    job = await jobs.create_job(db, language, filename=filename,
+                                prompt_version=template or prompt_budget.DEFAULT_SOAP_TEMPLATE)
+
+    def save_note(transcript, soap_note, usage):
+        return save_generated_note(patient_id, patient_name, language, transcript, soap_note, usage)["id"]
 
-        return {"soap_note": soap_note.content}
+    try:
+        jobs.submit_job(
+            job.id,
+            transcribe=lambda: transcribe_file(audio_path, language),
+            generate=lambda transcript: generate_soap_note(transcript, template),
+            cleanup=lambda: ingest.remove_file(audio_path),
+            persist=save_note if patient_id is not None else None,
+        )
+    except jobs.JobQueueFull as e:
+        await run_in_threadpool(jobs.fail_job, job.id, str(e))
+        raise
+    return job
+
+@app.get("/transcribe/jobs/{job_id}")
+async def get_transcription_job(job_id: str, wait: float = 0, db: AsyncSession = Depends(get_db)):
+    # Optional long-poll: hold the request until the job finishes or `wait` seconds pass
+    if wait > 0:
+        await jobs.wait_for_job(job_id, min(wait, 60))
+    job = await jobs.get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jobs.job_to_dict(job)
+
+@app.get("/transcribe/jobs/{job_id}/result")
+async def get_transcription_job_result(job_id: str, db: AsyncSession = Depends(get_db)):
+    job = await jobs.get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return {"job_id": job.id, "transcript": job.transcript, "soap_note": job.soap_note,
+            "sections": sections.parse_note(job.soap_note), "usage": jobs.usage_to_dict(job),
+            "note_id": job.note_id}
+
+# Resumable uploads (tus-style): create, append chunks at an offset, query the offset, then finalize
+@app.post("/uploads", status_code=201)
+async def create_upload(response: Response, upload_length: int = Header(..., alias="Upload-Length"),
+                        language: str = 'ar', template: Optional[str] = None, filename: Optional[str] = None,
+                        db: AsyncSession = Depends(get_db)):
+    check_template(template)
+    upload = await uploads.create_upload(db, upload_length, language, filename, template)
+    # Abandoned uploads are cleaned up off the request path
+    jobs.run_background(uploads.purge_expired)
+    response.headers.update(uploads.upload_headers(upload))
+    response.headers["Location"] = f"/uploads/{upload.id}"
+    return uploads.upload_to_dict(upload)
+
+@app.head("/uploads/{upload_id}")
+async def get_upload_offset(upload_id: str, db: AsyncSession = Depends(get_db)):
+    upload = await uploads.get_upload(db, upload_id)
+    return Response(status_code=200, headers=uploads.upload_headers(upload))
+
+@app.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str, response: Response, db: AsyncSession = Depends(get_db)):
+    upload = await uploads.get_upload(db, upload_id)
+    response.headers.update(uploads.upload_headers(upload))
+    return uploads.upload_to_dict(upload)
+
+@app.patch("/uploads/{upload_id}")
+async def append_upload_chunk(upload_id: str, request: Request,
+                              upload_offset: int = Header(..., alias="Upload-Offset"),
+                              upload_checksum: Optional[str] = Header(None, alias="Upload-Checksum"),
+                              db: AsyncSession = Depends(get_db)):
+    if request.headers.get("content-type", "").split(";")[0].strip() != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Content-Type must be application/offset+octet-stream")
+    checksum = uploads.parse_checksum(upload_checksum)
+    upload = await uploads.get_upload(db, upload_id)
+    # The body is written to the staging file as it streams in
+    await uploads.append_chunk(db, upload, upload_offset, request.stream(), checksum)
+    return Response(status_code=204, headers=uploads.upload_headers(upload))
+
+@app.post("/uploads/{upload_id}/finalize", status_code=202)
+async def finalize_upload(upload_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    # Queues the transcription job for a complete upload; repeating the call returns the same job
+    upload = await uploads.get_upload(db, upload_id)
+    if upload.job_id is None:
+        admission.admit(request, admission.INTERACTIVE, (transcriber.providers, llm.providers))
+        if not await uploads.claim_for_finalize(db, upload):
+            upload = await uploads.get_upload(db, upload_id)
+            if upload.job_id is None:
+                raise HTTPException(status_code=409, detail="Upload is being finalized")
+        else:
+            try:
+                job = await queue_transcription_job(db, uploads.staging_path(upload.id), upload.language,
+                                                    upload.prompt_version, upload.filename)
+            except jobs.JobQueueFull as e:
+                # The staged audio is kept, so the client can finalize again once the queue drains
+                await uploads.set_status(db, upload, "uploading")
+                raise HTTPException(status_code=503, detail=str(e))
+            except Exception as e:
+                await uploads.set_status(db, upload, "uploading")
+                raise metrics.internal_error(e)
+            await uploads.set_status(db, upload, "finalized", job.id)
+            return dict(jobs.job_to_dict(job), upload_id=upload.id)
+    job = await jobs.get_job(db, upload.job_id)
+    return dict(jobs.job_to_dict(job), upload_id=upload.id)
+
+@app.delete("/uploads/{upload_id}", status_code=204)
+async def delete_upload(upload_id: str, db: AsyncSession = Depends(get_db)):
+    upload = await uploads.get_upload(db, upload_id)
+    await uploads.delete_upload(db, upload)
+    return Response(status_code=204, headers={"Tus-Resumable": uploads.TUS_VERSION})
+
+@app.post("/transcribe/batch", status_code=202)
+async def submit_transcription_batch(request: Request, files: List[UploadFile] = File(...), language: str = 'ar',
+                                     template: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    metrics.observe_upload()
+    check_template(template)
+    # Many audio files, or a single .zip of them; each becomes one job in the batch
+    if len(files) > batches.BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {batches.BATCH_MAX_FILES} files per batch")
+    # Bulk work spends a token per file and yields provider slots to interactive requests
+    admission.admit(request, admission.BULK, (transcriber.providers, llm.providers), cost=len(files))
+    staged = []
+    try:
+        for upload in files:
+            path = await ingest.spool_upload(upload)
+            if len(files) == 1 and path.lower().endswith(".zip"):
+                try:
+                    staged = await run_in_threadpool(batches.extract_archive, path)
+                finally:
+                    ingest.remove_file(path)
+                # The archive was admitted as one file; the rest of its files are charged now
+                admission.charge(request, len(staged) - 1)
+            else:
+                staged.append((upload.filename, path))
+        if not staged:
+            raise HTTPException(status_code=400, detail="No audio files in upload")
+        batch_id, items = await batches.create_batch(
+            db, language, staged, prompt_version=template or prompt_budget.DEFAULT_SOAP_TEMPLATE,
+        )
+    except (ingest.UploadTooLarge, batches.BatchTooLarge) as e:
+        for _, path in staged:
+            ingest.remove_file(path)
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        for _, path in staged:
+            ingest.remove_file(path)
+        if isinstance(e, HTTPException):
+            raise
+        raise metrics.internal_error(e)
+
+    batches.submit_batch(items, lambda path: transcribe_file(path, language),
+                         lambda transcripts: generate_soap_notes(transcripts, template))
+    return {"batch_id": batch_id, "items": [
+        {"job_id": job_id, "filename": filename} for (job_id, _), (filename, _) in zip(items, staged)
+    ]}
+
+@app.get("/transcribe/batch/{batch_id}")
+async def get_transcription_batch(batch_id: str, include_results: bool = False, db: AsyncSession = Depends(get_db)):
+    rows = await batches.get_batch(db, batch_id)
+    if not rows:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batches.batch_to_dict(batch_id, rows, include_results)
 
 @app.post("/soap-notes/")
-async def create_soap_note(soap_note: SoapNoteCreate, db: Session = Depends(get_db)):
+async def create_soap_note(soap_note: SoapNoteCreate, response: Response,
+                           idempotency_key: Optional[str] = Header(None, alias=idempotency.IDEMPOTENCY_HEADER)):
+    # A retried save with the same key returns the note stored the first time instead of a duplicate
+    fingerprint = cache.sha256_text(soap_note.model_dump_json())
+    return await idempotency.replay_or_run(
+        "soap_notes", idempotency_key, fingerprint, response, lambda: store_soap_note(soap_note)
+    )
+
+async def store_soap_note(soap_note: SoapNoteCreate):
     try:
-        db_soap_note = SoapNoteDB(
-            patient_id=soap_note.patient_id,
-            patient_name=soap_note.patient_name,
-            content=soap_note.content
-        )
-        db.add(db_soap_note)
-        db.commit()
-        db.refresh(db_soap_note)
-        return {
-            "id": db_soap_note.id,
-            "patient_id": db_soap_note.patient_id,
-            "patient_name": db_soap_note.patient_name,
-            "content": db_soap_note.content,
-            "created_at": db_soap_note.created_at
-        }
+        # Queued with concurrent inserts and committed together; returns once this note is durable
+        return await note_writes.awrite(note_writer.note_values(**soap_note.model_dump()))
+    except Exception as e:
+        raise metrics.internal_error(e)
+
+@app.post("/soap-notes/import")
+async def import_soap_notes(request: Request, db: AsyncSession = Depends(get_db)):
+    # Body is NDJSON, one note per line; parsed and inserted as it streams in
+    try:
+        report = await bulk.import_ndjson(db, request.stream())
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise metrics.internal_error(e)
+    if report["inserted"]:
+        jobs.run_background(similar.index.sync)
+    return report
+
+@app.get("/soap-notes/export")
+async def export_soap_notes(format: str = "ndjson", patient_id: Optional[str] = None):
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        bulk.export_notes(format, patient_id),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="soap_notes.{format}"'},
+    )
 
 @app.get("/soap-notes/{patient_id}")
-async def get_soap_notes(patient_id: str, db: Session = Depends(get_db)):
+async def get_soap_notes(patient_id: str, limit: Optional[int] = None, cursor: Optional[str] = None,
+                         fields: Optional[str] = None, format: str = "json", db: AsyncSession = Depends(get_read_db)):
     try:
-        soap_notes = db.query(SoapNoteDB).filter(
-            SoapNoteDB.patient_id == patient_id
-        ).all()
-        
-        return [{
-            "id": note.id,
-            "patient_id": note.patient_id,
-            "patient_name": note.patient_name,
-            "content": note.content,
-            "created_at": note.created_at
-        } for note in soap_notes]
+        return await pagination.list_notes(
+            db, filters=[SoapNoteDB.patient_id == patient_id],
+            fields=fields, limit=limit, cursor=cursor, format=format,
+        )
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise metrics.internal_error(e)
 
 @app.get("/soap-notes/")
-async def get_all_soap_notes(db: Session = Depends(get_db)):
+async def get_all_soap_notes(limit: Optional[int] = None, cursor: Optional[str] = None,
+                             fields: Optional[str] = None, format: str = "json", db: AsyncSession = Depends(get_read_db)):
     try:
-        # Query all soap notes, ordered by creation date (newest first)
-        soap_notes = db.query(SoapNoteDB).order_by(SoapNoteDB.created_at.desc()).all()
-        
-        return [{
-            "id": note.id,
-            "patient_id": note.patient_id,
-            "patient_name": note.patient_name,
-            "content": note.content,
-            "created_at": note.created_at
-        } for note in soap_notes]
+        # Soap notes ordered by creation date (newest first), one keyset page at a time
+        return await pagination.list_notes(db, fields=fields, limit=limit, cursor=cursor, format=format)
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/analyze-patient-case")
-async def analyze_patient_case(patient_identifier: str, search_by: str = "id", db: Session = Depends(get_db)):
+        raise metrics.internal_error(e)
+
+@app.get("/search/soap-notes")
+async def search_soap_notes(q: str, patient_id: Optional[str] = None, limit: int = 20, offset: int = 0,
+                            db: AsyncSession = Depends(get_read_db)):
+    # Ranked full-text search; snippets mark matches with <mark></mark>
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Search query must not be empty")
+    limit = min(max(limit, 1), 100)
     try:
-        # Search by patient ID or name
-        if search_by == "name":
-            soap_notes = db.query(SoapNoteDB).filter(
-                SoapNoteDB.patient_name == patient_identifier
-            ).order_by(SoapNoteDB.created_at.desc()).all()
-        else:
-            soap_notes = db.query(SoapNoteDB).filter(
-                SoapNoteDB.patient_id == patient_identifier
-            ).order_by(SoapNoteDB.created_at.desc()).all()
-
-        if not soap_notes:
-            raise HTTPException(status_code=404, detail="No SOAP notes found for this patient")
-
-        # Combine all SOAP notes into a single text for analysis
-        combined_notes = "\n\n".join([
-            f"Date: {note.created_at}\n{note.content}" 
-            for note in soap_notes
-        ])
+        hits = await search.search_notes(db, q, patient_id=patient_id, limit=limit, offset=max(offset, 0))
+    except Exception as e:
+        raise metrics.internal_error(e)
+    return {"query": q, "limit": limit, "offset": offset, "results": hits}
+
+@app.get("/search/similar")
+async def search_similar_cases(q: str, k: int = 10, db: AsyncSession = Depends(get_read_db)):
+    # Notes closest to free text (e.g. a draft assessment), across all patients
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Search query must not be empty")
+    k = min(max(k, 1), 100)
+    try:
+        hits = await similar.find_similar(db, text=q, k=k, other_patients=False)
+    except Exception as e:
+        raise metrics.internal_error(e)
+    return {"query": q, "k": k, "results": hits}
+
+@app.get("/soap-notes/{note_id}/similar")
+async def get_similar_cases(note_id: int, k: int = 10, other_patients: bool = True,
+                            db: AsyncSession = Depends(get_read_db)):
+    # Nearest notes to a stored note; by default only other patients' cases
+    k = min(max(k, 1), 100)
+    try:
+        hits = await similar.find_similar(db, note_id=note_id, k=k, other_patients=other_patients)
+    except Exception as e:
+        raise metrics.internal_error(e)
+    if hits is None:
+        raise HTTPException(status_code=404, detail="SOAP note not found")
+    return {"note_id": note_id, "k": k, "results": hits}
+
+@app.get("/analytics/overview")
+async def get_analytics_overview(db: AsyncSession = Depends(get_read_db)):
+    return await analytics.get_overview(db)
+
+@app.get("/analytics/notes")
+async def get_analytics_notes(period: str = "day", start: Optional[date] = None, end: Optional[date] = None,
+                              db: AsyncSession = Depends(get_read_db)):
+    # Notes and distinct patients per day, week or month
+    if period not in analytics.PERIODS:
+        raise HTTPException(status_code=400, detail=f"period must be one of {', '.join(analytics.PERIODS)}")
+    return await analytics.get_periods(db, period, start, end)
+
+@app.get("/analytics/languages")
+async def get_analytics_languages(db: AsyncSession = Depends(get_read_db)):
+    return await analytics.get_languages(db)
+
+@app.get("/analytics/recent")
+async def get_analytics_recent(limit: int = 5, db: AsyncSession = Depends(get_read_db)):
+    return await analytics.get_recent_activity(db, min(max(limit, 1), 50))
+
+@app.get("/db/pool-stats")
+async def get_pool_stats():
+    return pool_stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.metrics_response()
+
+@app.get("/providers/stats")
+async def get_provider_stats():
+    # Per-provider call counts, latency percentiles and circuit state
+    return providers.stats()
+
+@app.get("/admission/stats")
+async def get_admission_stats():
+    # Concurrency slots in use and calls waiting, per provider
+    return admission.stats()
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return cache.stats()
+
+def load_patient_notes(db: Session, patient_identifier: str, search_by: str):
+    # Search by patient ID or name
+    if search_by == "name":
+        return db.query(SoapNoteDB).filter(
+            SoapNoteDB.patient_name == patient_identifier
+        ).order_by(SoapNoteDB.created_at.desc()).all()
+    return db.query(SoapNoteDB).filter(
+        SoapNoteDB.patient_id == patient_identifier
+    ).order_by(SoapNoteDB.created_at.desc()).all()
+
+def build_analysis_prompt(soap_notes, summary: Optional[str] = None, note_sections=None) -> str:
+    # Combine the SOAP notes into a single text for analysis
+    combined_notes = "\n\n".join([
+        summaries.format_note(note, note_sections)
+        for note in soap_notes
+    ])
+    if summary:
+        combined_notes = (
+            f"Summary of the patient's history across all visits:\n{summary}\n\n"
+            f"Most recent SOAP Notes:\n{combined_notes}"
+        )
 
-        # Create analysis prompt
-        analysis_prompt = f"""
+    return f"""
         Please analyze the following patient's SOAP notes and provide:
         1. A summary of the patient's medical history
         2. Key findings and patterns across visits
@@ -393,17 +742,102 @@ async def analyze_patient_case(patient_identifier: str, search_by: str = "id", d
         {combined_notes}
         """
 
-        # Get AI analysis
-        analysis = llm.invoke(analysis_prompt)
+def prepare_case_analysis(patient_identifier: str, search_by: str, note_sections=None):
+    """Return ``(prompt, number_of_notes)``, or None when the patient has no notes.
 
-        return {
-            "patient_identifier": patient_identifier,
-            "search_by": search_by,
-            "number_of_notes": len(soap_notes),
-            "analysis": analysis.content
-        }
+    Runs on a worker thread: it may fold new notes into the rolling summary.
+    """
+    db = SessionLocal()
+    try:
+        context = summaries.build_case_context(db, llm, patient_identifier, search_by, note_sections)
+        if context is not None:
+            summary, recent_notes, note_count = context
+            return build_analysis_prompt(recent_notes, summary, note_sections), note_count
+    finally:
+        db.close()
+
+    # Name shared by several patient ids: analyze the newest notes that fit the budget
+    read_db = ReadSessionLocal()
+    try:
+        soap_notes = load_patient_notes(read_db, patient_identifier, search_by)
+    finally:
+        read_db.close()
+    if not soap_notes:
+        return None
+    recent_notes = summaries.trim_notes(soap_notes, summaries.ANALYSIS_TOKEN_BUDGET, note_sections)
+    return build_analysis_prompt(recent_notes, note_sections=note_sections), len(soap_notes)
+
+def check_sections(note_sections: Optional[str]):
+    try:
+        return sections.parse_sections(note_sections)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def run_case_analysis(patient_identifier: str, search_by: str, fields):
+    case = await run_in_threadpool(prepare_case_analysis, patient_identifier, search_by, fields)
+
+    if case is None:
+        raise HTTPException(status_code=404, detail="No SOAP notes found for this patient")
+    analysis_prompt, number_of_notes = case
+
+    # Get AI analysis
+    with metrics.stage("analysis"):
+        analysis = await llm.ainvoke(analysis_prompt)
+
+    return {
+        "patient_identifier": patient_identifier,
+        "search_by": search_by,
+        "number_of_notes": number_of_notes,
+        "analysis": providers.real_content(analysis)
+    }
+
+@app.post("/analyze-patient-case")
+async def analyze_patient_case(request: Request, response: Response, patient_identifier: str, search_by: str = "id",
+                               note_sections: Optional[str] = Query(None, alias="sections"),
+                               idempotency_key: Optional[str] = Header(None, alias=idempotency.IDEMPOTENCY_HEADER)):
+    # `sections=assessment,plan` sends only those parts of each note to the model
+    fields = check_sections(note_sections)
+    admission.admit(request, admission.ANALYSIS, (llm.providers,))
+    # Requests for the same analysis while one is running wait for it instead of calling the model again
+    fingerprint = cache.sha256_text(patient_identifier, search_by, ",".join(fields or ()))
+    try:
+        return await idempotency.replay_or_run(
+            "analyze_patient_case", idempotency_key, fingerprint, response,
+            lambda: analysis_flights.run(
+                fingerprint, lambda: run_case_analysis(patient_identifier, search_by, fields)
+            ),
+        )
+    except HTTPException:
+        raise
+    except admission.Overloaded as e:
+        raise admission.too_busy(e)
+    except providers.ProviderUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise metrics.internal_error(e)
+
+@app.post("/analyze-patient-case/stream")
+async def analyze_patient_case_stream(request: Request, patient_identifier: str, search_by: str = "id",
+                                      note_sections: Optional[str] = Query(None, alias="sections")):
+    fields = check_sections(note_sections)
+    admission.admit(request, admission.ANALYSIS, (llm.providers,))
+    # The prompt is built before streaming starts so a missing patient is still a 404
+    case = await run_in_threadpool(prepare_case_analysis, patient_identifier, search_by, fields)
+    if case is None:
+        raise HTTPException(status_code=404, detail="No SOAP notes found for this patient")
+    analysis_prompt, number_of_notes = case
+
+    metadata = {
+        "patient_identifier": patient_identifier,
+        "search_by": search_by,
+        "number_of_notes": number_of_notes,
+    }
+    async def events():
+        with metrics.stage("analysis"):
+            async for event in streaming.stream_llm(llm, analysis_prompt, metadata):
+                yield event
+
+    return streaming.sse_response(events())
 
 if __name__ == "__main__":
     import uvicorn
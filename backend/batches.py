@@ -0,0 +1,164 @@
+import contextvars
+import os
+import shutil
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from dotenv import load_dotenv
+from sqlalchemy import select
+import ingest
+import jobs
+from models import TranscriptionJobDB
+
+load_dotenv()
+
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "200"))
+# Concurrent provider calls across all batches
+BATCH_TRANSCRIBE_CONCURRENCY = int(os.getenv("BATCH_TRANSCRIBE_CONCURRENCY", "8"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+# Transcripts are sent to the LLM in groups of this size as soon as they are ready
+BATCH_LLM_GROUP_SIZE = int(os.getenv("BATCH_LLM_GROUP_SIZE", "8"))
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".ogg", ".webm", ".flac", ".aac", ".mp4")
+
+transcribe_executor = ThreadPoolExecutor(max_workers=BATCH_TRANSCRIBE_CONCURRENCY, thread_name_prefix="batch-stt")
+# Each worker runs one llm.batch call of up to BATCH_LLM_GROUP_SIZE prompts, so several groups
+# generate at once; the provider limiters cap the calls actually in flight
+generate_executor = ThreadPoolExecutor(max_workers=BATCH_LLM_CONCURRENCY, thread_name_prefix="batch-llm")
+
+
+class BatchTooLarge(Exception):
+    pass
+
+
+def extract_archive(archive_path: str):
+    """Extract the audio members of a zip into temp files; return ``[(filename, path)]``.
+
+    Members are copied in chunks and count against ``MAX_UPLOAD_BYTES`` in total.
+    """
+    items = []
+    total = 0
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            for member in archive.infolist():
+                name = os.path.basename(member.filename)
+                if member.is_dir() or name.startswith(".") or not name.lower().endswith(AUDIO_EXTENSIONS):
+                    continue
+                if len(items) >= BATCH_MAX_FILES:
+                    raise BatchTooLarge(f"Archive has more than {BATCH_MAX_FILES} audio files")
+                total += member.file_size
+                if total > ingest.MAX_UPLOAD_BYTES:
+                    raise ingest.UploadTooLarge(f"Archive exceeds {ingest.MAX_UPLOAD_BYTES} bytes uncompressed")
+                fd, path = ingest.make_temp_file(os.path.splitext(name)[1])
+                items.append((name, path))
+                with archive.open(member) as source, os.fdopen(fd, "wb") as target:
+                    shutil.copyfileobj(source, target, ingest.UPLOAD_CHUNK_SIZE)
+    except BaseException:
+        for _, path in items:
+            ingest.remove_file(path)
+        raise
+    return items
+
+
+async def create_batch(db, language: str, files, prompt_version: str = None) -> tuple:
+    """Create one queued job per ``(filename, path)`` in a single commit."""
+    batch_id = uuid.uuid4().hex
+    rows = [
+        TranscriptionJobDB(id=uuid.uuid4().hex, batch_id=batch_id, filename=filename,
+                           status="queued", language=language, prompt_version=prompt_version)
+        for filename, _ in files
+    ]
+    db.add_all(rows)
+    await db.commit()
+    return batch_id, [(row.id, path) for row, (_, path) in zip(rows, files)]
+
+
+async def get_batch(db, batch_id: str):
+    result = await db.scalars(
+        select(TranscriptionJobDB).where(TranscriptionJobDB.batch_id == batch_id)
+        .order_by(TranscriptionJobDB.created_at, TranscriptionJobDB.filename)
+    )
+    return result.all()
+
+
+def batch_to_dict(batch_id: str, rows, include_results: bool = False) -> dict:
+    counts = {}
+    for row in rows:
+        counts[row.status] = counts.get(row.status, 0) + 1
+    finished = sum(counts.get(status, 0) for status in jobs.FINISHED_STATUSES)
+    return {
+        "batch_id": batch_id,
+        "total": len(rows),
+        "finished": finished,
+        "counts": counts,
+        "items": [jobs.job_to_dict(row, include_result=include_results) for row in rows],
+    }
+
+
+def _transcribe_item(job_id: str, audio_path: str, transcribe):
+    try:
+        jobs.update_job(job_id, status="running", stage="transcription")
+        transcript = transcribe(audio_path)
+        jobs.update_job(job_id, stage="generation", transcript=transcript)
+        return transcript
+    finally:
+        ingest.remove_file(audio_path)
+
+
+def _generate_group(group, generate_many):
+    # group: [(job_id, transcript)]; generate_many returns (note, usage) or an exception per transcript
+    try:
+        results = generate_many([transcript for _, transcript in group])
+    except Exception as e:
+        results = [e] * len(group)
+    for (job_id, _), result in zip(group, results):
+        if isinstance(result, Exception):
+            jobs.fail_job(job_id, str(result))
+        else:
+            soap_note, usage = result
+            jobs.update_job(job_id, status="completed", stage=None, soap_note=soap_note,
+                            finished_at=datetime.utcnow(), **usage)
+
+
+def _submit(executor, fn, *args):
+    # Each item carries the batch request's context (trace id, admission priority) onto its worker
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def run_batch(items, transcribe, generate_many):
+    """Transcribe every item with bounded concurrency and generate notes in LLM batches.
+
+    ``transcribe(path)`` returns a transcript; ``generate_many(transcripts)``
+    returns one ``(note, usage)`` or exception per transcript. Generation for a group
+    starts as soon as its transcripts are ready, so one slow upload only
+    delays its own group.
+    """
+    futures = {
+        _submit(transcribe_executor, _transcribe_item, job_id, path, transcribe): job_id
+        for job_id, path in items
+    }
+    pending, generations = [], []
+    for future in as_completed(futures):
+        job_id = futures[future]
+        try:
+            pending.append((job_id, future.result()))
+        except Exception as e:
+            jobs.fail_job(job_id, str(e))
+        if len(pending) >= BATCH_LLM_GROUP_SIZE:
+            generations.append(_submit(generate_executor, _generate_group, pending, generate_many))
+            pending = []
+    if pending:
+        generations.append(_submit(generate_executor, _generate_group, pending, generate_many))
+    for generation in generations:
+        generation.result()
+
+
+def submit_batch(items, transcribe, generate_many):
+    # The coordinator only waits on the executors, so it gets a lightweight thread of its own
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(run_batch, items, transcribe, generate_many),
+                              name="batch-coordinator", daemon=True)
+    thread.start()
+    return thread
+
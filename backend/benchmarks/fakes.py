@@ -0,0 +1,92 @@
+"""In-process stand-ins for AssemblyAI and the chat model, for offline benchmarks.
+
+Both sleep for a configurable latency and return text of a configurable size,
+so the rest of the stack (uploads, job pool, cache, DB) does real work while
+no provider is called.
+"""
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+VOCABULARY = (
+    "patient reports chest pain for three days worse on exertion denies fever cough shortness of breath "
+    "blood pressure 130 over 85 heart rate 78 takes metformin 500 mg twice daily no known allergies "
+    "plan to order ECG and lipid panel follow up in two weeks"
+).split()
+
+
+def fake_text(words: int, rng: random.Random) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words)) + "."
+
+
+class ProviderError(RuntimeError):
+    pass
+
+
+class FakeTranscriber:
+    """Mimics a transcription provider client: ``transcribe(audio, config)`` raises on failure."""
+
+    def __init__(self, latency: float = 2.0, jitter: float = 0.2, words: int = 600, error_rate: float = 0.0,
+                 seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.words = words
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+
+    def transcribe(self, audio, config=None):
+        time.sleep(max(0.0, self.rng.gauss(self.latency, self.latency * self.jitter)))
+        if self.rng.random() < self.error_rate:
+            raise ProviderError("fake transcription failure")
+        return SimpleNamespace(status="completed", error=None, text=fake_text(self.words, self.rng))
+
+
+class FakeChatModel:
+    """Duck-typed chat model with the ``invoke``/``ainvoke``/``astream``/``batch`` calls the app uses.
+
+    ``latency`` is the time to the full response; streamed tokens are spread
+    evenly across it after ``first_token_latency``.
+    """
+
+    def __init__(self, latency: float = 4.0, first_token_latency: float = 0.5, words: int = 400,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.first_token_latency = first_token_latency
+        self.words = words
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+
+    def _response(self):
+        if self.rng.random() < self.error_rate:
+            raise ProviderError("fake LLM failure")
+        return SimpleNamespace(content=fake_text(self.words, self.rng))
+
+    def invoke(self, prompt, config=None):
+        time.sleep(self.latency)
+        return self._response()
+
+    async def ainvoke(self, prompt, config=None):
+        await asyncio.sleep(self.latency)
+        return self._response()
+
+    async def astream(self, prompt, config=None):
+        await asyncio.sleep(self.first_token_latency)
+        words = self._response().content.split(" ")
+        delay = max(0.0, self.latency - self.first_token_latency) / max(1, len(words))
+        for word in words:
+            await asyncio.sleep(delay)
+            yield SimpleNamespace(content=word + " ")
+
+    def batch(self, prompts, config=None, return_exceptions=False):
+        # Provider batches run concurrently, so one latency covers the whole batch
+        time.sleep(self.latency)
+        results = []
+        for _ in prompts:
+            try:
+                results.append(self._response())
+            except ProviderError as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
@@ -0,0 +1,243 @@
+"""Offline load test: the real app in-process, fake providers and a local SQLite database.
+
+Each scenario runs at increasing concurrency and reports p50/p95/p99 latency,
+throughput and errors. Results are written to a baseline file; pass
+``--compare`` with an earlier baseline to see how p95 moved.
+
+    python benchmarks/load_test.py --scenarios notes_create,notes_list --concurrency 1,8,32
+    python benchmarks/load_test.py --output benchmarks/baseline.json --compare benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+DEFAULT_DATABASE_URL = "sqlite:///./benchmark.db"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,4,16,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=64, help="requests per scenario and level")
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL,
+                        help="defaults to a throwaway local SQLite file")
+    parser.add_argument("--reset", action="store_true",
+                        help="allow dropping every table of a database other than a throwaway SQLite file")
+    parser.add_argument("--transcribe-latency", type=float, default=0.5)
+    parser.add_argument("--transcript-words", type=int, default=600)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--llm-words", type=int, default=400)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake provider calls that fail")
+    parser.add_argument("--audio-bytes", type=int, default=256 * 1024)
+    parser.add_argument("--output", default=os.path.join(BENCHMARK_DIR, "baseline.json"))
+    parser.add_argument("--compare", help="earlier baseline file to diff p95 against")
+    return parser.parse_args()
+
+
+def is_throwaway(database_url: str) -> bool:
+    # The run drops and recreates every table; only the default file, in-memory or temp-dir SQLite is safe
+    from sqlalchemy.engine import make_url
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite":
+        return False
+    if database_url == DEFAULT_DATABASE_URL or url.database in (None, "", ":memory:"):
+        return True
+    return os.path.abspath(url.database).startswith(os.path.join(os.path.realpath(tempfile.gettempdir()), ""))
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Scenarios: setup(client, context) runs once per level, request(client, context, i) is timed
+async def setup_nothing(client, context):
+    pass
+
+
+async def register_login(client, context, i):
+    email = f"bench-{context['run']}-{context['level']}-{i}@example.com"
+    response = await client.post("/register", json={
+        "email": email, "password": "bench-password", "username": email, "job": "benchmark",
+    })
+    if response.status_code != 200:
+        return response
+    return await client.post("/login", json={"email": email, "password": "bench-password"})
+
+
+async def notes_create(client, context, i):
+    return await client.post("/soap-notes/", json={
+        "patient_id": f"bench-{i % 50}", "patient_name": f"Bench Patient {i % 50}",
+        "content": context["note"], "language": "en",
+    })
+
+
+async def setup_notes(client, context):
+    # Enough notes that listings and analysis read real pages
+    if context.get("seeded"):
+        return
+    for i in range(200):
+        await notes_create(client, context, i)
+    context["seeded"] = True
+
+
+async def notes_list(client, context, i):
+    return await client.get(f"/soap-notes/bench-{i % 50}", params={"limit": 20})
+
+
+async def transcribe(client, context, i):
+    # Fresh bytes per request, so the transcript and note caches never hit
+    audio = os.urandom(context["audio_bytes"])
+    return await client.post("/transcribe", params={"language": "en"},
+                             files={"file": ("visit.wav", audio, "audio/wav")})
+
+
+async def analyze(client, context, i):
+    return await client.post("/analyze-patient-case", params={"patient_identifier": f"bench-{i % 50}"})
+
+
+SCENARIOS = {
+    "register_login": (setup_nothing, register_login),
+    "notes_create": (setup_nothing, notes_create),
+    "notes_list": (setup_notes, notes_list),
+    "transcribe": (setup_nothing, transcribe),
+    "analyze": (setup_notes, analyze),
+}
+
+
+async def run_level(client, context, name: str, concurrency: int, total: int) -> dict:
+    setup, request = SCENARIOS[name]
+    context["level"] = concurrency
+    await setup(client, context)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], {}
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await request(client, context, i)
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - started) * 1000)
+            if status != 200:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+    }
+
+
+async def run(args, api) -> list:
+    import httpx
+
+    context = {
+        "run": uuid.uuid4().hex[:8],
+        "audio_bytes": args.audio_bytes,
+        "note": "SUBJECTIVE: chest pain for three days. OBJECTIVE: BP 130/85. ASSESSMENT: stable angina. "
+                "PLAN: ECG, lipid panel, follow up in two weeks.",
+    }
+    transport = httpx.ASGITransport(app=api.app)
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        for name in args.scenarios.split(","):
+            for concurrency in [int(level) for level in args.concurrency.split(",")]:
+                result = await run_level(client, context, name, concurrency, args.requests)
+                print(" ".join(f"{key}={value}" for key, value in result.items()), flush=True)
+                results.append(result)
+    return results
+
+
+def compare(results: list, path: str):
+    with open(path) as f:
+        previous = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+    print(f"\np95 vs {path}:")
+    for result in results:
+        before = previous.get((result["scenario"], result["concurrency"]))
+        if before is None:
+            continue
+        change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0
+        print(f"  {result['scenario']:<16} c={result['concurrency']:<4} "
+              f"{before['p95_ms']:>9.1f} -> {result['p95_ms']:>9.1f} ms ({change:+.1f}%)")
+
+
+def main():
+    args = parse_args()
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    if not args.reset and not is_throwaway(args.database_url):
+        sys.exit("Refusing to drop the tables of --database-url: it is not a throwaway SQLite file; "
+                 "pass --reset if that is really intended")
+
+    # Configure the app before it is imported: local DB, no replica
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.pop("DATABASE_REPLICA_URL", None)
+    # Every simulated user shares one client address; measure the service, not the rate limiter
+    os.environ["RATE_LIMIT_PER_MINUTE"] = "0"
+
+    from benchmarks.fakes import FakeChatModel, FakeTranscriber
+    import logging
+    import api
+    import providers
+    import search
+    from database import Base, engine
+
+    logging.getLogger("soap_note").setLevel(logging.WARNING)
+    # Fakes go behind the same retry/breaker/fallback layer as the real providers
+    api.transcriber = providers.ResilientTranscriber([providers.Provider("fake_transcription", FakeTranscriber(
+        args.transcribe_latency, words=args.transcript_words, error_rate=args.error_rate))])
+    api.llm = providers.ResilientLLM([providers.Provider("fake_llm", FakeChatModel(
+        args.llm_latency, words=args.llm_words, error_rate=args.error_rate))])
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    search.ensure_search_index(engine)
+
+    results = asyncio.run(run(args, api))
+
+    if args.compare and os.path.exists(args.compare):
+        compare(results, args.compare)
+    baseline = {
+        "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(baseline, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
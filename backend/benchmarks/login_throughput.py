@@ -0,0 +1,84 @@
+"""Login throughput: bcrypt on the shared threadpool vs. the dedicated bcrypt executor.
+
+Fires a burst of password verifications while a stream of cheap "other route"
+calls runs on the shared AnyIO threadpool, and reports login throughput plus
+the latency those other calls see.
+
+    python benchmarks/login_throughput.py --logins 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite:///./benchmark.db")
+
+from starlette.concurrency import run_in_threadpool
+import auth
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def other_route_work():
+    # Stand-in for a cheap sync route body
+    return sum(range(1000))
+
+
+async def run(mode: str, logins: int, concurrency: int, hashed: str) -> dict:
+    if mode == "shared":
+        async def verify():
+            return await run_in_threadpool(auth.verify_password, "secret-password", hashed)
+    else:
+        async def verify():
+            return await auth.verify_password_async("secret-password", hashed)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    other_latencies = []
+    done = asyncio.Event()
+
+    async def login():
+        async with semaphore:
+            await verify()
+
+    async def other_routes():
+        while not done.is_set():
+            started = time.perf_counter()
+            await run_in_threadpool(other_route_work)
+            other_latencies.append((time.perf_counter() - started) * 1000)
+            await asyncio.sleep(0.005)
+
+    probe = asyncio.create_task(other_routes())
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await probe
+
+    return {
+        "mode": mode,
+        "logins_per_sec": round(logins / elapsed, 1),
+        "other_route_p50_ms": round(statistics.median(other_latencies), 2),
+        "other_route_p99_ms": round(percentile(other_latencies, 99), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    hashed = auth.get_password_hash("secret-password")
+    for mode in ("shared", "dedicated"):
+        result = asyncio.run(run(mode, args.logins, args.concurrency, hashed))
+        print(" ".join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import csv
+import io
+import json
+import os
+import orjson
+from datetime import datetime
+from typing import Optional
+from dotenv import load_dotenv
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert, select
+import analytics
+import sections
+from database import AsyncReadSessionLocal
+from models import SoapNoteDB
+
+load_dotenv()
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# Per-batch cap on reported line errors so a bad file cannot blow up the report
+MAX_ERRORS_PER_BATCH = 20
+
+EXPORT_FIELDS = ("id", "patient_id", "patient_name", "content", "language", "created_at")
+
+
+class SoapNoteImport(BaseModel):
+    patient_id: str
+    patient_name: str
+    content: str
+    language: Optional[str] = None
+    # Historical notes keep their original timestamp
+    created_at: Optional[datetime] = None
+
+
+async def iter_lines(chunks):
+    """Split a byte stream into lines without buffering more than one partial line."""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+async def _insert_batch(db, notes: list):
+    # One multi-row INSERT plus the matching rollup increments, in one transaction
+    try:
+        await db.execute(insert(SoapNoteDB), [
+            dict(note.model_dump(), **sections.section_columns(note.content)) for note in notes
+        ])
+        await db.run_sync(analytics.record_notes, notes)
+        await db.commit()
+        return None
+    except Exception as e:
+        await db.rollback()
+        return str(e)
+
+
+async def import_ndjson(db, chunks, batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    """Insert notes from an NDJSON byte stream in batches and report per-batch results."""
+    batches = []
+    rows, errors, first_line = [], [], 1
+    total_inserted = total_failed = 0
+
+    async def flush(last_line: int):
+        nonlocal rows, errors, first_line, total_inserted, total_failed
+        report = {"batch": len(batches) + 1, "first_line": first_line, "last_line": last_line,
+                  "inserted": 0, "failed": len(errors), "errors": errors[:MAX_ERRORS_PER_BATCH]}
+        if rows:
+            error = await _insert_batch(db, rows)
+            if error is None:
+                report["inserted"] = len(rows)
+            else:
+                report["failed"] += len(rows)
+                report["errors"].append({"line": None, "error": f"Batch insert failed: {error}"})
+        total_inserted += report["inserted"]
+        total_failed += report["failed"]
+        batches.append(report)
+        rows, errors, first_line = [], [], last_line + 1
+
+    line_number = 0
+    async for line in iter_lines(chunks):
+        line_number += 1
+        if line.strip():
+            try:
+                note = SoapNoteImport(**json.loads(line))
+                note.created_at = note.created_at or datetime.utcnow()
+                rows.append(note)
+            except (ValueError, TypeError, ValidationError) as e:
+                errors.append({"line": line_number, "error": str(e)})
+        if len(rows) + len(errors) >= batch_size:
+            await flush(line_number)
+    if rows or errors:
+        await flush(line_number)
+
+    return {"inserted": total_inserted, "failed": total_failed, "lines": line_number, "batches": batches}
+
+
+def _csv_rows(rows, header: bool):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        writer.writerow(["" if value is None else value for value in row])
+    return buffer.getvalue()
+
+
+async def export_notes(format: str = "ndjson", patient_id: Optional[str] = None):
+    """Yield notes as NDJSON or CSV, oldest first, through a server-side cursor.
+
+    Opens its own read session because the response streams after the
+    request's dependencies have been torn down.
+    """
+    columns = [getattr(SoapNoteDB, name) for name in EXPORT_FIELDS]
+    query = select(*columns).order_by(SoapNoteDB.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    if patient_id:
+        query = query.where(SoapNoteDB.patient_id == patient_id)
+
+    async with AsyncReadSessionLocal() as db:
+        result = await db.stream(query)
+        header = True
+        async for partition in result.partitions():
+            if format == "csv":
+                yield _csv_rows(partition, header)
+                header = False
+            else:
+                yield b"".join(orjson.dumps(dict(zip(EXPORT_FIELDS, row))) + b"\n" for row in partition)
+        if format == "csv" and header:
+            yield _csv_rows([], header)
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+from database import SessionLocal
+from models import CacheEntryDB
+
+load_dotenv()
+
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "512"))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Expired rows (transcripts, notes, idempotent responses) are deleted this often, not only when looked up again
+CACHE_PURGE_INTERVAL_SECONDS = float(os.getenv("CACHE_PURGE_INTERVAL_SECONDS", "3600"))
+
+
+def sha256_text(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        # Separator so ("ab", "c") and ("a", "bc") hash differently
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ContentCache:
+    """Two-tier cache: an in-process LRU in front of the ``cache_entries`` table."""
+
+    def __init__(self, namespace: str, maxsize: int = CACHE_MAX_ENTRIES, ttl: int = CACHE_TTL_SECONDS):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize, ttl)
+        self.counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "writes": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, key: str):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+
+        db = SessionLocal()
+        try:
+            entry = db.query(CacheEntryDB).filter(
+                CacheEntryDB.namespace == self.namespace,
+                CacheEntryDB.key == key,
+            ).first()
+            if entry is not None and entry.expires_at is not None and entry.expires_at < datetime.utcnow():
+                db.delete(entry)
+                db.commit()
+                entry = None
+        finally:
+            db.close()
+
+        if entry is None:
+            self._count("misses")
+            return None
+        self._count("db_hits")
+        self.memory.set(key, entry.value)
+        return entry.value
+
+    def set(self, key: str, value: str):
+        self.memory.set(key, value)
+        self._count("writes")
+        db = SessionLocal()
+        try:
+            db.merge(CacheEntryDB(
+                namespace=self.namespace,
+                key=key,
+                value=value,
+                created_at=datetime.utcnow(),
+                expires_at=datetime.utcnow() + timedelta(seconds=self.ttl),
+            ))
+            db.commit()
+        except IntegrityError:
+            # Another worker stored the same key first; its value is equivalent
+            db.rollback()
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters["memory_hits"] + counters["db_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["db_hits"]
+        return dict(
+            counters,
+            memory_entries=len(self.memory),
+            hit_ratio=round(hits / lookups, 4) if lookups else None,
+        )
+
+
+# Level 1: audio content hash + language -> transcript
+transcript_cache = ContentCache("transcript")
+# Level 2: transcript + prompt version + model -> SOAP note
+soap_note_cache = ContentCache("soap_note")
+
+
+def transcript_key(audio_digest: str, language: str) -> str:
+    return sha256_text(audio_digest, language)
+
+
+def soap_note_key(transcript: str, prompt_version: str, model: str) -> str:
+    return sha256_text(transcript, prompt_version, model)
+
+
+def purge_expired() -> int:
+    """Delete expired ``cache_entries`` rows in every namespace; returns how many were removed."""
+    db = SessionLocal()
+    try:
+        result = db.execute(delete(CacheEntryDB).where(CacheEntryDB.expires_at < datetime.utcnow()))
+        db.commit()
+        return result.rowcount
+    finally:
+        db.close()
+
+
+def stats() -> dict:
+    return {
+        "transcript": transcript_cache.stats(),
+        "soap_note": soap_note_cache.stats(),
+    }
@@ -0,0 +1,32 @@
+import os
+import tempfile
+import pytest
+
+# Tests run against a throwaway SQLite database and local stand-ins for every external provider.
+# Set before any backend module is imported, so load_dotenv() never points them at a real deployment
+TEST_DIR = tempfile.mkdtemp(prefix="soap-tests-")
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}",
+    LLM_PROVIDERS="stub",
+    TRANSCRIPTION_PROVIDERS="stub",
+    RATE_LIMIT_PER_MINUTE="0",
+    AUDIO_PREPROCESS="false",
+    UPLOAD_DIR=TEST_DIR,
+    SIMILAR_INDEX_DIR=os.path.join(TEST_DIR, "similar_index"),
+)
+
+from database import Base, engine  # noqa: E402
+import models  # noqa: E402,F401
+import search  # noqa: E402
+
+Base.metadata.create_all(bind=engine)
+search.ensure_search_index(engine)
+
+
+@pytest.fixture
+def clean_db():
+    # Every table starts empty; the FTS triggers clear the search index along with the notes
+    with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+    yield
@@ -1,4 +1,6 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -8,17 +10,125 @@ load_dotenv()
 
 # Get database URL from environment variable
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Optional read replica for read-only endpoints; falls back to the primary
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
 
-# Create SQLAlchemy engine with SSL requirements
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={
-        "sslmode": "require"
-    }
-)
+# Connection pool settings
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Recycle before the managed Postgres / load balancer drops idle connections
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+DB_SSLMODE = os.getenv("DB_SSLMODE", "require")
 
-# Create SessionLocal class
+# Async drivers for each sync driver we deploy with
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+}
+
+def make_async_url(url: str):
+    # asyncpg takes `ssl` instead of libpq's `sslmode`, which is passed in connect_args below
+    parsed = make_url(url)
+    query = {key: value for key, value in parsed.query.items() if key != "sslmode"}
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername), query=query)
+
+def connect_args(url, is_async: bool = False) -> dict:
+    backend = make_url(url).get_backend_name()
+    if backend != "postgresql":
+        return {}
+    if is_async:
+        args = {"timeout": DB_CONNECT_TIMEOUT}
+        if DB_SSLMODE != "disable":
+            args["ssl"] = DB_SSLMODE
+        return args
+    return {"sslmode": DB_SSLMODE, "connect_timeout": DB_CONNECT_TIMEOUT}
+
+def pool_options(url) -> dict:
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+# Physical connects and checkouts per engine, to spot connection storms
+pool_counters = {}
+
+def _track_pool(name: str, sync_engine):
+    counters = pool_counters.setdefault(name, {"connects": 0, "checkouts": 0, "invalidated": 0})
+
+    @event.listens_for(sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        counters["connects"] += 1
+
+    @event.listens_for(sync_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        counters["checkouts"] += 1
+
+    @event.listens_for(sync_engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        counters["invalidated"] += 1
+
+def make_engine(url):
+    return create_engine(url, connect_args=connect_args(url), **pool_options(url))
+
+def make_async_engine(url, async_url=None):
+    async_url = async_url or make_async_url(url)
+    return create_async_engine(async_url, connect_args=connect_args(url, is_async=True), **pool_options(url))
+
+# Create SQLAlchemy engines: sync for worker threads and scripts, async for request handlers
+engine = make_engine(DATABASE_URL)
+async_engine = make_async_engine(DATABASE_URL, os.getenv("ASYNC_DATABASE_URL"))
+_track_pool("primary", engine)
+_track_pool("primary_async", async_engine.sync_engine)
+
+if DATABASE_REPLICA_URL:
+    read_engine = make_engine(DATABASE_REPLICA_URL)
+    async_read_engine = make_async_engine(DATABASE_REPLICA_URL, os.getenv("ASYNC_DATABASE_REPLICA_URL"))
+    _track_pool("replica", read_engine)
+    _track_pool("replica_async", async_read_engine.sync_engine)
+else:
+    read_engine = engine
+    async_read_engine = async_engine
+
+# Create SessionLocal class; used by worker threads and scripts
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# Async sessions for FastAPI routes
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# Database dependency
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Read-only dependency, routed to the replica when one is configured
+async def get_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+def pool_stats() -> dict:
+    engines = {"primary": engine, "primary_async": async_engine.sync_engine}
+    if DATABASE_REPLICA_URL:
+        engines.update(replica=read_engine, replica_async=async_read_engine.sync_engine)
+    stats = {}
+    for name, sync_engine in engines.items():
+        pool = sync_engine.pool
+        stats[name] = dict(
+            pool_counters.get(name, {}),
+            status=pool.status(),
+            size=getattr(pool, "size", lambda: None)(),
+            checked_in=getattr(pool, "checkedin", lambda: None)(),
+            checked_out=getattr(pool, "checkedout", lambda: None)(),
+            overflow=getattr(pool, "overflow", lambda: None)(),
+        )
+    return stats
 
 # Create Base class
-Base = declarative_base() 
\ No newline at end of file
+Base = declarative_base()
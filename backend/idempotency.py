@@ -0,0 +1,100 @@
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import Future
+from dotenv import load_dotenv
+from fastapi import HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+import cache
+import metrics
+
+load_dotenv()
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+# How long a stored response is replayed for a repeated key
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+MAX_KEY_LENGTH = 255
+
+# Stored responses live in cache_entries next to the transcript and SOAP note caches
+responses = cache.ContentCache("idempotency", ttl=IDEMPOTENCY_TTL_SECONDS)
+
+
+class SingleFlight:
+    """Coalesce identical in-flight calls in this process onto one computation.
+
+    ``do`` is for worker threads, ``run`` for the event loop; callers that find
+    the key already running wait for that call's result (or its exception).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn, *args):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            metrics.COALESCED_CALLS.labels(self.name).inc()
+            return future.result()
+        try:
+            result = fn(*args)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def run(self, key: str, factory):
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(factory())
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            metrics.COALESCED_CALLS.labels(self.name).inc()
+        # Shielded: a caller that disconnects must not cancel the computation the others share
+        return await asyncio.shield(task)
+
+
+flights = SingleFlight("idempotent_request")
+
+
+async def replay_or_run(route: str, idempotency_key, fingerprint: str, response: Response, compute):
+    """Return the stored response for a repeated key, else run ``compute()`` once and store it.
+
+    ``fingerprint`` identifies the request body; reusing a key for a different
+    request is a 422. Only successful responses are stored, so failures can be retried.
+    """
+    if idempotency_key is None:
+        return await compute()
+    if not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400,
+                            detail=f"{IDEMPOTENCY_HEADER} must be 1-{MAX_KEY_LENGTH} characters")
+    key = cache.sha256_text(route, idempotency_key)
+    stored = await run_in_threadpool(responses.get, key)
+    if stored is None:
+        async def compute_and_store():
+            body = jsonable_encoder(await compute())
+            await run_in_threadpool(responses.set, key, json.dumps({"fingerprint": fingerprint, "body": body}))
+            return {"fingerprint": fingerprint, "body": body, "replayed": False}
+        result = await flights.run(key, compute_and_store)
+    else:
+        result = dict(json.loads(stored), replayed=True)
+
+    if result["fingerprint"] != fingerprint:
+        raise HTTPException(status_code=422,
+                            detail=f"{IDEMPOTENCY_HEADER} was already used for a different request")
+    if result["replayed"]:
+        metrics.IDEMPOTENT_REPLAYS.labels(route).inc()
+        response.headers[REPLAYED_HEADER] = "true"
+    return result["body"]
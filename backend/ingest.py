@@ -0,0 +1,78 @@
+import hashlib
+import os
+import tempfile
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Upload limits
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_DIR = os.getenv("UPLOAD_DIR") or tempfile.gettempdir()
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def upload_suffix(file: UploadFile) -> str:
+    _, ext = os.path.splitext(file.filename or "")
+    return ext if ext else ".wav"
+
+
+def make_temp_file(suffix: str):
+    # Unique per request, so concurrent uploads never share a file
+    return tempfile.mkstemp(prefix="soap_audio_", suffix=suffix, dir=UPLOAD_DIR)
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def spool_upload(file: UploadFile) -> str:
+    """Copy an upload chunk by chunk into a unique temp file and return its path.
+
+    At most one chunk is held in memory. The file is removed if the copy fails
+    or the upload exceeds ``MAX_UPLOAD_BYTES``.
+    """
+    fd, path = make_temp_file(upload_suffix(file))
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            written = 0
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > MAX_UPLOAD_BYTES:
+                    raise UploadTooLarge(f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+                await run_in_threadpool(buffer.write, chunk)
+        return path
+    except BaseException:
+        remove_file(path)
+        raise
+
+
+def _hash_chunks(raw, limit: int) -> str:
+    digest = hashlib.sha256()
+    total = 0
+    while True:
+        chunk = raw.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > limit:
+            raise UploadTooLarge(f"Upload exceeds {limit} bytes")
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_hash(path: str) -> str:
+    # SHA-256 of a staged file, read in chunks
+    with open(path, "rb") as f:
+        return _hash_chunks(f, MAX_UPLOAD_BYTES)
@@ -1,5 +1,8 @@
+import sys
+from sqlalchemy import inspect, text
 from database import engine, Base
 from models import SoapNoteDB
+import search
 
 def init_db():
     print("Creating database tables...")
@@ -7,9 +10,35 @@ def init_db():
         # This will create all tables that inherit from Base
         Base.metadata.drop_all(bind=engine)  # First drop all tables to ensure clean state
         Base.metadata.create_all(bind=engine)
+        search.ensure_search_index(engine)
         print("Database tables created successfully!")
     except Exception as e:
         print(f"Error creating database tables: {str(e)}")
 
+def upgrade_db():
+    # Non-destructive: adds missing tables, nullable columns and indexes to an existing database
+    print("Upgrading database schema...")
+    try:
+        Base.metadata.create_all(bind=engine)
+        inspector = inspect(engine)
+        with engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                existing = {column["name"] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing:
+                        column_type = column.type.compile(dialect=engine.dialect)
+                        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                        print(f"Added column {table.name}.{column.name}")
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+        search.ensure_search_index(engine)
+        print("Database schema upgraded successfully!")
+    except Exception as e:
+        print(f"Error upgrading database schema: {str(e)}")
+
 if __name__ == "__main__":
-    init_db() 
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "upgrade":
+        upgrade_db()
+    else:
+        init_db()
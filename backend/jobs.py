@@ -0,0 +1,190 @@
+import asyncio
+import contextvars
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from dotenv import load_dotenv
+import admission
+from database import SessionLocal
+from models import TranscriptionJobDB
+
+load_dotenv()
+
+# Worker pool settings
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "64"))
+# Fire-and-forget maintenance (summary refreshes, index syncs, purges) gets its own small pool
+BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", "2"))
+
+FINISHED_STATUSES = ("completed", "failed")
+
+# Transcription jobs only; short blocking calls from request handlers use Starlette's threadpool
+executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="soap-job")
+background_executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix="soap-background")
+
+# Caps queued + running jobs so a burst of uploads cannot grow the queue without bound
+_slots = threading.BoundedSemaphore(JOB_QUEUE_LIMIT)
+
+# Long-poll waiters: job id -> list of (event loop, future)
+_waiters = {}
+_waiters_lock = threading.Lock()
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+async def create_job(db, language: str, batch_id: str = None, filename: str = None,
+                     prompt_version: str = None) -> TranscriptionJobDB:
+    job = TranscriptionJobDB(id=uuid.uuid4().hex, status="queued", language=language,
+                             batch_id=batch_id, filename=filename, prompt_version=prompt_version)
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+
+async def get_job(db, job_id: str):
+    return await db.get(TranscriptionJobDB, job_id, populate_existing=True)
+
+
+def job_to_dict(job: TranscriptionJobDB, include_result: bool = False) -> dict:
+    data = {
+        "job_id": job.id,
+        "batch_id": job.batch_id,
+        "filename": job.filename,
+        "status": job.status,
+        "stage": job.stage,
+        "language": job.language,
+        "prompt_version": job.prompt_version,
+        "error": job.error,
+        "note_id": job.note_id,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+        "finished_at": job.finished_at,
+    }
+    if include_result:
+        data["transcript"] = job.transcript
+        data["soap_note"] = job.soap_note
+        data["usage"] = usage_to_dict(job)
+    return data
+
+
+def usage_to_dict(row) -> dict:
+    return {
+        "prompt_version": row.prompt_version,
+        "input_tokens": row.input_tokens,
+        "output_tokens": row.output_tokens,
+        "trimmed_tokens": row.trimmed_tokens,
+    }
+
+
+def update_job(job_id: str, **fields):
+    db = SessionLocal()
+    try:
+        db.query(TranscriptionJobDB).filter(TranscriptionJobDB.id == job_id).update(
+            dict(fields, updated_at=datetime.utcnow())
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def fail_job(job_id: str, error: str):
+    update_job(job_id, status="failed", error=error, finished_at=datetime.utcnow())
+
+
+def _is_finished(job_id: str) -> bool:
+    db = SessionLocal()
+    try:
+        job = db.get(TranscriptionJobDB, job_id)
+        return job is None or job.status in FINISHED_STATUSES
+    finally:
+        db.close()
+
+
+def _notify(job_id: str):
+    with _waiters_lock:
+        waiters = _waiters.pop(job_id, [])
+    for loop, future in waiters:
+        loop.call_soon_threadsafe(_resolve, future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _run_job(job_id: str, transcribe, generate, cleanup=None, persist=None):
+    try:
+        update_job(job_id, status="running", stage="transcription")
+        transcript = transcribe()
+
+        update_job(job_id, stage="generation", transcript=transcript)
+        soap_note, usage = generate(transcript)
+
+        note_id = None
+        if persist is not None:
+            update_job(job_id, stage="saving")
+            note_id = persist(transcript, soap_note, usage)
+
+        update_job(job_id, status="completed", stage=None, soap_note=soap_note, note_id=note_id,
+                    finished_at=datetime.utcnow(), **usage)
+    except Exception as e:
+        fail_job(job_id, str(e))
+    finally:
+        if cleanup is not None:
+            cleanup()
+        _slots.release()
+        _notify(job_id)
+
+
+def submit_job(job_id: str, transcribe, generate, cleanup=None, persist=None):
+    """Queue a job on the worker pool.
+
+    ``transcribe()`` returns the transcript text and ``generate(transcript)``
+    returns ``(soap_note, usage)``; both run on a worker thread, never on the event loop.
+    ``persist(transcript, soap_note, usage)``, when given, stores the note and returns its id.
+    """
+    if not _slots.acquire(blocking=False):
+        raise JobQueueFull("Too many transcription jobs in progress")
+    return _submit(executor, _run_job, job_id, transcribe, generate, cleanup, persist)
+
+
+def _submit(pool, fn, *args):
+    # Carry the caller's context (trace id, admission priority) onto the worker thread
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _run_at_bulk_priority(fn, *args):
+    admission.priority.set(admission.BULK)
+    return fn(*args)
+
+
+def run_background(fn, *args):
+    # Fire-and-forget work that should not hold up the response; its provider calls queue behind requests
+    return _submit(background_executor, _run_at_bulk_priority, fn, *args)
+
+
+async def wait_for_job(job_id: str, timeout: float):
+    """Wait until the job finishes or ``timeout`` seconds pass, without holding a thread."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    with _waiters_lock:
+        _waiters.setdefault(job_id, []).append((loop, future))
+
+    # The job may have finished before the waiter was registered
+    if await asyncio.to_thread(_is_finished, job_id):
+        _resolve(future)
+
+    try:
+        await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        with _waiters_lock:
+            waiters = _waiters.get(job_id, [])
+            if (loop, future) in waiters:
+                waiters.remove((loop, future))
+            if not waiters:
+                _waiters.pop(job_id, None)
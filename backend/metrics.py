@@ -0,0 +1,141 @@
+import contextvars
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+TRACE_HEADER = "X-Request-ID"
+
+# Seconds; provider calls on long recordings run well past the client defaults
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120, 300)
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ["method", "route", "status"])
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time to response start by route",
+                            ["method", "route"], buckets=LATENCY_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being handled")
+STAGE_SECONDS = Histogram("pipeline_stage_duration_seconds", "Time spent per pipeline stage",
+                          ["stage"], buckets=LATENCY_BUCKETS)
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Database statement time by operation",
+                             ["operation"], buckets=LATENCY_BUCKETS)
+AUDIO_BYTES_SAVED = Counter("audio_preprocess_bytes_saved_total", "Upload bytes saved by audio preprocessing")
+AUDIO_SECONDS_SAVED = Counter("audio_preprocess_seconds_saved_total", "Audio seconds trimmed before transcription")
+PROVIDER_IN_FLIGHT = Gauge("provider_calls_in_flight", "Outstanding provider calls", ["provider"])
+PROVIDER_SECONDS = Histogram("provider_call_duration_seconds", "Provider call time by provider and call",
+                             ["provider", "call"], buckets=LATENCY_BUCKETS)
+PROVIDER_ERRORS = Counter("provider_errors_total", "Failed provider calls", ["provider", "call", "error"])
+COALESCED_CALLS = Counter("coalesced_calls_total", "Calls that joined an identical in-flight call", ["call"])
+IDEMPOTENT_REPLAYS = Counter("idempotent_replays_total", "Stored responses replayed for a repeated key", ["route"])
+PROVIDER_SLOTS_IN_USE = Gauge("provider_slots_in_use", "Provider concurrency slots held", ["provider"])
+ADMISSION_QUEUE_DEPTH = Gauge("admission_queue_depth", "Calls waiting for a provider slot", ["provider", "priority"])
+ADMISSION_WAIT_SECONDS = Histogram("admission_wait_seconds", "Time spent waiting for a provider slot",
+                                   ["provider", "priority"], buckets=LATENCY_BUCKETS)
+ADMISSION_REJECTED = Counter("admission_rejected_total", "Requests and calls turned away by admission control",
+                             ["reason"])
+NOTE_WRITE_BATCH_SIZE = Histogram("note_write_batch_size", "Notes committed per write-behind transaction",
+                                  buckets=(1, 2, 5, 10, 20, 50, 100, 200))
+NOTE_WRITE_QUEUE_DEPTH = Gauge("note_write_queue_depth", "Notes waiting for the write-behind writer")
+
+trace_id = contextvars.ContextVar("trace_id", default="-")
+# perf_counter() at the start of the current request; the request body is read before handlers run
+request_started = contextvars.ContextVar("request_started", default=None)
+
+logger = logging.getLogger("soap_note")
+
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record):
+        record.trace_id = trace_id.get()
+        return True
+
+
+def configure_logging(level: int = logging.INFO):
+    handler = logging.StreamHandler()
+    handler.addFilter(TraceIdFilter())
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def provider_call(provider: str, call: str):
+    """Time one provider attempt and count its failures by provider."""
+    PROVIDER_IN_FLIGHT.labels(provider).inc()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        PROVIDER_ERRORS.labels(provider, call, type(e).__name__).inc()
+        logger.warning("%s %s failed: %r", provider, call, e)
+        raise
+    finally:
+        PROVIDER_IN_FLIGHT.labels(provider).dec()
+        PROVIDER_SECONDS.labels(provider, call).observe(time.perf_counter() - started)
+
+
+def observe_upload():
+    # Multipart bodies are received and spooled before the handler is called
+    started = request_started.get()
+    if started is not None:
+        STAGE_SECONDS.labels("upload").observe(time.perf_counter() - started)
+
+
+def internal_error(e: Exception) -> HTTPException:
+    """Log ``e`` with its traceback and trace id, then wrap it as a 500."""
+    logger.error("Unhandled error: %s", e, exc_info=e)
+    return HTTPException(status_code=500, detail=str(e))
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    operation = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "other"
+    if operation not in ("select", "insert", "update", "delete", "with"):
+        operation = "other"
+    DB_QUERY_SECONDS.labels(operation).observe(elapsed)
+
+
+async def middleware(request: Request, call_next):
+    trace = request.headers.get(TRACE_HEADER) or uuid.uuid4().hex
+    trace_id.set(trace)
+    request_started.set(time.perf_counter())
+    started = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers[TRACE_HEADER] = trace
+        return response
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        # Route templates keep label cardinality bounded
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        REQUESTS.labels(request.method, path, str(status)).inc()
+        elapsed = time.perf_counter() - started
+        REQUEST_SECONDS.labels(request.method, path).observe(elapsed)
+        logger.info("%s %s -> %s in %.0f ms", request.method, request.url.path, status, elapsed * 1000)
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,7 +1,11 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Date, Index, JSON
+from sqlalchemy.dialects.postgresql import JSONB
 from datetime import datetime
 from database import Base
 
+# JSONB on Postgres; a missing section is stored as SQL NULL, not JSON null
+SectionJSON = JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql")
+
 class SoapNoteDB(Base):
     __tablename__ = "soap_notes"
 
@@ -9,8 +13,27 @@ class SoapNoteDB(Base):
     patient_id = Column(String(50), index=True)
     patient_name = Column(String(100), nullable=False)
     content = Column(Text, nullable=False)
+    language = Column(String(10))
+    # Prompt template and token usage of the generation that produced this note
+    prompt_version = Column(String(50))
+    input_tokens = Column(Integer)
+    output_tokens = Column(Integer)
+    trimmed_tokens = Column(Integer)
+    # Source transcript, when the note was saved straight from /transcribe
+    transcript = Column(Text)
+    # Parsed sections of `content`, each {"text", "subsections"}, so callers can read only what they need
+    subjective = Column(SectionJSON)
+    objective = Column(SectionJSON)
+    assessment = Column(SectionJSON)
+    plan = Column(SectionJSON)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
+    __table_args__ = (
+        # Keyset pagination: newest-first listings are index range scans
+        Index("ix_soap_notes_created_at_id", "created_at", "id"),
+        Index("ix_soap_notes_patient_id_created_at_id", "patient_id", "created_at", "id"),
+    )
+
     def __repr__(self):
         return f"<SoapNote(id={self.id}, patient_id={self.patient_id}, patient_name={self.patient_name})>" 
 
@@ -23,3 +46,106 @@ class User(Base):
     username = Column(String(100), unique=True, index=True)
     job = Column(String(100))
     hashed_password = Column(String)
+
+
+class TranscriptionJobDB(Base):
+    __tablename__ = "transcription_jobs"
+
+    id = Column(String(32), primary_key=True)
+    batch_id = Column(String(32), index=True)
+    filename = Column(String(255))
+    status = Column(String(20), nullable=False, default="queued", index=True)
+    stage = Column(String(20))
+    language = Column(String(10))
+    transcript = Column(Text)
+    soap_note = Column(Text)
+    prompt_version = Column(String(50))
+    input_tokens = Column(Integer)
+    output_tokens = Column(Integer)
+    trimmed_tokens = Column(Integer)
+    error = Column(Text)
+    # Stored note, for jobs submitted with a patient
+    note_id = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime)
+
+    def __repr__(self):
+        return f"<TranscriptionJob(id={self.id}, status={self.status}, stage={self.stage})>"
+
+
+class UploadDB(Base):
+    __tablename__ = "uploads"
+
+    # Resumable upload staged on local disk (see uploads.py)
+    id = Column(String(32), primary_key=True)
+    filename = Column(String(255))
+    language = Column(String(10))
+    prompt_version = Column(String(50))
+    upload_length = Column(BigInteger, nullable=False)
+    upload_offset = Column(BigInteger, nullable=False, default=0)
+    status = Column(String(20), nullable=False, default="uploading", index=True)
+    job_id = Column(String(32))
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, index=True)
+
+    def __repr__(self):
+        return f"<Upload(id={self.id}, offset={self.upload_offset}/{self.upload_length}, status={self.status})>"
+
+
+class CacheEntryDB(Base):
+    __tablename__ = "cache_entries"
+
+    namespace = Column(String(32), primary_key=True)
+    key = Column(String(64), primary_key=True)
+    value = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, index=True)
+
+    def __repr__(self):
+        return f"<CacheEntry(namespace={self.namespace}, key={self.key})>"
+
+
+class PatientSummaryDB(Base):
+    __tablename__ = "patient_summaries"
+
+    patient_id = Column(String(50), primary_key=True)
+    patient_name = Column(String(100))
+    summary = Column(Text, nullable=False)
+    # Highest soap_notes.id folded into the summary; later notes are the delta
+    last_note_id = Column(Integer, nullable=False)
+    note_count = Column(Integer, nullable=False, default=0)
+    summary_tokens = Column(Integer)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<PatientSummary(patient_id={self.patient_id}, last_note_id={self.last_note_id})>"
+
+
+class AnalyticsPeriodDB(Base):
+    __tablename__ = "analytics_periods"
+
+    # period is "day", "week", "month" or "all" (period_start 1970-01-01)
+    period = Column(String(8), primary_key=True)
+    period_start = Column(Date, primary_key=True)
+    note_count = Column(Integer, nullable=False, default=0)
+    patient_count = Column(Integer, nullable=False, default=0)
+    content_chars = Column(Integer, nullable=False, default=0)
+
+
+class AnalyticsPeriodPatientDB(Base):
+    __tablename__ = "analytics_period_patients"
+
+    # Membership rows that make patient_count a distinct count
+    period = Column(String(8), primary_key=True)
+    period_start = Column(Date, primary_key=True)
+    patient_id = Column(String(50), primary_key=True)
+
+
+class AnalyticsLanguageDB(Base):
+    __tablename__ = "analytics_languages"
+
+    language = Column(String(10), primary_key=True)
+    note_count = Column(Integer, nullable=False, default=0)
+
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from dotenv import load_dotenv
+import analytics
+import metrics
+import sections
+from database import SessionLocal
+from models import SoapNoteDB
+
+load_dotenv()
+
+# Notes that arrive while a transaction is committing go into the next one, up to this many
+NOTE_WRITE_BATCH_SIZE = int(os.getenv("NOTE_WRITE_BATCH_SIZE", "100"))
+# Optional extra wait to collect a fuller batch; 0 adds no latency when the queue is quiet
+NOTE_WRITE_MAX_DELAY_MS = float(os.getenv("NOTE_WRITE_MAX_DELAY_MS", "0"))
+
+
+def note_values(patient_id: str, patient_name: str, content: str, language: str = None, transcript: str = None,
+                prompt_version: str = None, input_tokens: int = None, output_tokens: int = None,
+                trimmed_tokens: int = None) -> dict:
+    """Column values for a new SoapNoteDB row; the usage arguments match a generation's usage dict."""
+    return dict(
+        patient_id=patient_id,
+        patient_name=patient_name,
+        content=content,
+        language=language,
+        transcript=transcript,
+        prompt_version=prompt_version,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        trimmed_tokens=trimmed_tokens,
+        # Structured copy of the note, so readers can fetch single sections
+        **sections.section_columns(content),
+        created_at=datetime.utcnow(),
+    )
+
+
+def stored_note(note: SoapNoteDB) -> dict:
+    return {
+        "id": note.id,
+        "patient_id": note.patient_id,
+        "patient_name": note.patient_name,
+        "content": note.content,
+        "language": note.language,
+        "created_at": note.created_at,
+    }
+
+
+class NoteWriter:
+    """Group-commit queue for note inserts.
+
+    Callers from any route enqueue column values and wait for the stored row;
+    one writer thread inserts everything queued so far in a single
+    transaction, so under load many notes share one commit. ``after_commit``
+    gets each committed batch of stored notes.
+    """
+
+    def __init__(self, batch_size: int = NOTE_WRITE_BATCH_SIZE, max_delay_ms: float = NOTE_WRITE_MAX_DELAY_MS,
+                 after_commit=None):
+        self.batch_size = batch_size
+        self.max_delay = max_delay_ms / 1000
+        self.after_commit = after_commit
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, values: dict) -> Future:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="note-writer", daemon=True)
+                self._thread.start()
+        future = Future()
+        self._queue.put((values, future))
+        metrics.NOTE_WRITE_QUEUE_DEPTH.inc()
+        return future
+
+    def write(self, values: dict) -> dict:
+        # From a worker thread; blocks until the note is committed
+        return self.submit(values).result()
+
+    async def awrite(self, values: dict) -> dict:
+        return await asyncio.wrap_future(self.submit(values))
+
+    def _next_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            try:
+                remaining = deadline - time.monotonic()
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        metrics.NOTE_WRITE_QUEUE_DEPTH.dec(len(batch))
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                stored = self._insert([values for values, _ in batch])
+            except Exception:
+                # One bad note must not fail the others queued with it
+                stored = []
+                for values, future in batch:
+                    try:
+                        stored.extend(self._insert([values]))
+                        future.set_result(stored[-1])
+                    except Exception as e:
+                        future.set_exception(e)
+            else:
+                for (_, future), note in zip(batch, stored):
+                    future.set_result(note)
+            if stored and self.after_commit is not None:
+                try:
+                    self.after_commit(stored)
+                except Exception as e:
+                    metrics.logger.error("Note after-commit hook failed: %s", e, exc_info=e)
+
+    def _insert(self, rows: list) -> list:
+        db = SessionLocal()
+        try:
+            with metrics.stage("db_write"):
+                notes = [SoapNoteDB(**values) for values in rows]
+                db.add_all(notes)
+                db.flush()
+                # Dashboard rollups are updated in the same transaction as the inserts
+                analytics.record_notes(db, notes)
+                db.commit()
+            metrics.NOTE_WRITE_BATCH_SIZE.observe(len(notes))
+            return [stored_note(note) for note in notes]
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
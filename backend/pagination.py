@@ -0,0 +1,90 @@
+import base64
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select, tuple_
+from models import SoapNoteDB
+from sections import SECTION_FIELDS
+
+# Returned when no fields are requested; structured sections are opt-in
+DEFAULT_FIELDS = ("id", "patient_id", "patient_name", "content", "language", "created_at")
+# Opt-in as well: the transcript is stored only for notes saved from /transcribe
+NOTE_FIELDS = DEFAULT_FIELDS + ("transcript",) + SECTION_FIELDS
+# Always selected: they identify the row and make up the keyset cursor
+KEY_FIELDS = ("id", "created_at")
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(created_at: datetime, note_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{note_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, note_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(note_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_fields(fields: Optional[str]):
+    if not fields:
+        return DEFAULT_FIELDS
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in NOTE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # Keep the canonical column order so compact rows are stable
+    return tuple(f for f in NOTE_FIELDS if f in requested or f in KEY_FIELDS)
+
+
+async def list_notes(db, filters=(), fields: Optional[str] = None, limit: Optional[int] = None,
+                     cursor: Optional[str] = None, format: str = "json"):
+    """Newest-first note listing with keyset pagination and column projection.
+
+    Only the projected columns are selected, so list views that skip
+    ``content`` never read it. Rows are serialized straight to JSON with
+    orjson. ``format="compact"`` returns ``{"fields", "rows", "next_cursor"}``
+    with one array per note; the default is the legacy list of objects, with
+    the next cursor in the ``X-Next-Cursor`` header.
+
+    Without ``limit`` or ``cursor`` every matching note is returned, as before.
+    """
+    if format not in ("json", "compact"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'compact'")
+    names = parse_fields(fields)
+    columns = [getattr(SoapNoteDB, name) for name in names]
+
+    query = select(*columns)
+    if filters:
+        query = query.where(*filters)
+    if cursor:
+        created_at, note_id = decode_cursor(cursor)
+        query = query.where(tuple_(SoapNoteDB.created_at, SoapNoteDB.id) < tuple_(created_at, note_id))
+    query = query.order_by(SoapNoteDB.created_at.desc(), SoapNoteDB.id.desc())
+
+    paginated = limit is not None or cursor is not None
+    if paginated:
+        limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+        # One extra row tells us whether another page exists
+        query = query.limit(limit + 1)
+
+    rows = (await db.execute(query)).all()
+    next_cursor = None
+    if paginated and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[names.index("created_at")], last[names.index("id")])
+
+    if format == "compact":
+        return ORJSONResponse({"fields": names, "rows": [tuple(row) for row in rows], "next_cursor": next_cursor})
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    # Objects are built from the result rows in one pass, with no intermediate tuple copy; a dict per row
+    # handed to a single orjson call measured faster than splicing per-value encodings into objects
+    return ORJSONResponse([dict(zip(names, row)) for row in rows], headers=headers)
@@ -0,0 +1,363 @@
+import io
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import wave
+import numpy as np
+from dotenv import load_dotenv
+import ingest
+import metrics
+
+load_dotenv()
+
+AUDIO_PREPROCESS = os.getenv("AUDIO_PREPROCESS", "true").lower() == "true"
+TARGET_SAMPLE_RATE = 16000
+# "auto" is Opus when ffmpeg is installed, else 16-bit WAV
+AUDIO_ENCODING = os.getenv("AUDIO_ENCODING", "auto")
+OPUS_BITRATE = os.getenv("AUDIO_OPUS_BITRATE", "24k")
+
+# Energy VAD: 30 ms frames; speech is anything VAD_MARGIN_DB above the noise floor
+VAD_FRAME_SECONDS = 0.03
+VAD_FLOOR_DB = float(os.getenv("AUDIO_VAD_FLOOR_DB", "-50"))
+VAD_MARGIN_DB = float(os.getenv("AUDIO_VAD_MARGIN_DB", "12"))
+VAD_DYNAMIC_RANGE_DB = float(os.getenv("AUDIO_VAD_DYNAMIC_RANGE_DB", "30"))
+# Speech is padded on both sides; internal pauses longer than MAX_SILENCE are cut down to it
+VAD_PADDING_SECONDS = float(os.getenv("AUDIO_VAD_PADDING_SECONDS", "0.3"))
+MAX_SILENCE_SECONDS = float(os.getenv("AUDIO_MAX_SILENCE_SECONDS", "1.0"))
+# Keep the original when preprocessing saves less than this and is not smaller
+MIN_SECONDS_SAVED = float(os.getenv("AUDIO_MIN_SECONDS_SAVED", "2"))
+
+FFMPEG = shutil.which("ffmpeg")
+# Audio is decoded, resampled and re-encoded this many bytes at a time, so memory stays flat
+# however long the recording is
+BLOCK_BYTES = 1 << 20
+
+
+class DecodeError(Exception):
+    pass
+
+
+def _ffmpeg_error(process, log) -> DecodeError:
+    log.seek(0)
+    message = log.read().decode(errors="replace").strip()
+    return DecodeError(message or f"ffmpeg exited with status {process.returncode}")
+
+
+def _decode_wav(source):
+    """Decode PCM WAV to mono float32 at the file's own rate.
+
+    Returns ``(blocks, rate, channels)``; ``blocks`` is a generator, so one
+    block is in memory at a time. The header is checked up front.
+    """
+    try:
+        reader = wave.open(source, "rb")
+    except (wave.Error, EOFError, struct.error) as e:
+        raise DecodeError(str(e))
+    channels, width, rate = reader.getnchannels(), reader.getsampwidth(), reader.getframerate()
+    if width not in (1, 2, 4):
+        reader.close()
+        raise DecodeError(f"Unsupported sample width {width}")
+    dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[width]
+    scale = float(2 ** (8 * width - 1))
+    frames_per_block = max(1, BLOCK_BYTES // (width * channels))
+
+    def blocks():
+        with reader:
+            while True:
+                data = reader.readframes(frames_per_block)
+                if not data:
+                    return
+                samples = np.frombuffer(data, dtype=dtype).astype(np.float32)
+                samples = samples[:len(samples) // channels * channels]
+                if width == 1:
+                    samples -= 128
+                # Downmix before anything else so memory is per channel, not per frame
+                yield samples.reshape(-1, channels).mean(axis=1) / scale
+
+    return blocks(), rate, channels
+
+
+def _feed(stdin, source):
+    try:
+        for chunk in iter(lambda: source.read(BLOCK_BYTES), b""):
+            stdin.write(chunk)
+    except (BrokenPipeError, ValueError):
+        # ffmpeg stopped reading; its exit status carries the reason
+        pass
+    finally:
+        stdin.close()
+
+
+def _decode_ffmpeg(source):
+    """Decode the browser formats (webm/ogg/mp3/m4a) through ffmpeg pipes, in blocks.
+
+    ffmpeg does the downmix and resample itself. Sources with a file
+    descriptor are handed to it directly; others are fed from a thread.
+    """
+    try:
+        source.fileno()
+        stdin = source
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        stdin = subprocess.PIPE
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        [FFMPEG, "-loglevel", "error", "-i", "pipe:0", "-f", "s16le", "-ac", "1",
+         "-ar", str(TARGET_SAMPLE_RATE), "pipe:1"],
+        stdin=stdin, stdout=subprocess.PIPE, stderr=log, bufsize=0,
+    )
+    feeder = None
+    if stdin is subprocess.PIPE:
+        feeder = threading.Thread(target=_feed, args=(process.stdin, source), daemon=True)
+        feeder.start()
+
+    def blocks():
+        remainder = b""
+        try:
+            while True:
+                chunk = process.stdout.read(BLOCK_BYTES)
+                if not chunk:
+                    break
+                chunk = remainder + chunk
+                # Pipe reads can split a sample
+                usable = len(chunk) - len(chunk) % 2
+                remainder = chunk[usable:]
+                yield np.frombuffer(chunk[:usable], dtype=np.int16).astype(np.float32) / 32768
+            if process.wait() != 0:
+                raise _ffmpeg_error(process, log)
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            if feeder is not None:
+                feeder.join()
+            log.close()
+
+    return blocks(), TARGET_SAMPLE_RATE, None
+
+
+class Resampler:
+    """Streaming resampler for mono audio, with a box low-pass first when downsampling.
+
+    Blocks are fed in order; filter history and the interpolation position
+    carry across block boundaries, so the output matches a one-shot resample.
+    """
+
+    def __init__(self, src_rate: int, dst_rate: int = TARGET_SAMPLE_RATE):
+        self.ratio = src_rate / dst_rate
+        width = int(round(self.ratio))
+        self.kernel = np.full(width, 1 / width, np.float32) if width > 1 else None
+        self.history = np.zeros(width - 1 if width > 1 else 0, np.float32)
+        # Last filtered sample of the previous block, and its index in the whole recording
+        self.tail = np.zeros(0, np.float32)
+        self.consumed = 0
+        self.produced = 0
+
+    def feed(self, block):
+        if self.ratio == 1 or not len(block):
+            return block
+        if self.kernel is not None:
+            extended = np.concatenate([self.history, block])
+            block = np.convolve(extended, self.kernel, mode="valid").astype(np.float32)
+            self.history = extended[len(extended) - len(self.history):]
+        buffer = np.concatenate([self.tail, block])
+        buffer_start = self.consumed - len(self.tail)
+        self.consumed += len(block)
+        # Every output whose source position falls inside this buffer
+        end = int((self.consumed - 1) / self.ratio) + 1
+        positions = np.arange(self.produced, end) * self.ratio - buffer_start
+        self.produced = max(self.produced, end)
+        self.tail = buffer[-1:]
+        return np.interp(positions, np.arange(len(buffer)), buffer).astype(np.float32)
+
+
+def _to_pcm(samples):
+    return (np.clip(samples, -1, 1) * 32767).astype(np.int16)
+
+
+def _stage(blocks, rate: int, path: str):
+    """Resample ``blocks`` to 16 kHz 16-bit PCM at ``path``.
+
+    Returns ``(frame_energy, samples)``: the RMS of every VAD frame, which is
+    all the speech detector needs, and the number of samples written.
+    """
+    resampler = Resampler(rate)
+    frame = int(TARGET_SAMPLE_RATE * VAD_FRAME_SECONDS)
+    energies, pending, total = [], np.zeros(0, np.float32), 0
+    with open(path, "wb") as out:
+        for block in blocks:
+            samples = resampler.feed(block)
+            out.write(_to_pcm(samples).tobytes())
+            total += len(samples)
+            pending = np.concatenate([pending, samples])
+            frames = len(pending) // frame
+            if frames:
+                energies.append(np.sqrt(np.mean(pending[:frames * frame].reshape(frames, frame) ** 2, axis=1)))
+                pending = pending[frames * frame:]
+    return (np.concatenate(energies) if energies else np.zeros(0, np.float32)), total
+
+
+def speech_segments(energy, total: int, rate: int = TARGET_SAMPLE_RATE):
+    """Return ``[(start, end)]`` sample ranges to keep, or None when no speech is found.
+
+    ``energy`` is the RMS of each VAD frame and ``total`` the recording's length in samples.
+    """
+    frame = int(rate * VAD_FRAME_SECONDS)
+    if not len(energy):
+        return None
+    energy_db = 20 * np.log10(np.maximum(energy, 1e-10))
+    # Noise floor from the quietest frames, capped below the loud ones so speech-heavy
+    # recordings (little real silence to measure) do not lose their quieter words
+    noise_floor, loud = np.percentile(energy_db, [10, 95])
+    threshold = max(VAD_FLOOR_DB, min(noise_floor + VAD_MARGIN_DB, loud - VAD_DYNAMIC_RANGE_DB))
+    voiced = np.flatnonzero(energy_db > threshold)
+    if not len(voiced):
+        return None
+
+    padding = int(VAD_PADDING_SECONDS / VAD_FRAME_SECONDS)
+    max_gap = int(MAX_SILENCE_SECONDS / VAD_FRAME_SECONDS)
+    segments = []
+    start = previous = voiced[0]
+    for index in voiced[1:]:
+        if index - previous > max_gap:
+            segments.append((start, previous))
+            start = index
+        previous = index
+    segments.append((start, previous))
+    return [
+        (int(max(0, (first - padding) * frame)), int(min(total, (last + 1 + padding) * frame)))
+        for first, last in segments
+    ]
+
+
+def _segment_chunks(pcm_path: str, segments):
+    # The kept ranges of the staged PCM, read back one block at a time
+    with open(pcm_path, "rb") as pcm:
+        for start, end in segments:
+            pcm.seek(start * 2)
+            remaining = (end - start) * 2
+            while remaining > 0:
+                chunk = pcm.read(min(BLOCK_BYTES, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+def _write_wav(path: str, chunks):
+    with wave.open(path, "wb") as writer:
+        writer.setnchannels(1)
+        writer.setsampwidth(2)
+        writer.setframerate(TARGET_SAMPLE_RATE)
+        for chunk in chunks:
+            writer.writeframes(chunk)
+
+
+def _write_opus(path: str, chunks):
+    with tempfile.TemporaryFile() as log:
+        process = subprocess.Popen(
+            [FFMPEG, "-nostdin", "-loglevel", "error", "-y", "-f", "s16le", "-ac", "1",
+             "-ar", str(TARGET_SAMPLE_RATE), "-i", "pipe:0", "-c:a", "libopus", "-b:a", OPUS_BITRATE,
+             "-application", "voip", path],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=log, bufsize=0,
+        )
+        try:
+            try:
+                for chunk in chunks:
+                    process.stdin.write(chunk)
+            except BrokenPipeError:
+                # ffmpeg stopped reading; its exit status carries the reason
+                pass
+            process.stdin.close()
+            if process.wait() != 0:
+                raise _ffmpeg_error(process, log)
+        finally:
+            process.stdin.close()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+
+def preprocess(audio):
+    """Decode, downmix, resample to 16 kHz, trim silence and re-encode ``audio``.
+
+    Returns ``(path, report)``; ``path`` is a new temp file the caller must
+    remove, or None when the original should be sent unchanged (undecodable,
+    not worth it, or preprocessing failed). ``report`` describes what was saved.
+    Audio flows through in fixed-size blocks, staged as 16 kHz PCM on disk.
+    """
+    started = time.perf_counter()
+    fd, pcm_path = ingest.make_temp_file(".pcm")
+    os.close(fd)
+    try:
+        return _preprocess(audio, pcm_path, started)
+    except Exception as e:
+        # Preprocessing only saves bytes; the transcription must not fail because of it
+        metrics.logger.warning("Audio preprocessing failed, sending the original: %s", e)
+        return None, {"preprocessed": False, "reason": f"preprocessing failed: {e}"}
+    finally:
+        ingest.remove_file(pcm_path)
+
+
+def _preprocess(audio, pcm_path: str, started: float):
+    source = open(audio, "rb")
+    try:
+        original_bytes = os.fstat(source.fileno()).st_size
+        try:
+            blocks, rate, channels = _decode_wav(source)
+            decoder = "wav"
+        except DecodeError:
+            if FFMPEG is None:
+                return None, {"preprocessed": False, "reason": "unsupported format and ffmpeg is not installed"}
+            source.seek(0)
+            blocks, rate, channels = _decode_ffmpeg(source)
+            decoder = "ffmpeg"
+        energy, total = _stage(blocks, rate, pcm_path)
+    except DecodeError as e:
+        return None, {"preprocessed": False, "reason": f"could not decode audio: {e}"}
+    finally:
+        source.close()
+
+    original_seconds = total / TARGET_SAMPLE_RATE
+    segments = speech_segments(energy, total)
+    kept = segments or [(0, total)]
+    processed_seconds = sum(end - start for start, end in kept) / TARGET_SAMPLE_RATE
+
+    encoding = AUDIO_ENCODING if AUDIO_ENCODING != "auto" else ("opus" if FFMPEG else "wav")
+    fd, path = ingest.make_temp_file(".ogg" if encoding == "opus" else ".wav")
+    os.close(fd)
+    try:
+        if encoding == "opus":
+            _write_opus(path, _segment_chunks(pcm_path, kept))
+        else:
+            _write_wav(path, _segment_chunks(pcm_path, kept))
+        processed_bytes = os.path.getsize(path)
+    except Exception:
+        ingest.remove_file(path)
+        raise
+
+    report = {
+        "preprocessed": True,
+        "decoder": decoder,
+        "encoding": encoding,
+        "original_channels": channels,
+        "original_sample_rate": rate,
+        "original_bytes": original_bytes,
+        "processed_bytes": processed_bytes,
+        "bytes_saved": original_bytes - processed_bytes,
+        "original_seconds": round(original_seconds, 2),
+        "processed_seconds": round(processed_seconds, 2),
+        "seconds_saved": round(original_seconds - processed_seconds, 2),
+        "speech_segments": len(segments) if segments else 0,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000),
+    }
+    if report["bytes_saved"] <= 0 and report["seconds_saved"] < MIN_SECONDS_SAVED:
+        ingest.remove_file(path)
+        return None, dict(report, preprocessed=False, reason="no meaningful savings")
+    metrics.AUDIO_BYTES_SAVED.inc(max(0, report["bytes_saved"]))
+    metrics.AUDIO_SECONDS_SAVED.inc(max(0, report["seconds_saved"]))
+    return path, report
@@ -139,3 +139,214 @@ Additional Notes
 Please maintain this exact formatting and structure in your response. Use clear bullet points and indentation for better readability. If certain information is not available from the transcript, mark it as 'Not reported' or 'Not assessed' rather than omitting the section.
 
 Format the response to be easily convertible to a professional medical document, maintaining consistent spacing and alignment."""
+
+
+# Full SOAP note template, used for every note before template variants existed
+SOAP_TEMPLATE = """
+# SOAP Note Template
+
+You are an experienced medical professional tasked with creating a comprehensive and precise SOAP note. Generate a detailed clinical documentation from the provided transcript, adhering to the following structured format:
+
+## Subjective
+• Chief Complaint (if mentioned):
+  - Primary concern with exact duration (days/weeks/months)
+  - Pain scale rating (if applicable, 0-10)
+  - Pattern and timing of symptoms
+• History of Present Illness (if mentioned):
+  - Chronological progression of symptoms
+  - Specific associated symptoms
+  - Precise aggravating and alleviating factors
+  - Previous treatments attempted
+• Past Medical History (if mentioned):
+  - Chronic conditions
+  - Previous surgeries with dates
+  - Relevant hospitalizations
+• Current Medications (if mentioned):
+  - Name (generic and brand)
+  - Exact dosage and frequency
+  - Duration of current regimen
+  - Compliance history
+• Allergies (if mentioned):
+  - Medication allergies with specific reactions
+  - Environmental/food allergies
+  - Severity of reactions
+• Family History (if mentioned):
+  - First-degree relatives' conditions
+  - Age of onset for hereditary conditions
+  - Current status of family members
+• Social History (if mentioned):
+  - Occupation and work environment
+  - Living situation and support system
+  - Detailed habits:
+    ∘ Smoking (packs/day, years)
+    ∘ Alcohol (type, frequency, amount)
+    ∘ Exercise routine
+    ∘ Diet patterns
+• Review of Systems (if mentioned):
+  - Cardiovascular
+  - Respiratory
+  - Gastrointestinal
+  - Musculoskeletal
+  - Neurological
+  - Other pertinent systems
+
+## Objective
+• Vital Signs (if mentioned):
+  - Blood pressure (mmHg)
+  - Heart rate (bpm)
+  - Temperature (°C/°F)
+  - Respiratory rate (breaths/min)
+  - O2 saturation (%)
+  - BMI
+• Physical Examination (if mentioned):
+  - General appearance
+  - Mental status
+  - Detailed cardiovascular exam:
+    ∘ Heart sounds (S1/S2/murmurs)
+    ∘ Peripheral pulses
+    ∘ Edema assessment
+  - Respiratory exam
+  - Abdominal exam
+  - Neurological exam
+  - Skin assessment
+• Laboratory Results (if mentioned):
+  - Complete blood count
+  - Metabolic panel
+  - Cardiac enzymes
+  - Other relevant tests
+• Diagnostic Studies (if mentioned):
+  - ECG findings
+  - Imaging results
+  - Other test results
+
+## Assessment
+• Primary Diagnosis (if mentioned):
+  - Condition name with specificity (e.g., "Essential Hypertension, Stage 2, poorly controlled")
+  - Severity/stage classification with detailed criteria:
+    ∘ Clinical parameters
+    ∘ Risk stratification 
+    ∘ Disease progression indicators
+  - Supporting evidence:
+    ∘ Key symptoms and clinical findings
+    ∘ Relevant test results
+    ∘ Response to previous treatments
+    ∘ Impact on patient's quality of life
+  - Clinical reasoning:
+    ∘ Key findings supporting diagnosis
+    ∘ Risk stratification
+    ∘ Disease progression assessment
+  - Complications:
+    ∘ Current complications
+    ∘ Potential complications
+    ∘ Risk factors
+
+## Differential Diagnosis
+• Primary Differential Diagnoses:
+  - List of potential diagnoses in order of likelihood
+  - For each diagnosis:
+    ∘ ICD-11 code and complete description
+    ∘ Supporting evidence and clinical findings
+    ∘ Key distinguishing features
+    ∘ Required confirmatory tests
+• Secondary Differential Diagnoses:
+  - Additional conditions to consider
+  - Risk factors and predisposing conditions
+  - Required screening or testing
+• Critical "Must-Not-Miss" Diagnoses:
+  - Life-threatening conditions to rule out
+  - Red flag symptoms/signs
+  - Emergency management considerations
+• Diagnostic Approach:
+  - Systematic evaluation strategy
+  - Key diagnostic tests needed
+  - Clinical decision points
+  - Consultation requirements
+
+## Plan
+• Medications (if mentioned):
+  - New prescriptions (name, dose, frequency, duration)
+  - Modified medications
+  - Discontinued medications
+  - Reason for each change
+• Diagnostic Testing (if mentioned):
+  - Ordered tests with rationale
+  - Expected timeframe
+  - Specific instructions
+• Interventions (if mentioned):
+  - Procedures planned
+  - Referrals with urgency level
+  - Specialist consultations
+• Patient Education (if mentioned):
+  - Lifestyle modifications
+  - Warning signs to monitor
+  - Self-management instructions
+• Follow-up (if mentioned):
+  - Next appointment timing
+  - Specific goals for next visit
+  - Conditions for earlier return
+
+## Conclusion
+• Case Summary (if mentioned):
+  - Brief overview of key findings
+  - Main diagnostic considerations
+  - Treatment strategy rationale
+• Prognosis (if mentioned):
+  - Expected outcomes
+  - Recovery timeline
+  - Long-term management needs
+• Quality Metrics (if mentioned):
+  - Care plan compliance
+  - Outcome measures
+  - Documentation completeness
+
+---
+
+### Critical Requirements:
+1. Extract information ONLY from the provided transcript: {transcript}
+2. Use standardized medical terminology and approved abbreviations following ICD-10 and SNOMED CT
+3. Document with extreme precision - use specific measurements, values and descriptors
+4. Maintain strict chronological order with clear timestamps for all historical events
+5. Include exact measurements with SI units and reference ranges where applicable
+6. Format using hierarchical bullet points and clear section headers for optimal readability
+7. Emphasize cardiovascular findings with detailed descriptions of heart sounds, rhythms, and circulation
+8. Establish clear connections between symptoms, signs, and diagnostic reasoning
+9. Mark undocumented information as "Not reported in transcript" to ensure transparency
+10. Follow standard medical documentation guidelines per Joint Commission requirements
+11. Include pertinent negatives that help rule out differential diagnoses
+12. Quantify all findings with objective measurements (e.g. pain scale 1-10, ROM in degrees)
+13. Flag urgent/emergent conditions in bold with clear action items
+14. Document patient's understanding, compliance, and barriers to treatment
+15. Include precise time stamps for all critical events, medications, and interventions
+16. Note any cultural or linguistic considerations affecting care
+17. Document all patient education provided and comprehension verified
+18. Include interdisciplinary communication and care coordination details
+19. Note any pending results or follow-up items clearly
+20. Document informed consent discussions and decisions
+
+Note: Maintain absolute objectivity and accuracy. Do not include speculative information or assumptions. If information is not explicitly stated in the transcript, mark it as "Not documented" rather than making clinical assumptions.
+"""
+
+# Compact template for routine primary-care visits
+PRIMARY_CARE_TEMPLATE = """
+You are an experienced primary-care physician. Write a concise SOAP note from the visit transcript below.
+
+SUBJECTIVE: chief complaint with duration, relevant history, current medications, allergies.
+OBJECTIVE: vital signs and examination findings that were stated.
+ASSESSMENT: working diagnosis and key differentials, with brief supporting evidence.
+PLAN: medications with dose and frequency, tests, referrals, patient education, follow-up.
+
+Use bullet points and standard medical terminology. Use only information from the transcript and write
+"Not reported" for anything that was not discussed. Flag urgent findings in bold.
+
+Transcript:
+{transcript}
+"""
+
+# Versioned templates selectable per request. Never edit a template in place:
+# add a new version so cached notes and recorded token counts stay comparable.
+SOAP_TEMPLATES = {
+    "soap-v1": SOAP_TEMPLATE,
+    "soap-standard-v1": SOAP_SYSTEM_PROMPT + "\n\nTranscript:\n{transcript}\n",
+    "soap-primary-care-v1": PRIMARY_CARE_TEMPLATE,
+}
+DEFAULT_SOAP_TEMPLATE = "soap-v1"
@@ -0,0 +1,103 @@
+import logging
+import os
+import re
+import threading
+import tiktoken
+from dotenv import load_dotenv
+from prompt import SOAP_TEMPLATES, DEFAULT_SOAP_TEMPLATE
+
+load_dotenv()
+
+# Off by default: the model sees the transcript exactly as transcribed unless trimming is turned on
+TRANSCRIPT_TRIM = os.getenv("TRANSCRIPT_TRIM", "false").lower() == "true"
+# Transcripts shorter than this are sent verbatim; trimming only pays off on long visits
+TRIM_MIN_TOKENS = int(os.getenv("TRANSCRIPT_TRIM_MIN_TOKENS", "1500"))
+
+# cl100k_base approximates the model tokenizer; counts are for budgeting and cost tracking.
+# tiktoken downloads it on first use, so it is loaded lazily and importing this module needs no network
+_encoding = None
+_encoding_lock = threading.Lock()
+
+# Standalone hesitation sounds in English and Arabic transcripts. Case-sensitive and whole-token only,
+# so words such as "ER", "serum" or "mm" (millimetres) survive; affirmatives like "mhm" are never fillers
+FILLER_PATTERN = re.compile(
+    r"(?<![\w-])(?:[Uu]h+|[Uu]m+|[Uu]hm+|[Hh]mm+|[Ee]rm+|امم+|إمم+|ممم+)(?![\w-])[,،]?[ \t]*"
+)
+
+
+class UnknownTemplate(ValueError):
+    pass
+
+
+def _get_encoding():
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                # Offline without a cached copy: estimate instead of failing every request
+                logging.getLogger("soap_note").warning("tiktoken encoding unavailable, estimating tokens: %s", e)
+                _encoding = False
+        return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if not encoding:
+        # About four characters per token for English text
+        return (len(text or "") + 3) // 4
+    return len(encoding.encode(text or ""))
+
+
+def get_template(template_id: str = None) -> str:
+    template_id = template_id or DEFAULT_SOAP_TEMPLATE
+    if template_id not in SOAP_TEMPLATES:
+        raise UnknownTemplate(f"Unknown template '{template_id}'; expected one of {', '.join(SOAP_TEMPLATES)}")
+    return SOAP_TEMPLATES[template_id]
+
+
+def list_templates() -> list:
+    # Overhead is the template's own size, i.e. the fixed cost added to every transcript
+    return [
+        {"id": template_id, "default": template_id == DEFAULT_SOAP_TEMPLATE,
+         "overhead_tokens": count_tokens(template.format(transcript=""))}
+        for template_id, template in SOAP_TEMPLATES.items()
+    ]
+
+
+def trim_transcript(transcript: str, min_tokens: int = TRIM_MIN_TOKENS, enabled: bool = TRANSCRIPT_TRIM) -> str:
+    """Drop standalone filler tokens ("uh", "um", ...) from a long transcript.
+
+    Only the filler tokens themselves are removed; no sentence is ever dropped.
+    Transcripts under ``min_tokens``, or any transcript when trimming is
+    disabled, are returned unchanged.
+    """
+    if not enabled or count_tokens(transcript) < min_tokens:
+        return transcript
+    return FILLER_PATTERN.sub("", transcript)
+
+
+def build_soap_prompt(transcript: str, template_id: str = None):
+    """Return ``(prompt_text, usage)`` for one transcript.
+
+    ``usage`` holds the template version, the prompt's input tokens and the
+    transcript tokens removed by trimming; ``output_tokens`` is filled in by
+    :func:`record_output` once the note is generated.
+    """
+    template_id = template_id or DEFAULT_SOAP_TEMPLATE
+    template = get_template(template_id)
+    trimmed = trim_transcript(transcript)
+    prompt_text = template.format(transcript=trimmed)
+    usage = {
+        "prompt_version": template_id,
+        "input_tokens": count_tokens(prompt_text),
+        "output_tokens": None,
+        "trimmed_tokens": count_tokens(transcript) - count_tokens(trimmed) if trimmed != transcript else 0,
+    }
+    return prompt_text, usage
+
+
+def record_output(usage: dict, soap_note: str) -> dict:
+    usage["output_tokens"] = count_tokens(soap_note)
+    return usage
@@ -0,0 +1,574 @@
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import AsyncExitStack
+from types import SimpleNamespace
+import assemblyai as aai
+from dotenv import load_dotenv
+import admission
+import metrics
+
+load_dotenv()
+
+# Fallback order; providers without an API key are skipped. "stub" answers locally.
+LLM_PROVIDERS = [name.strip() for name in os.getenv("LLM_PROVIDERS", "gemini,openai").split(",") if name.strip()]
+TRANSCRIPTION_PROVIDERS = [name.strip() for name in os.getenv("TRANSCRIPTION_PROVIDERS", "assemblyai").split(",")
+                           if name.strip()]
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash-002")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+
+# Deadline for one whole call, across retries, hedges and fallbacks
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "90"))
+TRANSCRIBE_TIMEOUT_SECONDS = float(os.getenv("TRANSCRIBE_TIMEOUT_SECONDS", "900"))
+# Start the next provider if the current one has not answered by then; 0 disables hedging
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "20"))
+TRANSCRIBE_HEDGE_AFTER_SECONDS = float(os.getenv("TRANSCRIBE_HEDGE_AFTER_SECONDS", "0"))
+PROVIDER_RETRIES = int(os.getenv("PROVIDER_RETRIES", "2"))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.5"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+STATS_WINDOW = int(os.getenv("PROVIDER_STATS_WINDOW", "500"))
+
+STUB_RESPONSE = (
+    "SOAP note unavailable: no language model provider could be reached. "
+    "The transcript was kept; please regenerate the note later."
+)
+STUB_TRANSCRIPT = "Stub transcript: no transcription provider is configured."
+
+# Hedged and deadline-bound sync calls run here so the caller can stop waiting
+provider_executor = ThreadPoolExecutor(max_workers=int(os.getenv("PROVIDER_WORKERS", "32")),
+                                       thread_name_prefix="provider")
+
+
+class ProviderUnavailable(RuntimeError):
+    pass
+
+
+def real_content(message) -> str:
+    """Text of an LLM answer; raises ProviderUnavailable when only the local stub answered.
+
+    The stub's notice is fine to show but must never be stored, cached or
+    summarized as if it were a note.
+    """
+    if message.content == STUB_RESPONSE:
+        raise ProviderUnavailable("No LLM provider is available; only the local stub answered")
+    return message.content
+
+
+def real_transcript(transcript) -> str:
+    # Same guard for the transcriber stub: its text is not what the patient said
+    if transcript.text == STUB_TRANSCRIPT:
+        raise ProviderUnavailable("No transcription provider is available; only the local stub answered")
+    return transcript.text
+
+
+class CircuitOpen(ProviderUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures; lets one probe through after ``reset_seconds``."""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def release(self):
+        # The probe ended without a verdict (cancelled); the next call may probe instead
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class ProviderStats:
+    def __init__(self, window: int = STATS_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.counters = {"calls": 0, "errors": 0, "retries": 0, "rejected": 0, "hedges": 0, "hedge_wins": 0}
+        self._lock = threading.Lock()
+
+    def count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            ordered = sorted(self.latencies)
+            counters = dict(self.counters)
+
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000) if ordered else None
+
+        return dict(counters, p50_ms=pct(50), p95_ms=pct(95), p99_ms=pct(99))
+
+
+def backoff(attempt: int) -> float:
+    # Full jitter, so retries from many callers do not line up
+    return random.uniform(0, RETRY_BASE_DELAY_SECONDS * 2 ** attempt)
+
+
+class Provider:
+    """One backend client with retries, a circuit breaker and latency stats."""
+
+    def __init__(self, name: str, client, model: str = None, retries: int = PROVIDER_RETRIES):
+        self.name = name
+        self.client = client
+        self.model = model or name
+        self.retries = retries
+        self.breaker = CircuitBreaker()
+        self.stats = ProviderStats()
+        # Concurrency cap shared by every stack that uses this provider
+        self.limiter = admission.limiter(name)
+
+    def _reject_if_open(self):
+        # Read-only check before queueing for a slot; it never takes the half-open probe
+        if self.breaker.state == "open":
+            self.stats.count("rejected")
+            raise CircuitOpen(f"{self.name} circuit is open")
+
+    def _before_attempt(self, attempt: int):
+        # Called with the slot held: a half-open probe taken here always ends in a recorded result
+        if not self.breaker.allow():
+            self.stats.count("rejected")
+            raise CircuitOpen(f"{self.name} circuit is open")
+        self.stats.count("retries" if attempt else "calls")
+
+    def _after_attempt(self, started: float, error: Exception = None):
+        if error is None:
+            self.stats.observe(time.perf_counter() - started)
+            self.breaker.record_success()
+        else:
+            self.stats.count("errors")
+            self.breaker.record_failure()
+
+    def call(self, method: str, *args, **kwargs):
+        for attempt in range(self.retries + 1):
+            self._reject_if_open()
+            # Waiting for a slot is not a provider failure, so it stays outside the breaker's accounting
+            with self.limiter.slot():
+                self._before_attempt(attempt)
+                started = time.perf_counter()
+                try:
+                    with metrics.provider_call(self.name, method):
+                        result = getattr(self.client, method)(*args, **kwargs)
+                except Exception as e:
+                    self._after_attempt(started, e)
+                    if attempt == self.retries:
+                        raise
+                else:
+                    self._after_attempt(started)
+                    return result
+            # The slot is given back during the backoff
+            time.sleep(backoff(attempt))
+
+    async def acall(self, method: str, *args, **kwargs):
+        for attempt in range(self.retries + 1):
+            self._reject_if_open()
+            async with self.limiter.aslot():
+                self._before_attempt(attempt)
+                started = time.perf_counter()
+                try:
+                    with metrics.provider_call(self.name, method):
+                        result = await getattr(self.client, method)(*args, **kwargs)
+                except Exception as e:
+                    self._after_attempt(started, e)
+                    if attempt == self.retries:
+                        raise
+                except asyncio.CancelledError:
+                    # A cancelled hedge loser says nothing about the provider's health
+                    self.breaker.release()
+                    raise
+                else:
+                    self._after_attempt(started)
+                    return result
+            await asyncio.sleep(backoff(attempt))
+
+
+def _unavailable(kind: str, errors: list) -> Exception:
+    if errors and all(isinstance(error, admission.Overloaded) for _, error in errors):
+        # Every provider is saturated rather than failing: the caller should back off, not see a 500
+        return admission.Overloaded(f"All {kind} providers are at capacity",
+                                    min(error.retry_after for _, error in errors))
+    detail = "; ".join(f"{name}: {error}" for name, error in errors) or "no providers configured"
+    return ProviderUnavailable(f"All {kind} providers failed ({detail})")
+
+
+def call_with_fallback(providers: list, method: str, args: tuple, timeout: float, hedge_after: float,
+                       kind: str):
+    """Call ``method`` on the first provider that answers within ``timeout``.
+
+    A failure starts the next provider at once; a provider still running after
+    ``hedge_after`` seconds gets the next one started alongside it, and the
+    first success wins. Abandoned calls finish in the background. Returns
+    ``(result, provider)`` so callers can tell which provider answered.
+    """
+    deadline = time.monotonic() + timeout
+    queue = list(providers)
+    running = {}
+    hedges = set()
+    errors = []
+
+    def start_next():
+        if queue:
+            provider = queue.pop(0)
+            running[provider_executor.submit(contextvars.copy_context().run, provider.call, method, *args)] = provider
+            return provider
+
+    start_next()
+    while running:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"{kind} call exceeded {timeout:.0f}s deadline")
+        wait_for = min(remaining, hedge_after) if hedge_after > 0 and queue else remaining
+        done, _ = wait(running, timeout=wait_for, return_when=FIRST_COMPLETED)
+        if not done:
+            hedge = start_next()
+            if hedge is not None:
+                hedge.stats.count("hedges")
+                hedges.add(hedge)
+            continue
+        for future in done:
+            provider = running.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                errors.append((provider.name, e))
+                if not running:
+                    start_next()
+                continue
+            if provider in hedges:
+                provider.stats.count("hedge_wins")
+            return result, provider
+    raise _unavailable(kind, errors)
+
+
+async def acall_with_fallback(providers: list, method: str, args: tuple, timeout: float, hedge_after: float,
+                              kind: str):
+    # Async twin of call_with_fallback; losing attempts are cancelled
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    queue = list(providers)
+    running = {}
+    hedges = set()
+    errors = []
+
+    def start_next():
+        if queue:
+            provider = queue.pop(0)
+            running[asyncio.ensure_future(provider.acall(method, *args))] = provider
+            return provider
+
+    start_next()
+    try:
+        while running:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise TimeoutError(f"{kind} call exceeded {timeout:.0f}s deadline")
+            wait_for = min(remaining, hedge_after) if hedge_after > 0 and queue else remaining
+            done, _ = await asyncio.wait(running, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedge = start_next()
+                if hedge is not None:
+                    hedge.stats.count("hedges")
+                    hedges.add(hedge)
+                continue
+            for task in done:
+                provider = running.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    errors.append((provider.name, e))
+                    if not running:
+                        start_next()
+                    continue
+                if provider in hedges:
+                    provider.stats.count("hedge_wins")
+                return result, provider
+        raise _unavailable(kind, errors)
+    finally:
+        for task in running:
+            task.cancel()
+
+
+class ResilientLLM:
+    """Chat-model facade over an ordered list of providers.
+
+    Exposes the ``invoke``/``ainvoke``/``astream``/``batch`` calls the app
+    uses, so callers do not know which provider answered. Callers that store
+    output keyed on the model use ``invoke_with_model``/``batch_with_models``
+    or pass ``answered_by`` to ``astream`` to learn which model it was.
+    """
+
+    def __init__(self, providers: list, timeout: float = LLM_TIMEOUT_SECONDS,
+                 hedge_after: float = LLM_HEDGE_AFTER_SECONDS):
+        self.providers = providers
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+
+    @property
+    def model(self) -> str:
+        return self.providers[0].model if self.providers else "none"
+
+    def invoke(self, prompt, config=None):
+        return self.invoke_with_model(prompt)[0]
+
+    def invoke_with_model(self, prompt):
+        message, provider = call_with_fallback(self.providers, "invoke", (prompt,), self.timeout, self.hedge_after,
+                                               "LLM")
+        return message, provider.model
+
+    async def ainvoke(self, prompt, config=None):
+        message, _ = await acall_with_fallback(self.providers, "ainvoke", (prompt,), self.timeout,
+                                               self.hedge_after, "LLM")
+        return message
+
+    async def astream(self, prompt, config=None, answered_by: list = None):
+        # Tokens cannot be taken back, so instead of hedging, a provider that has not
+        # sent its first chunk within the hedge window is abandoned for the next one.
+        # The model that streams the answer is appended to ``answered_by``
+        errors = []
+        for index, provider in enumerate(self.providers):
+            if provider.breaker.state == "open":
+                provider.stats.count("rejected")
+                errors.append((provider.name, CircuitOpen("circuit is open")))
+                continue
+            last = index == len(self.providers) - 1
+            first_chunk_timeout = self.timeout if last or not self.hedge_after else self.hedge_after
+            async with AsyncExitStack() as slot:
+                # The provider slot is held until the stream ends
+                try:
+                    await slot.enter_async_context(provider.limiter.aslot())
+                except admission.Overloaded as e:
+                    errors.append((provider.name, e))
+                    continue
+                # Only taken once the slot is held, so a half-open probe is never left without a result
+                if not provider.breaker.allow():
+                    provider.stats.count("rejected")
+                    errors.append((provider.name, CircuitOpen("circuit is open")))
+                    continue
+                provider.stats.count("calls")
+                started = time.perf_counter()
+                stream = provider.client.astream(prompt)
+                try:
+                    with metrics.provider_call(provider.name, "astream"):
+                        first = await asyncio.wait_for(stream.__anext__(), first_chunk_timeout)
+                except StopAsyncIteration:
+                    provider._after_attempt(started)
+                    return
+                except Exception as e:
+                    provider._after_attempt(started, e)
+                    errors.append((provider.name, e))
+                    await stream.aclose()
+                    continue
+                except BaseException:
+                    provider.breaker.release()
+                    raise
+                if answered_by is not None:
+                    answered_by.append(provider.model)
+                try:
+                    yield first
+                    async for chunk in stream:
+                        yield chunk
+                except Exception as e:
+                    provider._after_attempt(started, e)
+                    raise
+                except BaseException:
+                    # The consumer went away mid-stream; no verdict on the provider
+                    provider.breaker.release()
+                    raise
+                provider._after_attempt(started)
+                return
+        raise _unavailable("LLM", errors)
+
+    def batch(self, prompts, config=None, return_exceptions=False):
+        """Batch on the first available provider, then retry failed prompts one by one with fallback."""
+        return [answer for answer, _ in self.batch_with_models(prompts, config, return_exceptions)]
+
+    def batch_with_models(self, prompts, config=None, return_exceptions=False):
+        # One ``(answer, model)`` per prompt; the model is None where the answer is an exception
+        if not prompts:
+            return []
+        results = [(None, None)] * len(prompts)
+        pending = list(range(len(prompts)))
+        for provider in self.providers:
+            if provider.breaker.state == "open":
+                provider.stats.count("rejected")
+                continue
+            # A batch holds as many slots as it runs prompts at once
+            weight = min(len(pending), (config or {}).get("max_concurrency") or len(pending))
+            try:
+                with provider.limiter.slot(weight):
+                    if not provider.breaker.allow():
+                        provider.stats.count("rejected")
+                        continue
+                    provider.stats.count("calls")
+                    started = time.perf_counter()
+                    try:
+                        with metrics.provider_call(provider.name, "batch"):
+                            answers = provider.client.batch([prompts[i] for i in pending], config=config,
+                                                            return_exceptions=True)
+                    except Exception as e:
+                        provider._after_attempt(started, e)
+                        continue
+            except admission.Overloaded:
+                continue
+            failed = [i for i, answer in zip(pending, answers) if isinstance(answer, Exception)]
+            # Only a fully failed batch counts against the provider's breaker
+            provider._after_attempt(started, answers[0] if len(failed) == len(pending) else None)
+            for i, answer in zip(pending, answers):
+                results[i] = answer, provider.model
+            pending = failed
+            break
+        for i in pending:
+            try:
+                results[i] = self.invoke_with_model(prompts[i])
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results[i] = e, None
+        return results
+
+    def stats(self) -> dict:
+        return {provider.name: dict(provider.stats.snapshot(), model=provider.model,
+                                    circuit=provider.breaker.state) for provider in self.providers}
+
+
+class ResilientTranscriber:
+    """``aai.Transcriber``-shaped facade with deadlines, retries, hedging and fallback.
+
+    Audio is always a staged file path, so a hedged provider reads its own copy.
+    """
+
+    def __init__(self, providers: list, timeout: float = TRANSCRIBE_TIMEOUT_SECONDS,
+                 hedge_after: float = TRANSCRIBE_HEDGE_AFTER_SECONDS):
+        self.providers = providers
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+
+    def transcribe(self, audio, config=None):
+        transcript, _ = call_with_fallback(self.providers, "transcribe", (audio, config), self.timeout,
+                                           self.hedge_after, "transcription")
+        return transcript
+
+    def stats(self) -> dict:
+        return {provider.name: dict(provider.stats.snapshot(), circuit=provider.breaker.state)
+                for provider in self.providers}
+
+
+class AssemblyAIClient:
+    def __init__(self):
+        aai.settings.api_key = os.getenv("ASSEMBLYAI_API_KEY")
+        aai.settings.http_timeout = TRANSCRIBE_TIMEOUT_SECONDS
+        self.transcriber = aai.Transcriber()
+
+    def transcribe(self, audio, config=None):
+        # Provider-side failures come back as a status, not an exception
+        transcript = self.transcriber.transcribe(audio, config)
+        if transcript.status == aai.TranscriptStatus.error:
+            raise RuntimeError(f"Transcription failed: {transcript.error}")
+        return transcript
+
+
+class StubChatModel:
+    """Local last resort: answers instantly with a fixed notice instead of a note."""
+
+    def invoke(self, prompt, config=None):
+        return SimpleNamespace(content=STUB_RESPONSE)
+
+    async def ainvoke(self, prompt, config=None):
+        return self.invoke(prompt)
+
+    async def astream(self, prompt, config=None):
+        yield self.invoke(prompt)
+
+    def batch(self, prompts, config=None, return_exceptions=False):
+        return [self.invoke(prompt) for prompt in prompts]
+
+
+class StubTranscriberClient:
+    # For local runs without an AssemblyAI key; every upload transcribes to the same text
+    def transcribe(self, audio, config=None):
+        return SimpleNamespace(status="completed", error=None, text=STUB_TRANSCRIPT)
+
+
+def make_llm_provider(name: str):
+    if name == "gemini" and os.getenv("GEMINI_API_KEY"):
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        client = ChatGoogleGenerativeAI(model=GEMINI_MODEL, temperature=0, api_key=os.getenv("GEMINI_API_KEY"),
+                                        timeout=LLM_TIMEOUT_SECONDS, max_retries=0)
+        return Provider(name, client, GEMINI_MODEL)
+    if name == "openai" and os.getenv("OPENAI_API_KEY"):
+        from langchain_openai import ChatOpenAI
+        client = ChatOpenAI(model=OPENAI_MODEL, temperature=0, api_key=os.getenv("OPENAI_API_KEY"),
+                            timeout=LLM_TIMEOUT_SECONDS, max_retries=0)
+        return Provider(name, client, OPENAI_MODEL)
+    if name == "stub":
+        return Provider(name, StubChatModel(), "stub", retries=0)
+    return None
+
+
+def make_transcription_provider(name: str):
+    if name == "assemblyai" and os.getenv("ASSEMBLYAI_API_KEY"):
+        return Provider(name, AssemblyAIClient())
+    if name == "stub":
+        return Provider(name, StubTranscriberClient(), retries=0)
+    return None
+
+
+def build_llm(names=LLM_PROVIDERS) -> ResilientLLM:
+    return ResilientLLM([provider for provider in map(make_llm_provider, names) if provider is not None])
+
+
+def build_transcriber(names=TRANSCRIPTION_PROVIDERS) -> ResilientTranscriber:
+    return ResilientTranscriber([provider for provider in map(make_transcription_provider, names)
+                                 if provider is not None])
+
+
+llm = build_llm()
+transcriber = build_transcriber()
+
+
+def stats() -> dict:
+    return {"llm": llm.stats(), "transcription": transcriber.stats()}
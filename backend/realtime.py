@@ -0,0 +1,251 @@
+import asyncio
+import json
+import os
+import time
+import assemblyai as aai
+from dotenv import load_dotenv
+from fastapi import WebSocket, WebSocketDisconnect
+
+load_dotenv()
+
+# Which live transcriber to use: "assemblyai" or "fake"
+STREAMING_TRANSCRIBER = os.getenv("STREAMING_TRANSCRIBER", "assemblyai")
+STREAMING_SAMPLE_RATE = int(os.getenv("STREAMING_SAMPLE_RATE", "16000"))
+# Minimum time between SOAP drafts while a visit is being recorded
+DRAFT_INTERVAL_SECONDS = float(os.getenv("DRAFT_INTERVAL_SECONDS", "30"))
+# How long a stopped session waits for queued segments to reach the client
+FLUSH_TIMEOUT_SECONDS = float(os.getenv("REALTIME_FLUSH_TIMEOUT_SECONDS", "10"))
+
+
+class AssemblyAIStreamingTranscriber:
+    """Live transcription over AssemblyAI's real-time API.
+
+    Callbacks fire on the SDK's receiver thread with the segment text.
+    """
+
+    def __init__(self, sample_rate: int = STREAMING_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self._transcriber = None
+
+    def start(self, on_partial, on_final, on_error):
+        def on_data(transcript):
+            if not transcript.text:
+                return
+            if isinstance(transcript, aai.RealtimeFinalTranscript):
+                on_final(transcript.text)
+            else:
+                on_partial(transcript.text)
+
+        self._transcriber = aai.RealtimeTranscriber(
+            sample_rate=self.sample_rate,
+            on_data=on_data,
+            on_error=lambda error: on_error(str(error)),
+        )
+        self._transcriber.connect()
+
+    def send(self, frame: bytes):
+        self._transcriber.stream(frame)
+
+    def close(self):
+        if self._transcriber is not None:
+            self._transcriber.close()
+            self._transcriber = None
+
+
+class FakeStreamingTranscriber:
+    """Offline stand-in that turns audio frames into scripted transcript segments.
+
+    Every frame produces a partial; every ``frames_per_segment`` frames the
+    segment is finalized. Used for tests and local runs without provider keys.
+    """
+
+    def __init__(self, segments=None, frames_per_segment: int = 5):
+        self.segments = list(segments or [
+            "Patient reports chest pain for two days.",
+            "Pain is 6 out of 10, worse on exertion.",
+            "No known drug allergies.",
+        ])
+        self.frames_per_segment = frames_per_segment
+        self._frames = 0
+        self._index = 0
+        self._callbacks = None
+
+    def start(self, on_partial, on_final, on_error):
+        self._callbacks = (on_partial, on_final)
+
+    def send(self, frame: bytes):
+        on_partial, on_final = self._callbacks
+        segment = self.segments[self._index % len(self.segments)]
+        self._frames += 1
+        progress = self._frames % self.frames_per_segment
+        if progress:
+            words = segment.split()
+            on_partial(" ".join(words[:max(1, len(words) * progress // self.frames_per_segment)]))
+        else:
+            on_final(segment)
+            self._index += 1
+
+    def close(self):
+        self._callbacks = None
+
+
+def get_streaming_transcriber():
+    if STREAMING_TRANSCRIBER == "fake":
+        return FakeStreamingTranscriber()
+    return AssemblyAIStreamingTranscriber()
+
+
+class RealtimeSession:
+    """Bridges a streaming transcriber to a WebSocket and keeps a rolling SOAP draft.
+
+    Transcriber callbacks may run on another thread; they are handed to the
+    event loop through ``messages``. ``draft(transcript)`` is an async callable
+    that returns a SOAP note for the transcript so far.
+    """
+
+    def __init__(self, transcriber, draft, draft_interval: float = DRAFT_INTERVAL_SECONDS):
+        self.transcriber = transcriber
+        self.draft = draft
+        self.draft_interval = draft_interval
+        self.messages = asyncio.Queue()
+        self.segments = []
+        self.soap_draft = None
+        self._drafted_segments = 0
+        self._last_draft = 0.0
+        self._draft_task = None
+        self._loop = None
+
+    def _put(self, message: dict):
+        self._loop.call_soon_threadsafe(self.messages.put_nowait, message)
+
+    def _on_final(self, text: str):
+        self._loop.call_soon_threadsafe(self._add_segment, text)
+
+    def _add_segment(self, text: str):
+        self.segments.append(text)
+        self.messages.put_nowait({"type": "final", "text": text})
+        self._maybe_draft()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._last_draft = time.monotonic()
+        # Connecting to the provider is blocking network I/O
+        await asyncio.to_thread(
+            self.transcriber.start,
+            lambda text: self._put({"type": "partial", "text": text}),
+            self._on_final,
+            lambda error: self._put({"type": "error", "detail": error}),
+        )
+
+    @property
+    def transcript(self) -> str:
+        return " ".join(self.segments)
+
+    def _maybe_draft(self):
+        # One draft at a time, and only when new final text has arrived
+        if self._draft_task is not None and not self._draft_task.done():
+            return
+        if len(self.segments) == self._drafted_segments:
+            return
+        if time.monotonic() - self._last_draft < self.draft_interval:
+            return
+        self._draft_task = asyncio.create_task(self._refresh_draft())
+
+    async def _refresh_draft(self):
+        self._last_draft = time.monotonic()
+        segment_count = len(self.segments)
+        try:
+            self.soap_draft = await self.draft(self.transcript)
+        except Exception as e:
+            self.messages.put_nowait({"type": "error", "detail": f"Draft failed: {e}"})
+            return
+        self._drafted_segments = segment_count
+        self.messages.put_nowait({
+            "type": "draft",
+            "soap_note": self.soap_draft,
+            "segments": segment_count,
+        })
+
+    def send(self, frame: bytes):
+        self.transcriber.send(frame)
+
+    async def finish(self):
+        # Let the transcriber flush its last final segments before the summary is built
+        await asyncio.to_thread(self.transcriber.close)
+        if self._draft_task is not None:
+            await asyncio.gather(self._draft_task, return_exceptions=True)
+
+
+async def _forward_messages(websocket: WebSocket, session: RealtimeSession):
+    while True:
+        message = await session.messages.get()
+        try:
+            await websocket.send_json(message)
+        finally:
+            session.messages.task_done()
+
+
+def _is_stop(text: str) -> bool:
+    # Text frames that are not a JSON control message are ignored rather than ending the session
+    try:
+        control = json.loads(text)
+    except ValueError:
+        return False
+    return isinstance(control, dict) and control.get("type") == "stop"
+
+
+async def serve(websocket: WebSocket, session: RealtimeSession, finalize):
+    """Run a live session: binary frames in, transcript/draft events out.
+
+    The client ends the visit with a ``{"type": "stop"}`` text message; the
+    final note is then built with ``finalize(transcript)`` and sent as a
+    ``complete`` event.
+    """
+    try:
+        await session.start()
+    except Exception as e:
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        await websocket.close(code=1011)
+        return
+
+    sender = asyncio.create_task(_forward_messages(websocket, session))
+    finished = False
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes"):
+                session.send(message["bytes"])
+            elif message.get("text") and _is_stop(message["text"]):
+                break
+
+        await session.finish()
+        finished = True
+        # The forwarder dies if the client is gone, leaving the queue unjoined; wait on both, bounded
+        flushed = asyncio.ensure_future(session.messages.join())
+        try:
+            done, _ = await asyncio.wait({flushed, sender}, timeout=FLUSH_TIMEOUT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            flushed.cancel()
+        if flushed not in done:
+            return
+
+        transcript = session.transcript
+        try:
+            soap_note = await finalize(transcript) if transcript else None
+        except Exception as e:
+            # The transcript is still sent, so the visit is not lost with the note
+            await websocket.send_json({"type": "error", "detail": str(e), "transcript": transcript})
+            await websocket.close(code=1011)
+            return
+        await websocket.send_json({"type": "complete", "transcript": transcript, "soap_note": soap_note})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        if not finished:
+            await session.finish()
+
@@ -0,0 +1,214 @@
+import html
+import re
+from typing import Optional
+from sqlalchemy import text
+import metrics
+
+# Postgres: stored tsvector column with a GIN index, kept current by the database itself
+POSTGRES_DDL = [
+    """
+    ALTER TABLE soap_notes ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(patient_name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(content, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_soap_notes_search_vector ON soap_notes USING GIN (search_vector)",
+]
+
+# SQLite: external-content FTS5 table mirrored from soap_notes by triggers
+SQLITE_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS soap_notes_fts USING fts5(
+        patient_name, content, content='soap_notes', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS soap_notes_fts_insert AFTER INSERT ON soap_notes BEGIN
+        INSERT INTO soap_notes_fts(rowid, patient_name, content)
+        VALUES (new.id, new.patient_name, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS soap_notes_fts_delete AFTER DELETE ON soap_notes BEGIN
+        INSERT INTO soap_notes_fts(soap_notes_fts, rowid, patient_name, content)
+        VALUES ('delete', old.id, old.patient_name, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS soap_notes_fts_update AFTER UPDATE ON soap_notes BEGIN
+        INSERT INTO soap_notes_fts(soap_notes_fts, rowid, patient_name, content)
+        VALUES ('delete', old.id, old.patient_name, old.content);
+        INSERT INTO soap_notes_fts(rowid, patient_name, content)
+        VALUES (new.id, new.patient_name, new.content);
+    END
+    """,
+]
+
+# Snippets are HTML: the database marks matches with control characters that never occur in a
+# note, then the note text is escaped and only the markers become <mark> tags
+MARK_START, MARK_END = "\x02", "\x03"
+
+POSTGRES_SEARCH = """
+    SELECT hits.id, hits.patient_id, hits.patient_name, hits.created_at, hits.rank,
+           ts_headline('english', hits.content, query, :headline_options) AS snippet
+    FROM (
+        SELECT id, patient_id, patient_name, content, created_at,
+               ts_rank_cd(search_vector, query) AS rank
+        FROM soap_notes, websearch_to_tsquery('english', :query) AS query
+        WHERE search_vector @@ query {patient_filter}
+        ORDER BY rank DESC, id DESC
+        LIMIT :limit OFFSET :offset
+    ) AS hits, websearch_to_tsquery('english', :query) AS query
+    ORDER BY hits.rank DESC, hits.id DESC
+"""
+
+SQLITE_SEARCH = """
+    SELECT n.id, n.patient_id, n.patient_name, n.created_at,
+           -bm25(soap_notes_fts, 2.0, 1.0) AS rank,
+           snippet(soap_notes_fts, 1, :mark_start, :mark_end, '…', 20) AS snippet
+    FROM soap_notes_fts
+    JOIN soap_notes AS n ON n.id = soap_notes_fts.rowid
+    WHERE soap_notes_fts MATCH :query {patient_filter}
+    ORDER BY bm25(soap_notes_fts, 2.0, 1.0), n.id DESC
+    LIMIT :limit OFFSET :offset
+"""
+
+# Other dialects, and databases not yet upgraded, get an unranked substring match
+LIKE_SEARCH = """
+    SELECT id, patient_id, patient_name, created_at, content
+    FROM soap_notes
+    WHERE {term_filter} {patient_filter}
+    ORDER BY created_at DESC, id DESC
+    LIMIT :limit OFFSET :offset
+"""
+
+# Catalog checks only; the index itself is created by `python init_db.py upgrade`, never by a request
+INDEX_CHECKS = {
+    "postgresql": "SELECT 1 FROM information_schema.columns "
+                  "WHERE table_name = 'soap_notes' AND column_name = 'search_vector'",
+    "sqlite": "SELECT 1 FROM sqlite_master WHERE name = 'soap_notes_fts'",
+}
+SNIPPET_WORDS = 20
+
+# Database URLs whose full-text index has been seen; a missing one is checked again on the next search
+_indexed = set()
+
+
+def ensure_search_index(bind) -> bool:
+    """Create the dialect's full-text index if missing; safe to call repeatedly.
+
+    Part of init_db / upgrade_db: on Postgres the generated column rewrites
+    soap_notes, so it must not run from a request. Returns False for dialects
+    without full-text support, which fall back to substring matching.
+    """
+    dialect = bind.dialect.name
+    if dialect == "postgresql":
+        statements = POSTGRES_DDL
+    elif dialect == "sqlite":
+        statements = SQLITE_DDL
+    else:
+        metrics.logger.warning("Full-text search is not supported on %s; search falls back to LIKE", dialect)
+        return False
+    with bind.begin() as conn:
+        created = dialect == "sqlite" and conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'soap_notes_fts'"
+        )).first() is None
+        for statement in statements:
+            conn.execute(text(statement))
+        if created:
+            # Index notes written before the FTS table and its triggers existed
+            conn.execute(text("INSERT INTO soap_notes_fts(soap_notes_fts) VALUES ('rebuild')"))
+    return True
+
+
+async def _has_index(db, bind) -> bool:
+    key = str(bind.url)
+    if key in _indexed:
+        return True
+    check = INDEX_CHECKS.get(bind.dialect.name)
+    if check is None or (await db.execute(text(check))).first() is None:
+        return False
+    _indexed.add(key)
+    return True
+
+
+def like_pattern(term: str) -> str:
+    # "!" is the escape character: the only one every dialect accepts in a plain literal
+    return "%" + term.replace("!", "!!").replace("%", "!%").replace("_", "!_") + "%"
+
+
+def highlight(snippet: Optional[str]) -> str:
+    # Note text is escaped; only the match markers become markup
+    return html.escape(snippet or "").replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+def like_snippet(content: str, terms) -> str:
+    words = (content or "").split()
+    lowered = [word.lower() for word in words]
+    first = next((i for i, word in enumerate(lowered) if any(t in word for t in terms)), 0)
+    start = max(0, first - SNIPPET_WORDS // 4)
+    marked = [
+        f"<mark>{html.escape(word)}</mark>" if any(t in lowered[i] for t in terms) else html.escape(word)
+        for i, word in enumerate(words[start:start + SNIPPET_WORDS], start)
+    ]
+    return ("…" if start else "") + " ".join(marked) + ("…" if start + SNIPPET_WORDS < len(words) else "")
+
+
+def fts5_query(query: str) -> str:
+    # Quote every term so user input is never parsed as FTS5 syntax; "quoted phrases" stay phrases
+    terms = []
+    for phrase, word in re.findall(r'"([^"]+)"|(\S+)', query):
+        term = (phrase or word).replace('"', '""')
+        terms.append(f'"{term}"')
+    return " ".join(terms)
+
+
+async def search_notes(db, query: str, patient_id: Optional[str] = None, limit: int = 20, offset: int = 0):
+    """Ranked full-text search over note content and patient names, with highlighted snippets.
+
+    Snippets are escaped HTML in which only the ``<mark>`` tags are markup.
+
+    Without a full-text index (unsupported dialect, or a database not yet
+    upgraded) every term must appear as a substring; results are newest first.
+    """
+    bind = db.get_bind()
+    params = {"limit": limit, "offset": offset}
+    if patient_id:
+        params["patient_id"] = patient_id
+    if not await _has_index(db, bind):
+        return await _like_search(db, query, params)
+
+    patient_filter = ""
+    if bind.dialect.name == "postgresql":
+        sql = POSTGRES_SEARCH
+        params["query"] = query
+        params["headline_options"] = (f"StartSel={MARK_START}, StopSel={MARK_END}, "
+                                      "MaxFragments=2, MaxWords=20, MinWords=5")
+        if patient_id:
+            patient_filter = "AND patient_id = :patient_id"
+    else:
+        sql = SQLITE_SEARCH
+        params["query"] = fts5_query(query)
+        params["mark_start"], params["mark_end"] = MARK_START, MARK_END
+        if patient_id:
+            patient_filter = "AND n.patient_id = :patient_id"
+
+    rows = await db.execute(text(sql.format(patient_filter=patient_filter)), params)
+    return [dict(row._mapping, snippet=highlight(row.snippet)) for row in rows]
+
+
+async def _like_search(db, query: str, params: dict):
+    terms = [(phrase or word).lower() for phrase, word in re.findall(r'"([^"]+)"|(\S+)', query)]
+    filters = []
+    for i, term in enumerate(terms):
+        params[f"term{i}"] = like_pattern(term)
+        filters.append(f"(LOWER(content) LIKE :term{i} ESCAPE '!' OR LOWER(patient_name) LIKE :term{i} ESCAPE '!')")
+    patient_filter = "AND patient_id = :patient_id" if "patient_id" in params else ""
+    rows = await db.execute(text(LIKE_SEARCH.format(term_filter=" AND ".join(filters) or "1 = 1",
+                                                    patient_filter=patient_filter)), params)
+    return [
+        {"id": row.id, "patient_id": row.patient_id, "patient_name": row.patient_name,
+         "created_at": row.created_at, "rank": None, "snippet": like_snippet(row.content, terms)}
+        for row in rows
+    ]
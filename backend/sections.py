@@ -0,0 +1,121 @@
+import re
+from sqlalchemy import update
+from database import SessionLocal
+from models import SoapNoteDB
+
+# Structured columns on soap_notes, in SOAP order
+SECTION_FIELDS = ("subjective", "objective", "assessment", "plan")
+
+# Headings the templates (and the model's variations on them) produce, mapped to their column.
+# Differential diagnosis and the closing summary are part of the clinical assessment.
+SECTION_ALIASES = {
+    "subjective": "subjective",
+    "objective": "objective",
+    "assessment": "assessment",
+    "differential diagnosis": "assessment",
+    "differential diagnoses": "assessment",
+    "conclusion": "assessment",
+    "plan": "plan",
+}
+HEADING_PATTERN = re.compile(
+    r"^\s*(?:#{1,6}\s*)?\**\s*(" + "|".join(sorted(SECTION_ALIASES, key=len, reverse=True)) + r")\s*\**\s*:?\s*\**\s*$",
+    re.IGNORECASE,
+)
+# "• Chief Complaint:" / "- **Vital Signs:**" at the top level of a section
+SUBSECTION_PATTERN = re.compile(r"^[•*\-]\s+\**([^:*]{2,80}?)\**\s*:\**\s*(.*)$")
+
+
+def parse_note(content: str) -> dict:
+    """Split a rendered SOAP note into ``{field: {"text", "subsections"}}``.
+
+    Fields whose heading does not appear are left out; text before the first
+    heading (title, date, provider) is not part of any section.
+    """
+    parsed = {}
+    current = None
+    for line in (content or "").splitlines():
+        heading = HEADING_PATTERN.match(line)
+        if heading:
+            name = heading.group(1).lower()
+            current = parsed.setdefault(SECTION_ALIASES[name], {"lines": [], "subsections": {}})
+            current["subsection"] = None
+            if SECTION_ALIASES[name] != name:
+                # Keep folded headings (e.g. Differential Diagnosis) visible inside their section
+                current["lines"].append(f"{heading.group(1).strip()}:")
+            continue
+        if current is None:
+            continue
+        current["lines"].append(line)
+        subsection = SUBSECTION_PATTERN.match(line)
+        if subsection:
+            current["subsection"] = subsection.group(1).strip()
+            current["subsections"].setdefault(current["subsection"], [])
+            if subsection.group(2).strip():
+                current["subsections"][current["subsection"]].append(subsection.group(2).strip())
+        elif current["subsection"] is not None and line.strip():
+            current["subsections"][current["subsection"]].append(line.strip())
+
+    return {
+        field: {
+            "text": "\n".join(section["lines"]).strip(),
+            "subsections": {name: "\n".join(lines) for name, lines in section["subsections"].items()},
+        }
+        for field, section in parsed.items()
+    }
+
+
+def section_columns(content: str) -> dict:
+    # Values for every structured column, so notes without a heading store NULL
+    parsed = parse_note(content)
+    return {field: parsed.get(field) for field in SECTION_FIELDS}
+
+
+def parse_sections(sections) -> tuple:
+    """Validate a comma-separated section list; None means the whole note."""
+    if not sections:
+        return None
+    requested = [s.strip().lower() for s in sections.split(",") if s.strip()]
+    unknown = [s for s in requested if s not in SECTION_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown sections: {', '.join(unknown)}; expected {', '.join(SECTION_FIELDS)}")
+    return tuple(field for field in SECTION_FIELDS if field in requested)
+
+
+def render_sections(note, fields) -> str:
+    """Render only ``fields`` of a note; falls back to the full text for unstructured notes."""
+    parts = [
+        f"{field.upper()}:\n{getattr(note, field)['text']}"
+        for field in fields
+        if getattr(note, field, None)
+    ]
+    return "\n\n".join(parts) if parts else note.content
+
+
+def backfill_sections(batch_size: int = 500) -> int:
+    """Parse notes stored before structured columns existed; returns how many were updated."""
+    db = SessionLocal()
+    updated = 0
+    last_id = 0
+    try:
+        while True:
+            rows = db.query(SoapNoteDB.id, SoapNoteDB.content).filter(
+                SoapNoteDB.id > last_id,
+                *(getattr(SoapNoteDB, field).is_(None) for field in SECTION_FIELDS),
+            ).order_by(SoapNoteDB.id).limit(batch_size).all()
+            if not rows:
+                return updated
+            for note_id, content in rows:
+                columns = section_columns(content)
+                if any(columns.values()):
+                    db.execute(update(SoapNoteDB).where(SoapNoteDB.id == note_id).values(**columns))
+                    updated += 1
+            db.commit()
+            last_id = rows[-1][0]
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    print("Backfilling structured SOAP sections...")
+    count = backfill_sections()
+    print(f"Structured sections stored for {count} notes")
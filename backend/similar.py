@@ -0,0 +1,364 @@
+import fcntl
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import or_, select
+from starlette.concurrency import run_in_threadpool
+from database import SessionLocal
+from models import SoapNoteDB
+
+load_dotenv()
+
+SIMILAR_INDEX_DIR = os.getenv("SIMILAR_INDEX_DIR", "./similar_index")
+# Hashed feature space; float32 rows put 100k notes at ~400 MB with the default 1024
+SIMILAR_DIM = int(os.getenv("SIMILAR_DIM", "1024"))
+# "assessment" embeds the Assessment section (falling back to the whole note); "content" the whole note
+SIMILAR_SOURCE = os.getenv("SIMILAR_SOURCE", "assessment")
+SYNC_BATCH_SIZE = 1000
+# Ids skipped by a sync may belong to transactions that commit later; they are looked for this long
+SIMILAR_GAP_SECONDS = float(os.getenv("SIMILAR_GAP_SECONDS", "600"))
+
+DF_FILE = re.compile(r"df(\.\d+)?\.npy$")
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset(
+    "the and for with was were has have had not but are this that from patient reports reported "
+    "mentioned documented none transcript".split()
+)
+
+
+def note_text(content: str, assessment) -> str:
+    if SIMILAR_SOURCE == "assessment" and assessment and assessment.get("text"):
+        return assessment["text"]
+    return content or ""
+
+
+def features(text: str):
+    tokens = [t for t in TOKEN_PATTERN.findall(text.lower()) if len(t) > 2 and t not in STOPWORDS]
+    # Bigrams keep phrases like "chest pain" apart from "pain" and "chest" elsewhere
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+def hashed_tf(text: str, dim: int = SIMILAR_DIM):
+    """Signed feature hashing with sublinear term frequency; returns ``(vector, buckets)``."""
+    vector = np.zeros(dim, np.float32)
+    for feature in features(text):
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % dim] += 1.0 if (h // dim) & 1 else -1.0
+    buckets = np.flatnonzero(vector)
+    vector[buckets] = np.sign(vector[buckets]) * (1 + np.log(np.abs(vector[buckets])))
+    return vector, buckets
+
+
+class SimilarityIndex:
+    """Append-only, memory-mapped matrix of L2-normalized hashed TF-IDF rows.
+
+    Files in ``path``: ``vectors.f32`` (rows), ``ids.i64`` (note id per row,
+    in the order appended), ``df.<count>.npy`` (document frequency per bucket)
+    and ``meta.json``, which names the row count, df file and open id gaps and
+    is replaced last. IDF is frozen into each row when it is appended;
+    ``rebuild()`` refreshes it. Writers in every process serialize on
+    ``index.lock``.
+    """
+
+    def __init__(self, path: str = SIMILAR_INDEX_DIR, dim: int = SIMILAR_DIM):
+        self.path = path
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._load()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _file_lock(self):
+        # Shared by every worker process using this directory; held for appends and rebuilds
+        with open(self._file("index.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _remove_files(self):
+        names = ["vectors.f32", "ids.i64", "meta.json"] + [n for n in os.listdir(self.path) if DF_FILE.match(n)]
+        for name in names:
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+
+    def _read_meta(self) -> dict:
+        if not os.path.exists(self._file("meta.json")):
+            return {}
+        with open(self._file("meta.json")) as f:
+            return json.load(f)
+
+    def _load(self):
+        os.makedirs(self.path, exist_ok=True)
+        meta = self._read_meta()
+        if meta.get("dim", self.dim) != self.dim:
+            # Different feature space: start over rather than mix incompatible rows
+            with self._file_lock():
+                self._remove_files()
+            meta = {}
+        self._apply(meta)
+
+    def _apply(self, meta: dict):
+        self.count = meta.get("count", 0)
+        self.last_note_id = meta.get("last_note_id", 0)
+        self.generation = meta.get("generation")
+        # (first id, last id, first seen) ranges below last_note_id that were missing when synced
+        self.gaps = [tuple(gap) for gap in meta.get("gaps", [])]
+        df_file = self._file(meta.get("df_file", "df.npy"))
+        self.df = np.load(df_file) if meta and os.path.exists(df_file) else np.zeros(self.dim, np.int64)
+        self._map()
+
+    def _refresh(self):
+        # Another process may have appended or rebuilt since this one last looked
+        meta = self._read_meta()
+        if (meta.get("count", 0), meta.get("last_note_id", 0), meta.get("generation")) != \
+                (self.count, self.last_note_id, self.generation):
+            with self._lock:
+                self._apply(meta)
+
+    def _map(self):
+        if self.count:
+            self.vectors = np.memmap(self._file("vectors.f32"), np.float32, "r", shape=(self.count, self.dim))
+            self.ids = np.memmap(self._file("ids.i64"), np.int64, "r", shape=(self.count,))
+        else:
+            self.vectors = np.zeros((0, self.dim), np.float32)
+            self.ids = np.zeros(0, np.int64)
+
+    def _save_meta(self, count: int, last_note_id: int, df, gaps):
+        # df goes to a new file that meta.json points at, so the pair is swapped in one replace
+        previous = self._read_meta().get("df_file", "df.npy")
+        df_file = f"df.{count}.npy"
+        np.save(self._file(df_file), df)
+        with open(self._file("meta.json.tmp"), "w") as f:
+            json.dump({"dim": self.dim, "count": count, "last_note_id": last_note_id,
+                       "generation": self.generation, "df_file": df_file, "gaps": gaps}, f)
+        os.replace(self._file("meta.json.tmp"), self._file("meta.json"))
+        if previous and previous != df_file and os.path.exists(self._file(previous)):
+            os.remove(self._file(previous))
+
+    def idf(self, count: int = None, df=None):
+        count = self.count if count is None else count
+        df = self.df if df is None else df
+        return np.log((1 + count) / (1 + df)).astype(np.float32) + 1
+
+    def embed(self, text: str):
+        vector, _ = hashed_tf(text, self.dim)
+        vector *= self.idf()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def append(self, rows, gaps=None):
+        """Append ``[(note_id, text)]`` and record the open ``gaps``; call with the file lock held."""
+        if not rows:
+            return
+        df = self.df.copy()
+        tfs = []
+        for _, text in rows:
+            vector, buckets = hashed_tf(text, self.dim)
+            df[buckets] += 1
+            tfs.append(vector)
+        count = self.count + len(rows)
+        matrix = np.vstack(tfs) * self.idf(count, df)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = (matrix / np.where(norms == 0, 1, norms)).astype(np.float32)
+        ids = np.array([note_id for note_id, _ in rows], np.int64)
+        for name, data, row_bytes in (("vectors.f32", matrix, self.dim * 4), ("ids.i64", ids, 8)):
+            with open(self._file(name), "ab") as f:
+                # Bytes past the last committed row are left over from an interrupted append
+                f.truncate(self.count * row_bytes)
+                f.write(data.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        last_note_id = max(self.last_note_id, int(ids.max()))
+        gaps = self.gaps if gaps is None else gaps
+        # The rows only count once meta.json says so
+        self._save_meta(count, last_note_id, df, gaps)
+        with self._lock:
+            self.count, self.last_note_id, self.df, self.gaps = count, last_note_id, df, gaps
+            self._map()
+
+    def _snapshot(self):
+        # Rows and ids are remapped together on append; read them as a pair
+        with self._lock:
+            return self.vectors, self.ids
+
+    def vector_for(self, note_id: int):
+        vectors, ids = self._snapshot()
+        # Late commits are appended out of id order, so this is a scan rather than a binary search
+        rows = np.flatnonzero(ids == note_id)
+        if len(rows):
+            return np.asarray(vectors[rows[0]], np.float32)
+        return None
+
+    def search(self, query, k: int = 10, exclude_ids=()):
+        """Top-``k`` ``[(note_id, score)]`` by cosine similarity to the unit vector ``query``."""
+        vectors, ids = self._snapshot()
+        if not len(ids):
+            return []
+        scores = vectors @ query.astype(np.float32)
+        if exclude_ids:
+            scores[np.isin(ids, list(exclude_ids))] = -np.inf
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), round(float(scores[i]), 4)) for i in top if scores[i] > 0]
+
+    def sync(self) -> int:
+        """Append notes stored since the last sync: rows past ``last_note_id`` and late commits in open gaps."""
+        if not self._sync_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self._file_lock():
+                self._refresh()
+                return self._catch_up()
+        finally:
+            self._sync_lock.release()
+
+    def _catch_up(self) -> int:
+        db = SessionLocal()
+        try:
+            added = self._fill_gaps(db)
+            while True:
+                rows = db.execute(
+                    select(SoapNoteDB.id, SoapNoteDB.content, SoapNoteDB.assessment)
+                    .where(SoapNoteDB.id > self.last_note_id)
+                    .order_by(SoapNoteDB.id).limit(SYNC_BATCH_SIZE)
+                ).all()
+                if not rows:
+                    return added
+                gaps = self.gaps + gaps_between(self.last_note_id, [row.id for row in rows], time.time())
+                self.append(_texts(rows), gaps)
+                added += len(rows)
+        finally:
+            db.close()
+
+    def _fill_gaps(self, db) -> int:
+        # A lower id can commit after a higher one was indexed (bulk import and the note writer
+        # run side by side); ids skipped over are looked up again until SIMILAR_GAP_SECONDS pass
+        now = time.time()
+        gaps = [gap for gap in self.gaps if now - gap[2] < SIMILAR_GAP_SECONDS]
+        rows = []
+        if gaps:
+            rows = db.execute(
+                select(SoapNoteDB.id, SoapNoteDB.content, SoapNoteDB.assessment)
+                .where(or_(*[SoapNoteDB.id.between(first, last) for first, last, _ in gaps]))
+                .order_by(SoapNoteDB.id)
+            ).all()
+        if rows:
+            self.append(_texts(rows), without_ids(gaps, {row.id for row in rows}))
+        else:
+            # Expired gaps are dropped from meta.json with the next append
+            self.gaps = gaps
+        return len(rows)
+
+    def rebuild(self) -> int:
+        with self._sync_lock, self._file_lock():
+            self._remove_files()
+            with self._lock:
+                self._apply({})
+                # Tells other processes their mapping is stale even if the counts come out the same
+                self.generation = uuid.uuid4().hex
+            return self._catch_up()
+
+
+def _texts(rows):
+    return [(note_id, note_text(content, assessment)) for note_id, content, assessment in rows]
+
+
+def gaps_between(after: int, ids, seen: float) -> list:
+    """Ranges of ids missing between ``after`` and each of the ascending ``ids``."""
+    gaps = []
+    for note_id in ids:
+        if note_id > after + 1:
+            gaps.append((after + 1, note_id - 1, seen))
+        after = note_id
+    return gaps
+
+
+def without_ids(gaps, found) -> list:
+    # Splits each gap around the ids that have now been indexed
+    remaining = []
+    for first, last, seen in gaps:
+        start = first
+        for note_id in sorted(i for i in found if first <= i <= last):
+            if note_id > start:
+                remaining.append((start, note_id - 1, seen))
+            start = note_id + 1
+        if start <= last:
+            remaining.append((start, last, seen))
+    return remaining
+
+
+index = SimilarityIndex()
+
+
+async def find_similar(db, note_id: int = None, text: str = None, k: int = 10,
+                       other_patients: bool = True):
+    """Nearest notes to a stored note or to free text, with the matched notes' metadata."""
+    # Catch up on notes written since the last sync (cheap when there are none)
+    await run_in_threadpool(index.sync)
+    exclude, patient_id = set(), None
+    if note_id is not None:
+        row = (await db.execute(
+            select(SoapNoteDB.patient_id, SoapNoteDB.content, SoapNoteDB.assessment).where(SoapNoteDB.id == note_id)
+        )).first()
+        if row is None:
+            return None
+        patient_id = row.patient_id
+        exclude.add(note_id)
+        query = index.vector_for(note_id)
+        if query is None:
+            query = index.embed(note_text(row.content, row.assessment))
+    else:
+        query = index.embed(text)
+
+    # Over-fetch so dropping the patient's own notes still leaves k results
+    hits = index.search(query, k * 4 if other_patients and patient_id else k, exclude)
+    if not hits:
+        return []
+    rows = {
+        row.id: row for row in (await db.execute(
+            select(SoapNoteDB.id, SoapNoteDB.patient_id, SoapNoteDB.patient_name,
+                   SoapNoteDB.created_at, SoapNoteDB.assessment)
+            .where(SoapNoteDB.id.in_([hit_id for hit_id, _ in hits]))
+        )).all()
+    }
+    results = []
+    for hit_id, score in hits:
+        row = rows.get(hit_id)
+        # Rows deleted since they were indexed are skipped
+        if row is None or (other_patients and patient_id and row.patient_id == patient_id):
+            continue
+        results.append({
+            "id": row.id,
+            "patient_id": row.patient_id,
+            "patient_name": row.patient_name,
+            "created_at": row.created_at,
+            "score": score,
+            "assessment": row.assessment["text"] if row.assessment else None,
+        })
+        if len(results) == k:
+            break
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+        print("Rebuilding similar-case index...")
+        print(f"Indexed {index.rebuild()} notes")
+    else:
+        print("Syncing similar-case index...")
+        print(f"Indexed {index.sync()} new notes ({index.count} total)")
@@ -0,0 +1,64 @@
+import inspect
+import json
+import time
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Stop nginx and similar proxies from buffering the event stream
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(event: str, data) -> str:
+    payload = json.dumps(jsonable_encoder(data), ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+async def stream_llm(llm, prompt_text: str, metadata: dict, on_complete=None):
+    """Forward LLM chunks as ``token`` events, then a ``done`` event with the full text.
+
+    The ``done`` event carries ``metadata`` plus the complete text, the chunk
+    count and the time to the first token. ``on_complete(text, model)`` gets
+    the model that answered and may return an awaitable; it is awaited before
+    the ``done`` event is sent.
+    """
+    started = time.perf_counter()
+    first_token_ms = None
+    parts = []
+    answered_by = []
+    async for chunk in llm.astream(prompt_text, answered_by=answered_by):
+        text = chunk.content
+        if not text:
+            continue
+        if first_token_ms is None:
+            first_token_ms = round((time.perf_counter() - started) * 1000)
+        parts.append(text)
+        yield sse_event("token", {"text": text})
+
+    text = "".join(parts)
+    if on_complete is not None:
+        result = on_complete(text, answered_by[0] if answered_by else None)
+        if inspect.isawaitable(result):
+            await result
+
+    yield sse_event("done", dict(
+        metadata,
+        text=text,
+        chunks=len(parts),
+        first_token_ms=first_token_ms,
+        total_ms=round((time.perf_counter() - started) * 1000),
+    ))
+
+
+def sse_response(events, background=None) -> StreamingResponse:
+    async def guarded():
+        try:
+            async for event in events:
+                yield event
+        except Exception as e:
+            # Headers are already sent, so errors travel in-band
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(guarded(), media_type="text/event-stream", headers=SSE_HEADERS, background=background)
@@ -0,0 +1,224 @@
+import os
+import threading
+from datetime import datetime
+from dotenv import load_dotenv
+from sqlalchemy import func
+from database import SessionLocal
+from models import PatientSummaryDB, SoapNoteDB
+from prompt_budget import count_tokens
+from providers import real_content
+from sections import render_sections
+
+load_dotenv()
+
+# Token budgets, counted with tiktoken's cl100k_base as an approximation of the model tokenizer
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "1500"))
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "12000"))
+ANALYSIS_TOKEN_BUDGET = int(os.getenv("ANALYSIS_TOKEN_BUDGET", "16000"))
+RECENT_NOTES = int(os.getenv("ANALYSIS_RECENT_NOTES", "3"))
+SUMMARY_LOCK_STRIPES = int(os.getenv("SUMMARY_LOCK_STRIPES", "64"))
+
+# Serializes summary updates per patient so concurrent refreshes do not fold the same delta twice;
+# a fixed set of locks shared by hash, so memory does not grow with the number of patients
+_patient_locks = [threading.Lock() for _ in range(SUMMARY_LOCK_STRIPES)]
+
+MAP_PROMPT = """
+Summarize the following SOAP notes for one patient into a concise longitudinal clinical summary.
+Keep diagnoses, chronic conditions, medications with doses, allergies, key results with dates,
+and how the condition changed over time. Use at most {budget} tokens.
+
+SOAP Notes:
+{notes}
+"""
+
+REDUCE_PROMPT = """
+Merge the following partial clinical summaries of the same patient, in chronological order,
+into one concise longitudinal summary. Remove duplication, keep dates and changes over time.
+Use at most {budget} tokens.
+
+Partial summaries:
+{summaries}
+"""
+
+FOLD_PROMPT = """
+Here is the current longitudinal clinical summary of a patient, followed by new SOAP notes.
+Update the summary so it also reflects the new notes: add new findings, diagnoses and medication
+changes, and note how the condition has changed. Keep it concise, at most {budget} tokens.
+
+Current summary:
+{summary}
+
+New SOAP Notes:
+{notes}
+"""
+
+
+def format_note(note, sections=None) -> str:
+    # `sections` limits the note to those structured sections, e.g. ("assessment", "plan")
+    body = render_sections(note, sections) if sections else note.content
+    return f"Date: {note.created_at}\n{body}"
+
+
+def _chunk_notes(notes, chunk_tokens: int):
+    # Group notes into chunks that each fit one summarization call
+    chunks, current, used = [], [], 0
+    for note in notes:
+        tokens = count_tokens(note.content)
+        if current and used + tokens > chunk_tokens:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(note)
+        used += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def map_reduce_summary(llm, notes) -> str:
+    """Backfill: summarize note chunks in parallel, then merge the partial summaries."""
+    chunks = _chunk_notes(notes, SUMMARY_CHUNK_TOKENS)
+    prompts = [
+        MAP_PROMPT.format(budget=SUMMARY_TOKEN_BUDGET, notes="\n\n".join(format_note(n) for n in chunk))
+        for chunk in chunks
+    ]
+    # A stubbed answer raises here, before any summary state is written
+    summaries = [real_content(result) for result in llm.batch(prompts)]
+
+    # Merge in groups that fit the chunk budget until a single summary remains
+    while len(summaries) > 1:
+        groups, current, used = [], [], 0
+        for summary in summaries:
+            tokens = count_tokens(summary)
+            if current and used + tokens > SUMMARY_CHUNK_TOKENS:
+                groups.append(current)
+                current, used = [], 0
+            current.append(summary)
+            used += tokens
+        groups.append(current)
+        if len(groups) == len(summaries):
+            # Every summary is too large to pair up; merge them two at a time
+            groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+        prompts = [
+            REDUCE_PROMPT.format(budget=SUMMARY_TOKEN_BUDGET, summaries="\n\n---\n\n".join(group))
+            for group in groups
+        ]
+        summaries = [real_content(result) for result in llm.batch(prompts)]
+    return summaries[0]
+
+
+def fold_notes(llm, summary: str, notes) -> str:
+    """Fold only the new notes into an existing summary."""
+    if count_tokens("".join(n.content for n in notes)) > SUMMARY_CHUNK_TOKENS:
+        delta = map_reduce_summary(llm, notes)
+        notes_text = f"Summary of new notes:\n{delta}"
+    else:
+        notes_text = "\n\n".join(format_note(n) for n in notes)
+    return real_content(llm.invoke(FOLD_PROMPT.format(
+        budget=SUMMARY_TOKEN_BUDGET, summary=summary, notes=notes_text
+    )))
+
+
+def _patient_lock(patient_id: str):
+    return _patient_locks[hash(patient_id) % len(_patient_locks)]
+
+
+def update_patient_summary(db, llm, patient_id: str):
+    """Bring a patient's rolling summary up to date and return it (or None without notes)."""
+    with _patient_lock(patient_id):
+        return _update_patient_summary(db, llm, patient_id)
+
+
+def _update_patient_summary(db, llm, patient_id: str):
+    db.expire_all()
+    row = db.query(PatientSummaryDB).filter(PatientSummaryDB.patient_id == patient_id).first()
+    last_note_id = row.last_note_id if row else 0
+    rebuild = row is None
+    if row is not None:
+        # Concurrent writers (bulk import, the note writer) can commit a lower id after a higher one
+        # was folded; the watermark alone would skip that note for good, so a count mismatch
+        # below it rebuilds the summary from every note
+        settled = db.query(func.count(SoapNoteDB.id)).filter(
+            SoapNoteDB.patient_id == patient_id,
+            SoapNoteDB.id <= last_note_id,
+        ).scalar()
+        if settled != row.note_count:
+            rebuild, last_note_id = True, 0
+
+    delta = db.query(SoapNoteDB).filter(
+        SoapNoteDB.patient_id == patient_id,
+        SoapNoteDB.id > last_note_id,
+    ).order_by(SoapNoteDB.created_at, SoapNoteDB.id).all()
+    if not delta:
+        return row
+
+    if rebuild:
+        summary = map_reduce_summary(llm, delta)
+        if row is None:
+            row = PatientSummaryDB(patient_id=patient_id)
+            db.add(row)
+        row.note_count = 0
+    else:
+        summary = fold_notes(llm, row.summary, delta)
+
+    row.summary = summary
+    row.patient_name = delta[-1].patient_name
+    row.last_note_id = max(note.id for note in delta)
+    row.note_count += len(delta)
+    row.summary_tokens = count_tokens(summary)
+    row.updated_at = datetime.utcnow()
+    db.commit()
+    db.refresh(row)
+    return row
+
+
+def refresh_summary(llm, patient_id: str):
+    # Background entry point, run on the worker pool after a note is stored
+    db = SessionLocal()
+    try:
+        update_patient_summary(db, llm, patient_id)
+    finally:
+        db.close()
+
+
+def resolve_patient_id(db, patient_identifier: str, search_by: str):
+    if search_by != "name":
+        return patient_identifier
+    ids = [row[0] for row in db.query(SoapNoteDB.patient_id).filter(
+        SoapNoteDB.patient_name == patient_identifier
+    ).distinct().limit(2)]
+    # A name shared by several patient ids cannot be summarized as one patient
+    return ids[0] if len(ids) == 1 else None
+
+
+def build_case_context(db, llm, patient_identifier: str, search_by: str, sections=None):
+    """Return ``(summary, recent_notes, note_count)`` for a case analysis.
+
+    The summary covers the whole history; recent notes are added newest first
+    while they fit ``ANALYSIS_TOKEN_BUDGET``. Returns ``None`` when the
+    identifier does not resolve to a single patient with notes.
+    """
+    patient_id = resolve_patient_id(db, patient_identifier, search_by)
+    if patient_id is None:
+        return None
+    row = update_patient_summary(db, llm, patient_id)
+    if row is None:
+        return None
+
+    note_count = db.query(func.count(SoapNoteDB.id)).filter(SoapNoteDB.patient_id == patient_id).scalar()
+    recent = db.query(SoapNoteDB).filter(
+        SoapNoteDB.patient_id == patient_id
+    ).order_by(SoapNoteDB.created_at.desc(), SoapNoteDB.id.desc()).limit(RECENT_NOTES).all()
+
+    return row.summary, trim_notes(recent, ANALYSIS_TOKEN_BUDGET - row.summary_tokens, sections), note_count
+
+
+def trim_notes(notes, budget: int, sections=None):
+    # Keep notes in order while they fit the token budget
+    selected = []
+    for note in notes:
+        tokens = count_tokens(format_note(note, sections))
+        if tokens > budget:
+            break
+        selected.append(note)
+        budget -= tokens
+    return selected
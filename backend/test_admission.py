@@ -0,0 +1,197 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+from starlette.requests import Request
+import admission
+from auth import ALGORITHM, SECRET_KEY
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission, "time", SimpleNamespace(monotonic=clock.monotonic, perf_counter=time.perf_counter))
+    return clock
+
+
+def make_request(token=None, host="10.0.0.1"):
+    headers = [(b"authorization", f"Bearer {token}".encode())] if token else []
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": headers, "client": (host, 1234)})
+
+
+def test_burst_then_refill(clock):
+    buckets = admission.TokenBuckets(rate=1, burst=3)
+    assert [buckets.take("a") for _ in range(3)] == [0, 0, 0]
+    assert buckets.take("a") == pytest.approx(1)
+    # Other callers have their own bucket
+    assert buckets.take("b") == 0
+    clock.now += 2
+    assert buckets.take("a") == 0 and buckets.take("a") == 0
+    assert buckets.take("a") > 0
+
+
+def test_costs_above_the_burst_leave_the_bucket_in_debt(clock):
+    buckets = admission.TokenBuckets(rate=1, burst=10, max_cost=50)
+    assert buckets.take("a", cost=30) == 0
+    # Twenty tokens of debt, then one more for the next request
+    assert buckets.take("a") == pytest.approx(21)
+    clock.now += 21
+    assert buckets.take("a") == 0
+
+
+def test_large_requests_wait_for_a_full_bucket(clock):
+    buckets = admission.TokenBuckets(rate=1, burst=10, max_cost=50)
+    buckets.take("a", cost=4)
+    assert buckets.take("a", cost=30) == pytest.approx(4)
+
+
+def test_cost_is_capped_at_max_cost(clock):
+    buckets = admission.TokenBuckets(rate=1, burst=10, max_cost=50)
+    assert buckets.take("a", cost=1000) == 0
+    assert buckets.take("a") == pytest.approx(41)
+
+
+def test_charge_adds_debt_down_to_the_cap(clock):
+    buckets = admission.TokenBuckets(rate=1, burst=10, max_cost=50)
+    buckets.take("a")
+    buckets.charge("a", 19)
+    assert buckets.take("a") == pytest.approx(11)
+    buckets.charge("a", 10_000)
+    assert buckets.take("a") == pytest.approx(51)
+
+
+def test_zero_rate_disables_limiting():
+    buckets = admission.TokenBuckets(rate=0, burst=1)
+    assert all(buckets.take("a", cost=100) == 0 for _ in range(5))
+
+
+def test_callers_are_keyed_by_token_subject_then_address():
+    token = jwt.encode({"sub": "doctor@example.com"}, SECRET_KEY, algorithm=ALGORITHM)
+    assert admission.caller_identity(make_request(token)) == "user:doctor@example.com"
+    assert admission.caller_identity(make_request("not-a-jwt")) == "ip:10.0.0.1"
+    assert admission.caller_identity(make_request()) == "ip:10.0.0.1"
+
+
+def test_rate_limited_requests_get_retry_after(monkeypatch):
+    monkeypatch.setattr(admission, "buckets", admission.TokenBuckets(rate=1 / 60, burst=1))
+    admission.admit(make_request(), admission.INTERACTIVE)
+    with pytest.raises(HTTPException) as error:
+        admission.admit(make_request(), admission.INTERACTIVE)
+    assert error.value.status_code == 429
+    assert 55 <= int(error.value.headers["Retry-After"]) <= 60
+
+
+def test_full_provider_queues_turn_requests_away(monkeypatch):
+    monkeypatch.setattr(admission.limiter("test-full-stack"), "max_queue", 0)
+    with pytest.raises(HTTPException) as error:
+        admission.admit(make_request(), admission.BULK, stacks=[[SimpleNamespace(name="test-full-stack")]])
+    assert error.value.status_code == 429
+
+
+def run_queued(limiter, entries, hold_first=0.05):
+    """Queue ``(name, level, weight)`` entries behind a held slot; returns the order they ran in."""
+    order = []
+
+    async def holder():
+        async with limiter.aslot(weight=limiter.limit):
+            await asyncio.sleep(hold_first)
+
+    async def call(name, level, weight):
+        admission.priority.set(level)
+        async with limiter.aslot(weight=weight):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        first = asyncio.ensure_future(holder())
+        await asyncio.sleep(0)
+        calls = []
+        for entry in entries:
+            calls.append(asyncio.ensure_future(call(*entry)))
+            await asyncio.sleep(0)
+        await asyncio.gather(first, *calls)
+
+    asyncio.run(main())
+    return order
+
+
+def test_queued_calls_run_by_priority_then_arrival():
+    limiter = admission.PriorityLimiter("test-priority", limit=1)
+    order = run_queued(limiter, [("bulk-1", admission.BULK, 1), ("analysis", admission.ANALYSIS, 1),
+                                 ("interactive", admission.INTERACTIVE, 1), ("bulk-2", admission.BULK, 1)])
+    assert order == ["interactive", "analysis", "bulk-1", "bulk-2"]
+    assert limiter.in_use == 0 and limiter.waiting == 0
+
+
+def test_heavy_waiter_is_not_overtaken():
+    limiter = admission.PriorityLimiter("test-weight", limit=2)
+    order = run_queued(limiter, [("heavy", admission.BULK, 2), ("light", admission.BULK, 1)])
+    assert order == ["heavy", "light"]
+
+
+def test_queue_limit_and_wait_timeout():
+    limiter = admission.PriorityLimiter("test-timeout", limit=1, max_queue=1, max_wait=0.05)
+
+    async def main():
+        async with limiter.aslot():
+            waiter = asyncio.ensure_future(limiter.aslot().__aenter__())
+            await asyncio.sleep(0)
+            with pytest.raises(admission.Overloaded):
+                async with limiter.aslot():
+                    pass
+            with pytest.raises(admission.Overloaded) as error:
+                await waiter
+            assert error.value.retry_after > 0
+        assert limiter.waiting == 0
+
+    asyncio.run(main())
+    assert limiter.in_use == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    limiter = admission.PriorityLimiter("test-cancel", limit=1)
+
+    async def main():
+        async with limiter.aslot():
+            waiter = asyncio.ensure_future(limiter.aslot().__aenter__())
+            await asyncio.sleep(0)
+            assert limiter.waiting == 1
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+            assert limiter.waiting == 0
+
+    asyncio.run(main())
+    assert limiter.in_use == 0
+
+
+def test_thread_slots_respect_the_limit():
+    limiter = admission.PriorityLimiter("test-threads", limit=2)
+    peak, active, lock = [0], [0], threading.Lock()
+
+    def work():
+        with limiter.slot():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 2 and limiter.in_use == 0
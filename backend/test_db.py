@@ -1,4 +1,6 @@
-from database import SessionLocal
+import asyncio
+from sqlalchemy import select
+from database import SessionLocal, connect_args, get_db, get_read_db, make_async_url, pool_options
 from models import SoapNoteDB
 
 def test_db_connection():
@@ -27,5 +29,34 @@ def test_db_connection():
     finally:
         db.close()
 
+def test_async_sessions_see_committed_notes(clean_db):
+    async def run():
+        async for db in get_db():
+            db.add(SoapNoteDB(patient_id="async1", patient_name="Jane Doe", content="Async note"))
+            await db.commit()
+        async for db in get_read_db():
+            return (await db.execute(select(SoapNoteDB.content).where(SoapNoteDB.patient_id == "async1"))).scalar()
+
+    assert asyncio.run(run()) == "Async note"
+
+def test_async_urls_use_async_drivers():
+    url = make_async_url("postgresql://user:pw@db:5432/soap?sslmode=require&application_name=api")
+    assert url.drivername == "postgresql+asyncpg"
+    # asyncpg takes ssl through connect_args, not the URL
+    assert dict(url.query) == {"application_name": "api"}
+    assert make_async_url("mysql+pymysql://user:pw@db/soap").drivername == "mysql+aiomysql"
+    assert make_async_url("sqlite:///soap.db").drivername == "sqlite+aiosqlite"
+
+def test_connect_args_per_driver():
+    url = "postgresql://user:pw@db/soap"
+    assert set(connect_args(url)) == {"sslmode", "connect_timeout"}
+    assert set(connect_args(url, is_async=True)) <= {"ssl", "timeout"}
+    assert connect_args("sqlite:///soap.db") == {}
+
+def test_pool_sizing_is_skipped_for_sqlite():
+    assert "pool_size" in pool_options("postgresql://user:pw@db/soap")
+    options = pool_options("sqlite:///soap.db")
+    assert "pool_size" not in options and "pool_pre_ping" in options
+
 if __name__ == "__main__":
     test_db_connection() 
\ No newline at end of file
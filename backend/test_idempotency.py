@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from fastapi import HTTPException, Response
+import cache
+import idempotency
+
+
+@pytest.fixture(autouse=True)
+def fresh_responses(clean_db, monkeypatch):
+    monkeypatch.setattr(idempotency, "responses", cache.ContentCache("idempotency"))
+
+
+class Endpoint:
+    """Counts how often the expensive work actually runs."""
+
+    def __init__(self, delay=0.0, error=None):
+        self.calls = 0
+        self.delay = delay
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {"soap_note": "S: cough", "call": self.calls}
+
+
+def request(endpoint, key, fingerprint="body-1"):
+    response = Response()
+    body = asyncio.run(idempotency.replay_or_run("/generate", key, fingerprint, response, endpoint))
+    return body, response.headers.get(idempotency.REPLAYED_HEADER)
+
+
+def test_requests_without_a_key_always_run():
+    endpoint = Endpoint()
+    request(endpoint, None)
+    request(endpoint, None)
+    assert endpoint.calls == 2
+
+
+def test_repeated_key_replays_the_stored_response():
+    endpoint = Endpoint()
+    first, replayed = request(endpoint, "key-1")
+    assert replayed is None
+    second, replayed = request(endpoint, "key-1")
+    assert (second, replayed) == (first, "true")
+    assert endpoint.calls == 1
+
+
+def test_replays_survive_a_restart(monkeypatch):
+    endpoint = Endpoint()
+    first, _ = request(endpoint, "key-1")
+    # A new process starts with an empty in-memory tier and reads the stored row
+    monkeypatch.setattr(idempotency, "responses", cache.ContentCache("idempotency"))
+    assert request(endpoint, "key-1") == (first, "true")
+    assert endpoint.calls == 1
+
+
+def test_keys_are_scoped_to_the_route():
+    endpoint = Endpoint()
+    request(endpoint, "key-1")
+    asyncio.run(idempotency.replay_or_run("/transcribe", "key-1", "body-1", Response(), endpoint))
+    assert endpoint.calls == 2
+
+
+def test_key_reused_for_a_different_body_conflicts():
+    endpoint = Endpoint()
+    request(endpoint, "key-1", fingerprint="body-1")
+    with pytest.raises(HTTPException) as error:
+        request(endpoint, "key-1", fingerprint="body-2")
+    assert error.value.status_code == 422
+    assert endpoint.calls == 1
+
+
+@pytest.mark.parametrize("key", ["", "k" * (idempotency.MAX_KEY_LENGTH + 1)])
+def test_key_length_is_checked(key):
+    with pytest.raises(HTTPException) as error:
+        request(Endpoint(), key)
+    assert error.value.status_code == 400
+
+
+def test_failures_are_not_stored():
+    failing = Endpoint(error=RuntimeError("provider down"))
+    with pytest.raises(RuntimeError):
+        request(failing, "key-1")
+    endpoint = Endpoint()
+    body, replayed = request(endpoint, "key-1")
+    assert replayed is None and endpoint.calls == 1
+
+
+def test_concurrent_retries_share_one_computation():
+    endpoint = Endpoint(delay=0.05)
+
+    async def together():
+        return await asyncio.gather(*(
+            idempotency.replay_or_run("/generate", "key-1", "body-1", Response(), endpoint) for _ in range(3)
+        ))
+
+    bodies = asyncio.run(together())
+    assert endpoint.calls == 1
+    assert bodies[0] == bodies[1] == bodies[2]
+
+
+def test_single_flight_coalesces_threads_and_shares_errors():
+    flight = idempotency.SingleFlight("test")
+    calls = []
+    started = threading.Event()
+
+    def slow(value):
+        calls.append(value)
+        started.set()
+        time.sleep(0.1)
+        return value * 2
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        leader = pool.submit(flight.do, "k", slow, 21)
+        started.wait()
+        followers = [pool.submit(flight.do, "k", slow, 21) for _ in range(2)]
+        assert [f.result() for f in [leader] + followers] == [42, 42, 42]
+    assert calls == [21]
+
+    def broken():
+        raise ValueError("bad audio")
+
+    with pytest.raises(ValueError):
+        flight.do("k", broken)
+    # The key is free again once the call has finished
+    assert flight.do("k", slow, 1) == 2
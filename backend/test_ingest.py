@@ -0,0 +1,48 @@
+import asyncio
+import hashlib
+import io
+import os
+import pytest
+from fastapi import UploadFile
+import ingest
+
+
+def upload(data: bytes, filename="visit.webm"):
+    return UploadFile(io.BytesIO(data), filename=filename)
+
+
+def staged_files():
+    return {name for name in os.listdir(ingest.UPLOAD_DIR) if name.startswith("soap_audio_")}
+
+
+def test_uploads_are_spooled_to_unique_files(monkeypatch):
+    monkeypatch.setattr(ingest, "UPLOAD_CHUNK_SIZE", 4)
+    data = b"0123456789"
+    first = asyncio.run(ingest.spool_upload(upload(data)))
+    second = asyncio.run(ingest.spool_upload(upload(data)))
+    try:
+        assert first != second and first.endswith(".webm")
+        with open(first, "rb") as f:
+            assert f.read() == data
+        assert ingest.content_hash(first) == hashlib.sha256(data).hexdigest()
+    finally:
+        ingest.remove_file(first)
+        ingest.remove_file(second)
+
+
+def test_oversized_uploads_leave_no_file(monkeypatch):
+    monkeypatch.setattr(ingest, "UPLOAD_CHUNK_SIZE", 4)
+    monkeypatch.setattr(ingest, "MAX_UPLOAD_BYTES", 8)
+    before = staged_files()
+    with pytest.raises(ingest.UploadTooLarge):
+        asyncio.run(ingest.spool_upload(upload(b"0123456789")))
+    assert staged_files() == before
+
+
+def test_uploads_without_an_extension_default_to_wav():
+    assert ingest.upload_suffix(upload(b"", filename="recording")) == ".wav"
+    assert ingest.upload_suffix(upload(b"", filename=None)) == ".wav"
+
+
+def test_remove_file_ignores_missing_files(tmp_path):
+    ingest.remove_file(str(tmp_path / "gone.wav"))
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import pytest
+from database import AsyncSessionLocal
+import jobs
+
+USAGE = {"prompt_version": "soap-v1", "input_tokens": 120, "output_tokens": 40, "trimmed_tokens": 0}
+
+
+def create_job():
+    async def run():
+        async with AsyncSessionLocal() as db:
+            return (await jobs.create_job(db, "en", filename="visit.wav")).id
+    return asyncio.run(run())
+
+
+def get_job(job_id):
+    async def run():
+        async with AsyncSessionLocal() as db:
+            return jobs.job_to_dict(await jobs.get_job(db, job_id), include_result=True)
+    return asyncio.run(run())
+
+
+def test_job_runs_every_stage_and_stores_the_result(clean_db):
+    job_id = create_job()
+    assert get_job(job_id)["status"] == "queued"
+    cleaned = threading.Event()
+    saved = []
+
+    def persist(transcript, soap_note, usage):
+        saved.append((transcript, soap_note))
+        return 7
+
+    jobs.submit_job(job_id, lambda: "Chest pain.", lambda transcript: (f"NOTE: {transcript}", dict(USAGE)),
+                    cleanup=cleaned.set, persist=persist).result(timeout=5)
+    job = get_job(job_id)
+    assert (job["status"], job["stage"], job["note_id"]) == ("completed", None, 7)
+    assert (job["transcript"], job["soap_note"]) == ("Chest pain.", "NOTE: Chest pain.")
+    assert job["usage"] == USAGE and job["finished_at"] is not None
+    assert saved == [("Chest pain.", "NOTE: Chest pain.")]
+    assert cleaned.is_set()
+
+
+def test_failed_stage_fails_the_job_and_still_cleans_up(clean_db):
+    job_id = create_job()
+    cleaned = threading.Event()
+
+    def transcribe():
+        raise RuntimeError("transcriber down")
+
+    jobs.submit_job(job_id, transcribe, lambda transcript: ("unused", {}), cleanup=cleaned.set).result(timeout=5)
+    job = get_job(job_id)
+    assert (job["status"], job["error"], job["stage"]) == ("failed", "transcriber down", "transcription")
+    assert cleaned.is_set()
+
+
+def test_full_queue_rejects_new_jobs(clean_db, monkeypatch):
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(jobs, "_slots", slots)
+    slots.acquire()
+    with pytest.raises(jobs.JobQueueFull):
+        jobs.submit_job(create_job(), lambda: "", lambda transcript: ("", {}))
+
+
+def test_wait_for_job_wakes_when_the_job_finishes(clean_db):
+    job_id = create_job()
+    release = threading.Event()
+
+    def transcribe():
+        release.wait(5)
+        return "Cough."
+
+    async def main():
+        jobs.submit_job(job_id, transcribe, lambda transcript: ("NOTE", dict(USAGE)))
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        loop.call_later(0.05, release.set)
+        await jobs.wait_for_job(job_id, timeout=5)
+        return loop.time() - started
+
+    assert asyncio.run(main()) < 2
+    assert get_job(job_id)["status"] == "completed"
+    assert job_id not in jobs._waiters
+
+
+def test_wait_for_job_times_out_and_forgets_the_waiter(clean_db):
+    job_id = create_job()
+    asyncio.run(jobs.wait_for_job(job_id, timeout=0.05))
+    assert job_id not in jobs._waiters
+    # Already finished (or unknown) jobs return at once
+    asyncio.run(asyncio.wait_for(jobs.wait_for_job("missing", timeout=5), 1))
@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from sqlalchemy.exc import IntegrityError
+from database import SessionLocal
+from models import SoapNoteDB
+from note_writer import NoteWriter, note_values
+
+NOTE = "SUBJECTIVE:\n• Chief Complaint: cough\n\nPLAN:\nRest and fluids."
+
+
+def values(i, **overrides):
+    return dict(note_values(f"p{i}", f"Patient {i}", NOTE, language="en"), **overrides)
+
+
+def stored_count():
+    db = SessionLocal()
+    try:
+        return db.query(SoapNoteDB).count()
+    finally:
+        db.close()
+
+
+def test_queued_notes_share_one_commit(clean_db):
+    batches = []
+    writer = NoteWriter(batch_size=100, max_delay_ms=200, after_commit=batches.append)
+    futures = [writer.submit(values(i)) for i in range(5)]
+    notes = [future.result(timeout=5) for future in futures]
+    assert [note["patient_id"] for note in notes] == [f"p{i}" for i in range(5)]
+    assert len({note["id"] for note in notes}) == 5
+    assert [len(batch) for batch in batches] == [5]
+    assert stored_count() == 5
+
+
+def test_batches_are_capped_at_batch_size(clean_db):
+    batches = []
+    writer = NoteWriter(batch_size=2, max_delay_ms=200, after_commit=batches.append)
+    futures = [writer.submit(values(i)) for i in range(5)]
+    for future in futures:
+        future.result(timeout=5)
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_stored_notes_carry_their_sections(clean_db):
+    note = NoteWriter().write(values(1))
+    db = SessionLocal()
+    try:
+        row = db.get(SoapNoteDB, note["id"])
+        assert row.subjective["subsections"] == {"Chief Complaint": "cough"}
+        assert row.plan["text"] == "Rest and fluids."
+        assert row.objective is None
+    finally:
+        db.close()
+
+
+def test_a_bad_note_fails_alone(clean_db):
+    batches = []
+    writer = NoteWriter(batch_size=100, max_delay_ms=200, after_commit=batches.append)
+    good = writer.submit(values(1))
+    bad = writer.submit(values(2, patient_name=None))
+    other = writer.submit(values(3))
+    with pytest.raises(IntegrityError):
+        bad.result(timeout=5)
+    assert good.result(timeout=5)["patient_id"] == "p1"
+    assert other.result(timeout=5)["patient_id"] == "p3"
+    assert [[note["patient_id"] for note in batch] for batch in batches] == [["p1", "p3"]]
+    assert stored_count() == 2
+
+
+def test_after_commit_errors_do_not_stop_the_writer(clean_db):
+    def broken(batch):
+        raise RuntimeError("index unavailable")
+
+    writer = NoteWriter(after_commit=broken)
+    assert writer.write(values(1))["patient_id"] == "p1"
+    assert writer.write(values(2))["patient_id"] == "p2"
+
+
+def test_awrite_waits_on_the_event_loop(clean_db):
+    writer = NoteWriter()
+
+    async def main():
+        return await asyncio.gather(writer.awrite(values(1)), writer.awrite(values(2)))
+
+    assert [note["patient_id"] for note in asyncio.run(main())] == ["p1", "p2"]
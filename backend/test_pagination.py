@@ -0,0 +1,101 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+from database import AsyncSessionLocal, SessionLocal
+from models import SoapNoteDB
+import pagination
+
+START = datetime(2024, 1, 1, 9, 0)
+
+
+def add_notes(count, same_time_every=1):
+    # Notes share a created_at in groups of ``same_time_every``, so ties are broken by id
+    db = SessionLocal()
+    try:
+        db.add_all([
+            SoapNoteDB(patient_id="p1", patient_name=f"Patient {i}", content=f"Note {i}",
+                       created_at=START + timedelta(minutes=i // same_time_every))
+            for i in range(count)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def list_notes(**kwargs):
+    async def run():
+        async with AsyncSessionLocal() as db:
+            return await pagination.list_notes(db, **kwargs)
+    return asyncio.run(run())
+
+
+def body(response):
+    return json.loads(response.body)
+
+
+def test_cursor_round_trip():
+    cursor = pagination.encode_cursor(START, 42)
+    assert "=" not in cursor
+    assert pagination.decode_cursor(cursor) == (START, 42)
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", "bm90LWEtY3Vyc29y", pagination.encode_cursor(START, 1)[:-3]])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        pagination.decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_pages_cover_every_note_once_newest_first(clean_db):
+    add_notes(7, same_time_every=3)
+    seen, cursor = [], None
+    while True:
+        response = list_notes(limit=3, cursor=cursor)
+        seen += [note["id"] for note in body(response)]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert len(seen) == 7
+    assert seen == [note["id"] for note in body(list_notes())]
+    assert seen == sorted(seen, reverse=True)
+
+
+def test_last_full_page_has_no_cursor(clean_db):
+    add_notes(4)
+    first = list_notes(limit=2)
+    second = list_notes(limit=2, cursor=first.headers["X-Next-Cursor"])
+    assert len(body(second)) == 2
+    assert "X-Next-Cursor" not in second.headers
+
+
+def test_unpaginated_listing_returns_everything(clean_db):
+    add_notes(pagination.DEFAULT_PAGE_SIZE + 5)
+    response = list_notes()
+    assert len(body(response)) == pagination.DEFAULT_PAGE_SIZE + 5
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_projection_keeps_key_fields_in_canonical_order(clean_db):
+    add_notes(1)
+    assert pagination.parse_fields("patient_name,plan") == ("id", "patient_name", "created_at", "plan")
+    note = body(list_notes(fields="patient_name"))[0]
+    assert list(note) == ["id", "patient_name", "created_at"]
+
+
+def test_compact_format(clean_db):
+    add_notes(3)
+    page = body(list_notes(fields="patient_name", limit=2, format="compact"))
+    assert page["fields"] == ["id", "patient_name", "created_at"]
+    assert [row[1] for row in page["rows"]] == ["Patient 2", "Patient 1"]
+    rest = body(list_notes(fields="patient_name", limit=2, cursor=page["next_cursor"], format="compact"))
+    assert [row[1] for row in rest["rows"]] == ["Patient 0"]
+    assert rest["next_cursor"] is None
+
+
+@pytest.mark.parametrize("kwargs", [{"fields": "id,password"}, {"format": "xml"}])
+def test_bad_arguments_are_rejected(kwargs):
+    with pytest.raises(HTTPException) as error:
+        list_notes(**kwargs)
+    assert error.value.status_code == 400
@@ -0,0 +1,114 @@
+import os
+import wave
+import numpy as np
+import pytest
+import ingest
+import preprocess
+
+RATE = preprocess.TARGET_SAMPLE_RATE
+
+
+@pytest.fixture(autouse=True)
+def wav_output(monkeypatch):
+    # Opus needs ffmpeg; WAV output keeps the tests self-contained
+    monkeypatch.setattr(preprocess, "AUDIO_ENCODING", "wav")
+
+
+def tone(seconds, rate, amplitude=0.5, frequency=220):
+    t = np.arange(int(seconds * rate)) / rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def silence(seconds, rate):
+    return np.zeros(int(seconds * rate), np.float32)
+
+
+def write_wav(path, samples, rate, channels=1):
+    pcm = (np.repeat(samples[:, None], channels, axis=1) * 32767).astype(np.int16)
+    with wave.open(path, "wb") as writer:
+        writer.setnchannels(channels)
+        writer.setsampwidth(2)
+        writer.setframerate(rate)
+        writer.writeframes(pcm.tobytes())
+
+
+def frame_energy(samples):
+    frame = int(RATE * preprocess.VAD_FRAME_SECONDS)
+    frames = len(samples) // frame
+    return np.sqrt(np.mean(samples[:frames * frame].reshape(frames, frame) ** 2, axis=1))
+
+
+@pytest.mark.parametrize("src_rate", [44100, 48000, 8000])
+def test_block_resampling_matches_one_shot(src_rate):
+    samples = tone(1.0, src_rate)
+    whole = preprocess.Resampler(src_rate).feed(samples)
+    streaming = preprocess.Resampler(src_rate)
+    blocks = np.concatenate([streaming.feed(block) for block in np.array_split(samples, 7)])
+    assert abs(len(whole) - RATE) <= 1
+    assert len(blocks) == len(whole)
+    assert np.allclose(blocks, whole, atol=1e-5)
+
+
+def test_resampling_at_the_target_rate_is_a_no_op():
+    samples = tone(0.1, RATE)
+    assert preprocess.Resampler(RATE).feed(samples) is samples
+
+
+def test_speech_segments_cut_long_pauses():
+    samples = np.concatenate([silence(1, RATE), tone(1, RATE), silence(3, RATE), tone(1, RATE), silence(1, RATE)])
+    segments = preprocess.speech_segments(frame_energy(samples), len(samples))
+    assert len(segments) == 2
+    padding = preprocess.VAD_PADDING_SECONDS * RATE
+    (first_start, first_end), (second_start, second_end) = segments
+    assert first_start == pytest.approx(RATE - padding, abs=0.05 * RATE)
+    assert first_end == pytest.approx(2 * RATE + padding, abs=0.05 * RATE)
+    assert second_start == pytest.approx(5 * RATE - padding, abs=0.05 * RATE)
+    assert second_end <= len(samples)
+
+
+def test_short_pauses_stay_in_one_segment():
+    samples = np.concatenate([tone(1, RATE), silence(0.5, RATE), tone(1, RATE)])
+    assert len(preprocess.speech_segments(frame_energy(samples), len(samples))) == 1
+
+
+def test_silence_has_no_speech():
+    samples = silence(2, RATE)
+    assert preprocess.speech_segments(frame_energy(samples), len(samples)) is None
+    assert preprocess.speech_segments(np.zeros(0, np.float32), 0) is None
+
+
+def test_preprocess_downmixes_resamples_and_trims(tmp_path):
+    path = str(tmp_path / "visit.wav")
+    samples = np.concatenate([silence(2, 44100), tone(1, 44100), silence(4, 44100), tone(1, 44100)])
+    write_wav(path, samples, 44100, channels=2)
+
+    processed, report = preprocess.preprocess(path)
+    try:
+        assert report["preprocessed"] and report["decoder"] == "wav"
+        assert (report["original_channels"], report["original_sample_rate"]) == (2, 44100)
+        assert report["original_seconds"] == pytest.approx(8, abs=0.01)
+        assert report["seconds_saved"] > 4
+        assert report["speech_segments"] == 2
+        with wave.open(processed, "rb") as reader:
+            assert (reader.getnchannels(), reader.getframerate()) == (1, RATE)
+            assert reader.getnframes() / RATE == pytest.approx(report["processed_seconds"], abs=0.01)
+    finally:
+        ingest.remove_file(processed)
+
+
+def test_recordings_without_savings_are_sent_unchanged(tmp_path):
+    path = str(tmp_path / "speech.wav")
+    write_wav(path, tone(3, RATE), RATE)
+    processed, report = preprocess.preprocess(path)
+    assert processed is None
+    assert report["reason"] == "no meaningful savings"
+
+
+def test_undecodable_audio_is_sent_unchanged(tmp_path, monkeypatch):
+    monkeypatch.setattr(preprocess, "FFMPEG", None)
+    path = str(tmp_path / "visit.webm")
+    with open(path, "wb") as f:
+        f.write(os.urandom(4096))
+    processed, report = preprocess.preprocess(path)
+    assert processed is None and not report["preprocessed"]
+    assert "ffmpeg is not installed" in report["reason"]
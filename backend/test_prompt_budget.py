@@ -0,0 +1,45 @@
+from prompt_budget import build_soap_prompt, trim_transcript
+
+DIALOGUE = (
+    "Thanks, doctor, the headache started three days ago. "
+    "Hi, I'm still taking metformin 500 mg twice a day. "
+    "Good morning, I've had some chest tightness since yesterday. "
+    "My wife says I've been wheezing at night. "
+    "I was stuck in traffic and felt short of breath. "
+    "He went to the ER on Friday."
+)
+
+
+def trim(text: str) -> str:
+    return trim_transcript(text, min_tokens=0, enabled=True)
+
+
+def test_trimming_is_off_by_default():
+    text = "Um, so, uh, the headache is worse."
+    assert trim_transcript(text, min_tokens=0) == text
+    _, usage = build_soap_prompt(text)
+    assert usage["trimmed_tokens"] == 0
+
+
+def test_sentences_opening_with_greetings_are_kept():
+    trimmed = trim(DIALOGUE)
+    for phrase in ("headache started three days ago", "metformin 500 mg twice a day", "chest tightness",
+                   "wheezing at night", "short of breath", "went to the ER on Friday"):
+        assert phrase in trimmed
+    assert trimmed == DIALOGUE
+
+
+def test_only_standalone_fillers_are_removed():
+    assert trim("Um, the pain, uh, is in my uhm left knee.") == "the pain, is in my left knee."
+    assert trim("Hmm I take it at night.") == "I take it at night."
+
+
+def test_fillers_match_case_sensitively_on_word_boundaries():
+    for text in ("Check the serum potassium.", "A 5 mm lesion.", "UM was the clinic code.",
+                 "Mhm, yes, every morning.", "The drum and the album."):
+        assert trim(text) == text
+
+
+def test_short_transcripts_are_untouched():
+    text = "Uh, the cough is better."
+    assert trim_transcript(text, min_tokens=1000, enabled=True) == text
@@ -0,0 +1,165 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+import admission
+import providers
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(providers, "RETRY_BASE_DELAY_SECONDS", 0)
+
+
+class ScriptedClient:
+    """Answers ``invoke``/``ainvoke`` after ``delay``, raising the scripted errors first."""
+
+    def __init__(self, answer, delay=0.0, errors=()):
+        self.answer = answer
+        self.delay = delay
+        self.errors = list(errors)
+        self.calls = 0
+        self.cancelled = False
+
+    def invoke(self, prompt):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(content=self.answer)
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(content=self.answer)
+
+
+def provider(name, client, retries=0):
+    return providers.Provider(name, client, retries=retries)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = providers.CircuitBreaker(failure_threshold=2, reset_seconds=30)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    breaker = providers.CircuitBreaker(failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    # A failed probe reopens the circuit; a successful one closes it
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_cancelled_probe_frees_the_half_open_slot():
+    breaker = providers.CircuitBreaker(failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_open_circuit_rejects_without_calling_the_client():
+    client = ScriptedClient("ok")
+    p = provider("test-open", client)
+    p.breaker = providers.CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    p.breaker.record_failure()
+    with pytest.raises(providers.CircuitOpen):
+        p.call("invoke", "prompt")
+    assert client.calls == 0
+    assert p.stats.snapshot()["rejected"] == 1
+
+
+def test_retries_until_the_client_answers():
+    client = ScriptedClient("ok", errors=[RuntimeError("blip"), RuntimeError("blip")])
+    p = provider("test-retry", client, retries=2)
+    assert p.call("invoke", "prompt").content == "ok"
+    stats = p.stats.snapshot()
+    assert (stats["calls"], stats["retries"], stats["errors"]) == (1, 2, 2)
+    assert p.breaker.failures == 0
+
+
+def test_fallback_after_a_failure():
+    first = provider("test-fail", ScriptedClient("no", errors=[RuntimeError("down")]))
+    second = provider("test-backup", ScriptedClient("backup"))
+    result, answered = providers.call_with_fallback([first, second], "invoke", ("prompt",), timeout=5,
+                                                    hedge_after=0, kind="LLM")
+    assert result.content == "backup"
+    assert answered is second
+
+
+def test_slow_provider_is_hedged():
+    slow = provider("test-slow", ScriptedClient("slow", delay=1.0))
+    fast = provider("test-fast", ScriptedClient("fast"))
+    started = time.monotonic()
+    result, answered = providers.call_with_fallback([slow, fast], "invoke", ("prompt",), timeout=5,
+                                                    hedge_after=0.05, kind="LLM")
+    assert result.content == "fast" and answered is fast
+    assert time.monotonic() - started < 0.5
+    assert fast.stats.snapshot()["hedge_wins"] == 1
+
+
+def test_deadline_covers_every_provider():
+    slow = provider("test-deadline", ScriptedClient("late", delay=0.5))
+    with pytest.raises(TimeoutError):
+        providers.call_with_fallback([slow], "invoke", ("prompt",), timeout=0.1, hedge_after=0, kind="LLM")
+
+
+def test_every_provider_failing_is_unavailable():
+    failing = [provider(f"test-down-{i}", ScriptedClient("no", errors=[RuntimeError(f"down {i}")])) for i in range(2)]
+    with pytest.raises(providers.ProviderUnavailable, match="down 0.*down 1"):
+        providers.call_with_fallback(failing, "invoke", ("prompt",), timeout=5, hedge_after=0, kind="LLM")
+
+
+def test_every_provider_saturated_is_overloaded():
+    busy = [provider(f"test-busy-{i}", ScriptedClient("no", errors=[admission.Overloaded("full", 2 + i)]))
+            for i in range(2)]
+    with pytest.raises(admission.Overloaded) as error:
+        providers.call_with_fallback(busy, "invoke", ("prompt",), timeout=5, hedge_after=0, kind="LLM")
+    assert error.value.retry_after == 2
+
+
+def test_async_hedge_cancels_the_loser():
+    slow_client = ScriptedClient("slow", delay=1.0)
+    slow = provider("test-aslow", slow_client)
+    fast = provider("test-afast", ScriptedClient("fast"))
+
+    async def run():
+        return await providers.acall_with_fallback([slow, fast], "ainvoke", ("prompt",), timeout=5,
+                                                   hedge_after=0.05, kind="LLM")
+
+    result, answered = asyncio.run(run())
+    assert result.content == "fast" and answered is fast
+    assert slow_client.cancelled
+    # Cancellation is not a failure of the slow provider
+    assert slow.breaker.failures == 0
+
+
+def test_resilient_llm_reports_the_answering_model():
+    llm = providers.ResilientLLM([provider("test-m1", ScriptedClient("no", errors=[RuntimeError("down")])),
+                                  providers.Provider("test-m2", ScriptedClient("yes"), model="model-2")],
+                                 timeout=5, hedge_after=0)
+    message, model = llm.invoke_with_model("prompt")
+    assert (message.content, model) == ("yes", "model-2")
+
+
+def test_stub_output_is_never_real():
+    with pytest.raises(providers.ProviderUnavailable):
+        providers.real_content(SimpleNamespace(content=providers.STUB_RESPONSE))
+    with pytest.raises(providers.ProviderUnavailable):
+        providers.real_transcript(SimpleNamespace(text=providers.STUB_TRANSCRIPT))
+    assert providers.real_content(SimpleNamespace(content="S: ...")) == "S: ..."
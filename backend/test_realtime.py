@@ -0,0 +1,95 @@
+import asyncio
+from fastapi import WebSocketDisconnect
+import realtime
+
+FRAME = b"\0" * 640
+
+
+class FakeWebSocket:
+    """Scripted client: hands out ``incoming`` messages, records what the server sends."""
+
+    def __init__(self, incoming, disconnect_on_stop=False):
+        self.incoming = list(incoming)
+        self.disconnect_on_stop = disconnect_on_stop
+        self.disconnected = False
+        self.sent = []
+        self.close_code = None
+
+    async def receive(self):
+        message = self.incoming.pop(0)
+        if self.disconnect_on_stop and message.get("text") == '{"type": "stop"}':
+            self.disconnected = True
+        return message
+
+    async def send_json(self, message):
+        if self.disconnected:
+            raise WebSocketDisconnect(1001)
+        self.sent.append(message)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+def frames(count):
+    return [{"type": "websocket.receive", "bytes": FRAME} for _ in range(count)]
+
+
+def text(message):
+    return {"type": "websocket.receive", "text": message}
+
+
+def run_session(websocket, finalized):
+    async def draft(transcript):
+        return "draft"
+
+    async def finalize(transcript):
+        finalized.append(transcript)
+        return f"NOTE: {transcript}"
+
+    transcriber = realtime.FakeStreamingTranscriber(["Chest pain.", "No allergies."], frames_per_segment=2)
+    session = realtime.RealtimeSession(transcriber, draft, draft_interval=3600)
+
+    async def main():
+        await asyncio.wait_for(realtime.serve(websocket, session, finalize), timeout=5)
+
+    asyncio.run(main())
+    return transcriber
+
+
+def test_stop_sends_segments_then_the_final_note():
+    websocket = FakeWebSocket(frames(4) + [text('{"type": "stop"}')])
+    finalized = []
+    run_session(websocket, finalized)
+
+    finals = [m["text"] for m in websocket.sent if m["type"] == "final"]
+    assert finals == ["Chest pain.", "No allergies."]
+    assert websocket.sent[-1] == {"type": "complete", "transcript": "Chest pain. No allergies.",
+                                  "soap_note": "NOTE: Chest pain. No allergies."}
+    assert finalized == ["Chest pain. No allergies."]
+    assert websocket.close_code == 1000
+
+
+def test_non_json_text_frames_are_ignored():
+    websocket = FakeWebSocket(frames(2) + [text("hello"), text("[1, 2]"), text('{"type": "ping"}')]
+                              + frames(2) + [text('{"type": "stop"}')])
+    run_session(websocket, [])
+    assert websocket.sent[-1]["type"] == "complete"
+    assert websocket.sent[-1]["transcript"] == "Chest pain. No allergies."
+
+
+def test_client_disconnect_ends_the_session():
+    websocket = FakeWebSocket(frames(2) + [{"type": "websocket.disconnect", "code": 1001}])
+    finalized = []
+    transcriber = run_session(websocket, finalized)
+    assert finalized == []
+    # The transcriber was closed by session.finish()
+    assert transcriber._callbacks is None
+
+
+def test_disconnect_after_stop_does_not_hang_the_flush():
+    # Segments are still queued when the client goes away, so forwarding them fails
+    websocket = FakeWebSocket(frames(4) + [text('{"type": "stop"}')], disconnect_on_stop=True)
+    finalized = []
+    run_session(websocket, finalized)
+    assert finalized == []
+    assert not any(m["type"] == "complete" for m in websocket.sent)
@@ -0,0 +1,89 @@
+import asyncio
+from database import AsyncSessionLocal, SessionLocal
+from models import SoapNoteDB
+import search
+
+
+def add_note(patient_id, patient_name, content):
+    db = SessionLocal()
+    try:
+        note = SoapNoteDB(patient_id=patient_id, patient_name=patient_name, content=content)
+        db.add(note)
+        db.commit()
+        return note.id
+    finally:
+        db.close()
+
+
+def run_search(query, like=False, **kwargs):
+    async def run():
+        async with AsyncSessionLocal() as db:
+            if like:
+                params = {"limit": kwargs.get("limit", 20), "offset": 0}
+                if kwargs.get("patient_id"):
+                    params["patient_id"] = kwargs["patient_id"]
+                return await search._like_search(db, query, params)
+            return await search.search_notes(db, query, **kwargs)
+    return asyncio.run(run())
+
+
+def test_fts5_query_quotes_user_input():
+    assert search.fts5_query('chest OR "shortness of breath" NEAR(') == '"chest" "OR" "shortness of breath" "NEAR("'
+    assert search.fts5_query('say "hi') == '"say" """hi"'
+
+
+def test_like_pattern_escapes_wildcards():
+    assert search.like_pattern("50%_a!") == "%50!%!_a!!%"
+
+
+def test_ranked_results_with_highlighted_snippets(clean_db):
+    chest = add_note("p1", "Ann Lee", "Patient reports chest pain radiating to the left arm.")
+    add_note("p2", "Bob Ray", "Follow-up for knee pain after a fall.")
+    results = run_search("chest pain")
+    assert [r["id"] for r in results] == [chest]
+    assert "<mark>chest</mark> <mark>pain</mark>" in results[0]["snippet"]
+    assert results[0]["rank"] > 0
+
+
+def test_patient_name_matches_and_patient_filter(clean_db):
+    add_note("p1", "Ann Lee", "Routine visit.")
+    other = add_note("p2", "Bob Ray", "Ann mentioned her sister.")
+    assert {r["patient_id"] for r in run_search("Ann")} == {"p1", "p2"}
+    assert [r["id"] for r in run_search("Ann", patient_id="p2")] == [other]
+
+
+def test_fts_syntax_in_queries_is_harmless(clean_db):
+    add_note("p1", "Ann Lee", "Cough and fever near the weekend.")
+    # Operators and stray quotes are searched as plain words instead of raising a syntax error
+    assert len(run_search("fever NEAR(")) == 1
+    assert len(run_search("cough AND")) == 1
+    assert run_search('"unclosed') == []
+
+
+def test_deleted_notes_leave_the_index(clean_db):
+    note_id = add_note("p1", "Ann Lee", "Wheezing at night.")
+    db = SessionLocal()
+    try:
+        db.query(SoapNoteDB).filter(SoapNoteDB.id == note_id).delete()
+        db.commit()
+    finally:
+        db.close()
+    assert run_search("wheezing") == []
+
+
+def test_snippets_escape_note_html(clean_db):
+    add_note("p1", "Ann Lee", "Rash <script>alert(1)</script> on the arm & hand.")
+    snippet = run_search("rash")[0]["snippet"]
+    assert "<script>" not in snippet
+    assert "&lt;script&gt;" in snippet and "&amp;" in snippet
+    assert snippet.startswith("<mark>Rash</mark>")
+
+
+def test_like_fallback_matches_every_term(clean_db):
+    add_note("p1", "Ann Lee", "Chest pain <b>worse</b> on exertion.")
+    add_note("p2", "Bob Ray", "Chest is clear.")
+    results = run_search("chest worse", like=True)
+    assert [r["patient_id"] for r in results] == ["p1"]
+    assert results[0]["rank"] is None
+    assert "<mark>Chest</mark>" in results[0]["snippet"]
+    assert "<mark>&lt;b&gt;worse&lt;/b&gt;</mark>" in results[0]["snippet"]
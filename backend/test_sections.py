@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+import pytest
+from database import SessionLocal
+from models import SoapNoteDB
+import sections
+
+NOTE = """SOAP Note - 12 March 2024
+Provider: Dr. Lee
+
+**Subjective:**
+• Chief Complaint: Chest pain for two days
+• History of Present Illness:
+  Pain is worse on exertion.
+  No radiation.
+
+## OBJECTIVE
+- **Vital Signs:** BP 130/85, HR 88
+
+Assessment:
+Likely musculoskeletal chest pain.
+
+Differential Diagnosis:
+1. Angina
+
+PLAN
+• Follow-up: one week
+"""
+
+
+def test_headings_split_the_note_into_sections():
+    parsed = sections.parse_note(NOTE)
+    assert list(parsed) == ["subjective", "objective", "assessment", "plan"]
+    assert "Provider" not in parsed["subjective"]["text"]
+    assert parsed["objective"]["text"] == "- **Vital Signs:** BP 130/85, HR 88"
+
+
+def test_subsections_collect_their_continuation_lines():
+    subjective = sections.parse_note(NOTE)["subjective"]["subsections"]
+    assert subjective == {
+        "Chief Complaint": "Chest pain for two days",
+        "History of Present Illness": "Pain is worse on exertion.\nNo radiation.",
+    }
+    assert sections.parse_note(NOTE)["objective"]["subsections"] == {"Vital Signs": "BP 130/85, HR 88"}
+
+
+def test_folded_headings_stay_visible_in_their_section():
+    assessment = sections.parse_note(NOTE)["assessment"]["text"]
+    assert assessment == "Likely musculoskeletal chest pain.\n\nDifferential Diagnosis:\n1. Angina"
+
+
+def test_unstructured_notes_store_null_sections():
+    assert sections.section_columns("Patient seen, no complaints.") == dict.fromkeys(sections.SECTION_FIELDS)
+    assert sections.parse_note(None) == {}
+
+
+def test_heading_words_inside_sentences_are_not_headings():
+    parsed = sections.parse_note("Subjective:\nThe plan is to review the assessment.\nPlan of care discussed.")
+    assert list(parsed) == ["subjective"]
+
+
+def test_parse_sections_validates_and_orders():
+    assert sections.parse_sections(None) is None
+    assert sections.parse_sections("plan, Subjective") == ("subjective", "plan")
+    with pytest.raises(ValueError, match="history"):
+        sections.parse_sections("plan,history")
+
+
+def test_render_sections_falls_back_to_the_full_note():
+    note = SimpleNamespace(content=NOTE, **sections.section_columns(NOTE))
+    assert sections.render_sections(note, ("plan",)) == "PLAN:\n• Follow-up: one week"
+    legacy = SimpleNamespace(content="Free text note", **dict.fromkeys(sections.SECTION_FIELDS))
+    assert sections.render_sections(legacy, ("plan",)) == "Free text note"
+
+
+def test_backfill_parses_notes_stored_without_sections(clean_db):
+    db = SessionLocal()
+    try:
+        db.add_all([SoapNoteDB(patient_id="p1", patient_name="Ann", content=NOTE),
+                    SoapNoteDB(patient_id="p2", patient_name="Bob", content="No headings here.")])
+        db.commit()
+    finally:
+        db.close()
+    assert sections.backfill_sections(batch_size=1) == 1
+    db = SessionLocal()
+    try:
+        rows = {row.patient_id: row for row in db.query(SoapNoteDB)}
+        assert rows["p1"].plan["text"] == "• Follow-up: one week"
+        assert rows["p2"].plan is None
+    finally:
+        db.close()
@@ -0,0 +1,110 @@
+import asyncio
+import pytest
+from database import AsyncSessionLocal, SessionLocal
+from models import SoapNoteDB
+import sections
+import similar
+
+NOTES = {
+    1: ("p1", "Assessment:\nAcute asthma exacerbation with wheezing and shortness of breath."),
+    2: ("p2", "Assessment:\nAsthma exacerbation, wheezing at night, shortness of breath on exertion."),
+    3: ("p3", "Assessment:\nSprained left ankle after a fall, swelling and bruising."),
+    4: ("p1", "Assessment:\nAsthma follow-up, wheezing improved."),
+}
+
+
+@pytest.fixture
+def index(clean_db, tmp_path, monkeypatch):
+    index = similar.SimilarityIndex(str(tmp_path), dim=256)
+    monkeypatch.setattr(similar, "index", index)
+    return index
+
+
+def add_notes(*note_ids):
+    db = SessionLocal()
+    try:
+        for note_id in note_ids:
+            patient_id, content = NOTES[note_id]
+            db.add(SoapNoteDB(id=note_id, patient_id=patient_id, patient_name=patient_id, content=content,
+                              **sections.section_columns(content)))
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_sync_indexes_new_notes_once(index):
+    add_notes(1, 2, 3)
+    assert index.sync() == 3
+    assert index.sync() == 0
+    assert (index.count, index.last_note_id) == (3, 3)
+    add_notes(4)
+    assert index.sync() == 1 and index.count == 4
+
+
+def test_nearest_notes_rank_first(index):
+    add_notes(1, 2, 3)
+    index.sync()
+    hits = index.search(index.vector_for(1), k=3, exclude_ids={1})
+    assert [note_id for note_id, _ in hits][0] == 2
+    assert all(note_id != 1 for note_id, _ in hits)
+    assert index.search(index.embed("ankle swelling after a fall"), k=1)[0][0] == 3
+
+
+def test_index_is_reopened_from_disk(index, tmp_path):
+    add_notes(1, 2)
+    index.sync()
+    reopened = similar.SimilarityIndex(str(tmp_path), dim=256)
+    assert (reopened.count, reopened.last_note_id) == (2, 2)
+    assert reopened.search(reopened.vector_for(2), k=1) == index.search(index.vector_for(2), k=1)
+    # A different feature space starts over instead of mixing rows
+    assert similar.SimilarityIndex(str(tmp_path), dim=128).count == 0
+
+
+def test_notes_committed_below_the_watermark_are_picked_up(index, tmp_path):
+    add_notes(1, 3)
+    index.sync()
+    assert [gap[:2] for gap in index.gaps] == [(2, 2)]
+    add_notes(2)
+    assert index.sync() == 1
+    assert index.gaps == [] and index.count == 3
+    assert index.vector_for(2) is not None
+    assert similar.SimilarityIndex(str(tmp_path), dim=256).gaps == []
+
+
+def test_expired_gaps_are_forgotten(index, monkeypatch):
+    add_notes(1, 3)
+    index.sync()
+    monkeypatch.setattr(similar, "SIMILAR_GAP_SECONDS", 0)
+    add_notes(2)
+    assert index.sync() == 0
+    assert index.gaps == []
+
+
+def test_gap_helpers():
+    assert similar.gaps_between(0, [1, 4, 5, 9], 7.0) == [(2, 3, 7.0), (6, 8, 7.0)]
+    assert similar.without_ids([(2, 6, 7.0)], {2, 4}) == [(3, 3, 7.0), (5, 6, 7.0)]
+    assert similar.without_ids([(2, 3, 7.0)], {2, 3}) == []
+
+
+def test_rebuild_reindexes_everything(index):
+    add_notes(1, 2)
+    index.sync()
+    generation = index.generation
+    add_notes(3)
+    assert index.rebuild() == 3
+    assert index.count == 3 and index.generation != generation
+
+
+def test_find_similar_skips_the_same_patient(index):
+    add_notes(1, 2, 3, 4)
+
+    async def run(**kwargs):
+        async with AsyncSessionLocal() as db:
+            return await similar.find_similar(db, **kwargs)
+
+    results = asyncio.run(run(note_id=1, k=2))
+    assert [result["patient_id"] for result in results][0] == "p2"
+    assert all(result["patient_id"] != "p1" for result in results)
+    assert results[0]["assessment"].startswith("Asthma exacerbation")
+    assert asyncio.run(run(note_id=99)) is None
+    assert asyncio.run(run(text="sprained ankle", k=1))[0]["id"] == 3
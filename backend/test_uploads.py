@@ -0,0 +1,147 @@
+import asyncio
+import base64
+import hashlib
+import os
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import update
+from starlette.requests import ClientDisconnect
+from database import AsyncSessionLocal
+from models import UploadDB
+import uploads
+
+
+def run(step):
+    async def main():
+        async with AsyncSessionLocal() as db:
+            return await step(db)
+    return asyncio.run(main())
+
+
+async def body(*chunks, disconnect=False):
+    for chunk in chunks:
+        yield chunk
+    if disconnect:
+        raise ClientDisconnect()
+
+
+def checksum(data: bytes, algorithm="sha256"):
+    return uploads.parse_checksum(f"{algorithm} {base64.b64encode(hashlib.new(algorithm, data).digest()).decode()}")
+
+
+def staged(upload_id):
+    with open(uploads.staging_path(upload_id), "rb") as f:
+        return f.read()
+
+
+def status_of(call, *args):
+    with pytest.raises(HTTPException) as error:
+        call(*args)
+    return error.value.status_code
+
+
+def new_upload(length=10):
+    return run(lambda db: uploads.create_upload(db, length, "en", filename="visit.wav"))
+
+
+def append(upload_id, offset, chunks, checksum=None):
+    async def step(db):
+        upload = await uploads.get_upload(db, upload_id)
+        return await uploads.append_chunk(db, upload, offset, chunks, checksum)
+    return run(step)
+
+
+def test_chunks_append_at_the_current_offset(clean_db):
+    upload = new_upload()
+    assert upload.upload_offset == 0 and staged(upload.id) == b""
+    assert append(upload.id, 0, body(b"abc", b"de")) == 5
+    assert append(upload.id, 5, body(b"fghij"), checksum(b"fghij")) == 10
+    assert staged(upload.id) == b"abcdefghij"
+    assert run(lambda db: uploads.get_upload(db, upload.id)).upload_offset == 10
+
+
+@pytest.mark.parametrize("length", [0, -1])
+def test_invalid_lengths_are_rejected(clean_db, length):
+    assert status_of(run, lambda db: uploads.create_upload(db, length, "en")) == 400
+
+
+def test_oversized_uploads_are_rejected(clean_db, monkeypatch):
+    monkeypatch.setattr(uploads.ingest, "MAX_UPLOAD_BYTES", 5)
+    assert status_of(run, lambda db: uploads.create_upload(db, 6, "en")) == 413
+
+
+def test_stale_offset_conflicts(clean_db):
+    upload = new_upload()
+    append(upload.id, 0, body(b"abc"))
+    assert status_of(append, upload.id, 0, body(b"abc")) == 409
+
+
+def test_chunk_past_the_length_is_dropped(clean_db):
+    upload = new_upload(4)
+    assert status_of(append, upload.id, 0, body(b"abc", b"de")) == 413
+    assert staged(upload.id) == b""
+    assert run(lambda db: uploads.get_upload(db, upload.id)).upload_offset == 0
+
+
+def test_checksum_mismatch_keeps_the_old_offset(clean_db):
+    upload = new_upload()
+    append(upload.id, 0, body(b"abc"))
+    assert status_of(append, upload.id, 3, body(b"xyz"), checksum(b"def", "md5")) == uploads.CHECKSUM_MISMATCH
+    assert staged(upload.id) == b"abc"
+
+
+def test_disconnect_keeps_unchecked_bytes_only(clean_db):
+    upload = new_upload()
+    with pytest.raises(ClientDisconnect):
+        append(upload.id, 0, body(b"abc", disconnect=True))
+    assert run(lambda db: uploads.get_upload(db, upload.id)).upload_offset == 3
+    with pytest.raises(ClientDisconnect):
+        append(upload.id, 3, body(b"def", disconnect=True), checksum(b"defgh"))
+    assert run(lambda db: uploads.get_upload(db, upload.id)).upload_offset == 3
+    assert staged(upload.id) == b"abc"
+
+
+def test_finalize_needs_every_byte_and_happens_once(clean_db):
+    upload = new_upload(3)
+    append(upload.id, 0, body(b"ab"))
+
+    async def claim(db):
+        return await uploads.claim_for_finalize(db, await uploads.get_upload(db, upload.id))
+    assert status_of(run, claim) == 409
+    append(upload.id, 2, body(b"c"))
+    assert run(claim) is True
+    assert run(claim) is False
+    assert run(lambda db: uploads.get_upload(db, upload.id)).status == "finalizing"
+
+
+def test_finalized_uploads_take_no_more_chunks(clean_db):
+    upload = new_upload(3)
+    append(upload.id, 0, body(b"abc"))
+
+    async def finalize_then_append(db):
+        upload_row = await uploads.get_upload(db, upload.id)
+        await uploads.claim_for_finalize(db, upload_row)
+        return await uploads.append_chunk(db, upload_row, 3, body(b"d"))
+    assert status_of(run, finalize_then_append) == 409
+
+
+def test_expired_uploads_are_gone_and_purged(clean_db):
+    upload = new_upload()
+
+    async def expire(db):
+        await db.execute(update(UploadDB).where(UploadDB.id == upload.id)
+                         .values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+        await db.commit()
+    run(expire)
+    assert status_of(run, lambda db: uploads.get_upload(db, upload.id)) == 410
+    assert uploads.purge_expired() == 1
+    assert not os.path.exists(uploads.staging_path(upload.id))
+    assert status_of(run, lambda db: uploads.get_upload(db, upload.id)) == 404
+
+
+@pytest.mark.parametrize("header", ["sha256", "sha256 not-base64!", "crc32 AAAA"])
+def test_malformed_checksums_are_rejected(header):
+    with pytest.raises(HTTPException) as error:
+        uploads.parse_checksum(header)
+    assert error.value.status_code == 400
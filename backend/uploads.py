@@ -0,0 +1,229 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.orm.attributes import set_committed_value
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+from database import SessionLocal
+from models import UploadDB
+import ingest
+
+load_dotenv()
+
+TUS_VERSION = "1.0.0"
+# Unfinished uploads (and their staged bytes) are dropped after this long without being finalized
+UPLOAD_EXPIRY_SECONDS = int(os.getenv("UPLOAD_EXPIRY_SECONDS", str(24 * 3600)))
+CHECKSUM_ALGORITHMS = ("md5", "sha1", "sha256")
+# Not a standard HTTP status; the tus checksum extension uses it for a corrupted chunk
+CHECKSUM_MISMATCH = 460
+
+# One append at a time per upload in this process; the offset check in the database covers other workers
+_append_locks = {}
+
+
+def staging_path(upload_id: str) -> str:
+    return os.path.join(ingest.UPLOAD_DIR, f"soap_upload_{upload_id}.part")
+
+
+def upload_headers(upload: UploadDB) -> dict:
+    headers = {
+        "Tus-Resumable": TUS_VERSION,
+        "Upload-Offset": str(upload.upload_offset),
+        "Upload-Length": str(upload.upload_length),
+        "Cache-Control": "no-store",
+    }
+    if upload.expires_at is not None and upload.status == "uploading":
+        headers["Upload-Expires"] = format_datetime(upload.expires_at.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+
+def upload_to_dict(upload: UploadDB) -> dict:
+    return {
+        "upload_id": upload.id,
+        "filename": upload.filename,
+        "language": upload.language,
+        "prompt_version": upload.prompt_version,
+        "upload_length": upload.upload_length,
+        "upload_offset": upload.upload_offset,
+        "status": upload.status,
+        "job_id": upload.job_id,
+        "created_at": upload.created_at,
+        "expires_at": upload.expires_at,
+    }
+
+
+def parse_checksum(header):
+    """Parse ``Upload-Checksum: <algorithm> <base64 digest>``; None when absent."""
+    if not header:
+        return None
+    try:
+        algorithm, encoded = header.strip().split(" ", 1)
+        digest = base64.b64decode(encoded.strip(), validate=True)
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Upload-Checksum must be '<algorithm> <base64 digest>'")
+    algorithm = algorithm.lower()
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise HTTPException(status_code=400,
+                            detail=f"Unsupported checksum algorithm; expected one of {', '.join(CHECKSUM_ALGORITHMS)}")
+    return algorithm, digest
+
+
+async def create_upload(db, length: int, language: str, filename: str = None,
+                        prompt_version: str = None) -> UploadDB:
+    if length <= 0:
+        raise HTTPException(status_code=400, detail="Upload-Length must be a positive number of bytes")
+    if length > ingest.MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {ingest.MAX_UPLOAD_BYTES} bytes")
+    upload = UploadDB(
+        id=uuid.uuid4().hex, filename=filename, language=language, prompt_version=prompt_version,
+        upload_length=length, upload_offset=0, status="uploading",
+        expires_at=datetime.utcnow() + timedelta(seconds=UPLOAD_EXPIRY_SECONDS),
+    )
+    # Empty staging file up front, so every append opens an existing file at its offset
+    open(staging_path(upload.id), "wb").close()
+    db.add(upload)
+    await db.commit()
+    await db.refresh(upload)
+    return upload
+
+
+async def get_upload(db, upload_id: str) -> UploadDB:
+    upload = await db.get(UploadDB, upload_id, populate_existing=True)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if upload.status == "uploading" and upload.expires_at is not None and upload.expires_at < datetime.utcnow():
+        raise HTTPException(status_code=410, detail="Upload expired")
+    return upload
+
+
+def _write_chunk(f, chunk: bytes):
+    f.write(chunk)
+
+
+def _sync_and_close(f, truncate_to=None):
+    if truncate_to is not None:
+        f.truncate(truncate_to)
+    f.flush()
+    # The offset is only advanced once the bytes behind it are on disk
+    os.fsync(f.fileno())
+    f.close()
+
+
+async def append_chunk(db, upload: UploadDB, offset: int, chunks, checksum=None) -> int:
+    """Append a request body at ``offset`` and return the new offset.
+
+    The body is written as it arrives, one network chunk in memory at a time.
+    A chunk with a checksum is kept only if it verifies; without one, bytes
+    received before a dropped connection are kept so the client can resume
+    from there.
+    """
+    if upload.status != "uploading":
+        raise HTTPException(status_code=409, detail=f"Upload is {upload.status}")
+    lock = _append_locks.setdefault(upload.id, asyncio.Lock())
+    if lock.locked():
+        raise HTTPException(status_code=409, detail="Another chunk is being appended to this upload")
+    async with lock:
+        try:
+            if offset != upload.upload_offset:
+                raise HTTPException(status_code=409,
+                                    detail=f"Upload-Offset {offset} does not match current offset {upload.upload_offset}")
+            hasher = hashlib.new(checksum[0]) if checksum else None
+            written = 0
+            keep = True
+            f = await run_in_threadpool(open, staging_path(upload.id), "r+b")
+            try:
+                f.seek(offset)
+                async for chunk in chunks:
+                    if offset + written + len(chunk) > upload.upload_length:
+                        keep = False
+                        raise HTTPException(status_code=413, detail="Chunk extends past Upload-Length")
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    await run_in_threadpool(_write_chunk, f, chunk)
+                    written += len(chunk)
+                if hasher is not None and hasher.digest() != checksum[1]:
+                    keep = False
+                    raise HTTPException(status_code=CHECKSUM_MISMATCH, detail="Upload-Checksum does not match the chunk")
+            except ClientDisconnect:
+                # Partial bytes cannot be verified against a checksum for the whole chunk
+                keep = hasher is None
+                raise
+            finally:
+                # Everything past the new offset is dropped, so a retry overwrites a clean tail
+                new_offset = offset + written if keep else offset
+                await run_in_threadpool(_sync_and_close, f, new_offset)
+                if new_offset != offset:
+                    result = await db.execute(
+                        update(UploadDB)
+                        .where(UploadDB.id == upload.id, UploadDB.upload_offset == offset)
+                        .values(upload_offset=new_offset, updated_at=datetime.utcnow())
+                    )
+                    await db.commit()
+                    if result.rowcount == 0:
+                        raise HTTPException(status_code=409, detail="Upload was modified concurrently")
+                    set_committed_value(upload, "upload_offset", new_offset)
+            return new_offset
+        finally:
+            _append_locks.pop(upload.id, None)
+
+
+async def claim_for_finalize(db, upload: UploadDB) -> bool:
+    """Move a complete upload out of ``uploading``; False if another request already did."""
+    if upload.upload_offset != upload.upload_length:
+        raise HTTPException(status_code=409,
+                            detail=f"Upload incomplete: {upload.upload_offset} of {upload.upload_length} bytes received")
+    result = await db.execute(
+        update(UploadDB).where(UploadDB.id == upload.id, UploadDB.status == "uploading")
+        .values(status="finalizing", updated_at=datetime.utcnow())
+    )
+    await db.commit()
+    if result.rowcount == 1:
+        set_committed_value(upload, "status", "finalizing")
+    return result.rowcount == 1
+
+
+async def set_status(db, upload: UploadDB, status: str, job_id: str = None):
+    await db.execute(
+        update(UploadDB).where(UploadDB.id == upload.id)
+        .values(status=status, job_id=job_id, updated_at=datetime.utcnow())
+    )
+    await db.commit()
+    set_committed_value(upload, "status", status)
+    set_committed_value(upload, "job_id", job_id)
+
+
+async def delete_upload(db, upload: UploadDB):
+    if upload.status != "uploading":
+        raise HTTPException(status_code=409, detail=f"Upload is {upload.status}")
+    await db.delete(upload)
+    await db.commit()
+    ingest.remove_file(staging_path(upload.id))
+
+
+def purge_expired(batch_size: int = 100) -> int:
+    """Remove unfinished uploads past their expiry; returns how many were dropped."""
+    db = SessionLocal()
+    removed = 0
+    try:
+        while True:
+            rows = db.execute(
+                select(UploadDB).where(UploadDB.status == "uploading", UploadDB.expires_at < datetime.utcnow())
+                .limit(batch_size)
+            ).scalars().all()
+            if not rows:
+                return removed
+            for upload in rows:
+                ingest.remove_file(staging_path(upload.id))
+                db.delete(upload)
+            db.commit()
+            removed += len(rows)
+    finally:
+        db.close()